@@ -1,34 +1,74 @@
-import streamlit as st
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import base64
-import customer
+import importlib
+import os
+import threading
+
+import streamlit as st
+import data_loader
+import filters
+import incremental
+import kpi
+import perf
+import shared
+import store
+import streaming
+import transactions
 
 # Set page layout to wide
 st.set_page_config(layout="wide")
 
-# Load your data
-df = pd.read_excel("coffee_shop.xlsx")
-df2 = pd.read_csv('New_data.csv')
+# Data is loaded by the pages that use it (parsed once per process, then served
+# as shared read-only tables) plus any new transaction batches dropped into the
+# incoming folder. By default the parsed tables come memory-mapped from the
+# compact store (store.py), shared by every app process on the machine.
+if streaming.ENABLED:
+    load_table = streaming.load_table
+elif store.ENABLED:
+    load_table = store.load_table
+else:
+    load_table = transactions.load_table
+
+
+def _load(path):
+    return incremental.load_table(path, load_table)
+
+
+# One table per source for all sessions; a session that finds the data
+# changed rebuilds it while the others keep reading the current one
+def transactions_table():
+    with perf.stage('load_data', path=data_loader.TRANSACTIONS_PATH):
+        return shared.get_table(data_loader.TRANSACTIONS_PATH, _load)
+
+
+def new_data_table():
+    with perf.stage('load_data', path=data_loader.NEW_DATA_PATH):
+        return shared.get_table(data_loader.NEW_DATA_PATH, _load)
 
-# Function to load and encode images
+
+# Images under static/ are served by Streamlit (enableStaticServing in
+# .streamlit/config.toml), so the browser caches them across reruns
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+@st.cache_resource
 def get_base64(file_path):
     with open(file_path, 'rb') as f:
         data = f.read()
     return base64.b64encode(data).decode()
 
-# Encode background image and pie chart
-background_image_path = 'background.png'
-pie_chart_path = 'pie chart.png'
-background_image_base64 = get_base64(background_image_path)
-pie_chart_base64 = get_base64(pie_chart_path)
+
+def static_url(name):
+    if st.get_option("server.enableStaticServing"):
+        return f"app/static/{name}"
+    # Static serving is off (e.g. another config): inline it, encoded once per process
+    return f"data:image/jpg;base64,{get_base64(os.path.join(STATIC_DIR, name))}"
+
 
 # CSS to set background image
 background_image_style = f"""
 <style>
     .stApp {{
-        background-image: url("data:image/jpg;base64,{background_image_base64}");
+        background-image: url("{static_url('background.png')}");
         background-size: cover;
         background-position: center;
     }}
@@ -75,22 +115,6 @@ st.markdown(
 )
 
 
-
-def top_product_categories(df):
-    top_products = df.groupby(['store_location', 'product_detail', 'unit_price'])['transaction_qty'].sum().reset_index()
-    top_products_by_location = top_products.loc[top_products.groupby('store_location')['transaction_qty'].idxmax()]
-    top_products_by_location = top_products_by_location.sort_values('transaction_qty', ascending=False)
-
-    # Create the bar plot
-    plt.figure(figsize=(16, 10))
-    sns.barplot(data=top_products_by_location, x='store_location', y='transaction_qty', hue='product_detail')
-    plt.title('Highest Selling Products by Location')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    # Display the plot in Streamlit
-    st.pyplot()
-
 def main():
     # Sidebar Navigation with larger header and improved styling
     st.sidebar.markdown(
@@ -99,13 +123,78 @@ def main():
         """,
         unsafe_allow_html=True
     )
+    pages = ["🏠 Home", "🛍 Customer Behaviour", "🏷 Pricing Strategy", "📈 Future Demand", "🔎 Product Drill-down"]
+    if perf.panel_enabled(st.query_params):
+        pages.append("⏱ Performance")
     page = st.sidebar.radio(
         "Navigate Menu:",
-        ["🏠 Home", "🛍 Customer Behaviour", "🏷 Pricing Strategy", "📈 Future Demand"],
+        pages,
         format_func=lambda page: f"{page}"
     )
+    with perf.stage(f"page {page}"):
+        show_page(page)
+    prewarm()
+
+
+def _warm_up():
+    importlib.import_module('customer')
+    transactions_table()
+    new_data_table()
+
+
+@st.cache_resource
+def prewarm():
+    # Once per process, after the first page is drawn: import the chart modules
+    # and load the remaining data in the background, so the first visit to a
+    # chart page doesn't pay for them
+    thread = threading.Thread(target=_warm_up, name='prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+def sidebar_filter(tables):
+    # Date range, store and category pickers shared by every page, offered
+    # for the data the page shows; full ranges and empty picks mean no filter
+    if not all(table.cube.has_cells for table in tables):
+        # Only the page roll-ups are kept in streaming mode, nothing to slice
+        st.sidebar.caption("Filters are not available in streaming mode.")
+        return filters.DataFilter()
+    days = [table.cube.rollup('date').index for table in tables]
+    first_day = min(table_days.min() for table_days in days).date()
+    last_day = max(table_days.max() for table_days in days).date()
+    stores = sorted(set().union(*(table.cube.rollup('store_location').index for table in tables)))
+    categories = sorted(set().union(*(table.cube.rollup('product_category').index for table in tables)))
+
+    st.sidebar.subheader("Filters")
+    dates = st.sidebar.date_input("Date range", (first_day, last_day), first_day, last_day, key='filter_dates')
+    selected_stores = st.sidebar.multiselect("Store locations", stores, key='filter_stores')
+    selected_categories = st.sidebar.multiselect("Product categories", categories, key='filter_categories')
+
+    start = end = None
+    if len(dates) == 2:
+        start = dates[0] if dates[0] > first_day else None
+        end = dates[1] if dates[1] < last_day else None
+    return filters.DataFilter(start, end, selected_stores, selected_categories)
+
+
+def filtered_tables(*tables):
+    # Every table of the page cut down to the sidebar filter (a binary-search
+    # slice of the (store, time) index, cached per filter)
+    data_filter = sidebar_filter(tables)
+    tables = [table.filter(data_filter) for table in tables]
+    if any(table.cube.rows == 0 for table in tables):
+        st.warning("No transactions match the selected filters.")
+        st.stop()
+    return data_filter, tables
+
+
+def show_page(page):
 
     if page == "🏠 Home":
+        # Headline numbers and the location pie follow the loaded data
+        _, (df,) = filtered_tables(transactions_table())
+        kpis = kpi.get_kpis(df)
+        pie_chart_base64 = kpi.location_share_pie(df)
         st.markdown(
     f"""
     <div style="padding: 10px; border: 2px solid black; border-radius: 10px; background-color: #6F4E37; color: white; width: 100%; max-width: 800px; margin: 20px auto;">
@@ -113,16 +202,16 @@ def main():
         <div style="display: flex; flex-wrap: wrap; justify-content: space-around; margin-top: 10px;">
             <div style="flex: 1; min-width: 300px; max-width: 350px; padding: 10px; border: 2px solid green; border-radius: 10px; background-color: white; color: green; margin-bottom: 10px;">
                 <h3 style="text-align: center; color: green;">Total Sales Revenue</h3>
-                <h1 style="text-align: center; color: green;">$698,812.33</h1>
+                <h1 style="text-align: center; color: green;">${kpis['total_revenue']:,.2f}</h1>
             </div>
             <div style="flex: 1; min-width: 300px; max-width: 350px; padding: 10px; border: 2px solid #6F4E37; border-radius: 10px; background-color: white; color: #4B4B4B; margin-bottom: 10px;">
                 <h3 style="text-align: center; color: #4B4B4B;">Total Orders</h3>
-                <h1 style="text-align: center; color: #4B4B4B;">149,116</h1>
+                <h1 style="text-align: center; color: #4B4B4B;">{kpis['total_orders']:,}</h1>
             </div>
             <div style="flex: 1; min-width: 300px; max-width: 350px; padding: 10px; border: 2px solid orange; border-radius: 10px; background-color: white; color: orange; margin-bottom: 10px;">
                 <h3 style="text-align: center; color: orange;">Top Sales Location</h3>
-                <h1 style="text-align: center; color: orange;">Hell's Kitchen</h1>
-                <h3 style="text-align: center; color: orange;">$236,511.17</h3>
+                <h1 style="text-align: center; color: orange;">{kpis['top_location']}</h1>
+                <h3 style="text-align: center; color: orange;">${kpis['top_location_revenue']:,.2f}</h3>
             </div>
             <div style="flex: 1; min-width: 300px; max-width: 350px; margin-top: 20px;">
                 <h3 style="text-align: center; color: white;">Top Sales Locations</h3>
@@ -136,23 +225,48 @@ def main():
 
 
     elif page == "🛍 Customer Behaviour":
+        # The chart modules (matplotlib, seaborn) are only imported by the chart pages
+        import customer
+
+        _, (df, df2) = filtered_tables(transactions_table(), new_data_table())
         st.header("Age Distribution Analysis")
 
         customer.transaction_in_hour_basis(df2)
         customer.transaction_in_day_basis(df)
         customer.transaction_in_month_basis(df)
+        customer.revenue_anomalies(df)
         customer.display_barista_revenue(df2)
 
     elif page == "🏷 Pricing Strategy":
+        import customer
+
+        _, (df2,) = filtered_tables(new_data_table())
         st.header("Pricing Strategy")
         customer.average_price_basis(df2)
         customer.lowest_sale_product(df2)
 
     elif page == "📈 Future Demand":
+        import customer
+
+        data_filter, (df2,) = filtered_tables(new_data_table())
+        # A picked date range replaces the default window of the last 6 months
+        months = None if data_filter.start or data_filter.end else 6
         st.header("Future Demand Analysis")
         customer.category_basis_transaction(df2)
-        customer.average_category_transaction(df2)
-        customer.category_transaction(df2)
+        customer.average_category_transaction(df2, months)
+        customer.category_transaction(df2, months)
+        customer.demand_forecast(df2)
+
+    elif page == "🔎 Product Drill-down":
+        import customer
+
+        _, (df2,) = filtered_tables(new_data_table())
+        st.header("Product Drill-down")
+        customer.product_drilldown(df2)
+
+    elif page == "⏱ Performance":
+        perf.performance_page()
 
 if __name__ == "__main__":
-    main()
+    with perf.stage('main'):
+        main()
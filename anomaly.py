@@ -0,0 +1,265 @@
+import os
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+# Hourly and daily revenue of every store, folded in as transactions arrive.
+# Each transaction only adds to the open hour; closing an hour or a day
+# updates a fixed window of running sums, an exponentially weighted mean and
+# variance and Welford's mean and variance of its weekday and hour, so every
+# update is O(1) and history is never scanned again. Days are compared with
+# the days before them, hours with the same hour of the same weekday. Hours
+# and days without any transaction (closed stores) are not part of the series.
+
+# Weight of the newest value in the exponentially weighted mean
+ALPHA = float(os.environ.get("COFFEE_EWMA_ALPHA", 0.2))
+
+# Observed days the rolling z-score of a day is computed over
+WINDOW_DAYS = int(os.environ.get("COFFEE_ANOMALY_WINDOW", 28))
+
+# Days or hours whose z-score is beyond this are flagged
+THRESHOLD = float(os.environ.get("COFFEE_ANOMALY_Z", 3.0))
+
+# Values a statistic needs before it flags anything
+MIN_HISTORY = int(os.environ.get("COFFEE_ANOMALY_MIN_HISTORY", 7))
+
+HOUR = 3600 * 10 ** 9
+
+# 1970-01-01, day 0 of the epoch, was a Thursday
+_EPOCH_WEEKDAY = 3
+
+
+def _zscore(value, mean, variance):
+    return (value - mean) / np.sqrt(variance) if variance > 0 else np.nan
+
+
+class RollingStats:
+    # Exponentially weighted mean and variance of a series plus running sums
+    # over its last `window` values
+
+    def __init__(self, window):
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.ewma = None
+        self.ewvar = 0.0
+
+    def copy(self):
+        stats = RollingStats(self.values.maxlen)
+        stats.values.extend(self.values)
+        stats.total, stats.total_sq, stats.ewma, stats.ewvar = self.total, self.total_sq, self.ewma, self.ewvar
+        return stats
+
+    def zscore(self, value):
+        # Against the window as it was before the value
+        n = len(self.values)
+        if n < MIN_HISTORY:
+            return np.nan
+        mean = self.total / n
+        return _zscore(value, mean, (self.total_sq - n * mean * mean) / (n - 1))
+
+    def add(self, value):
+        if len(self.values) == self.values.maxlen:
+            oldest = self.values[0]
+            self.total -= oldest
+            self.total_sq -= oldest * oldest
+        self.values.append(value)
+        self.total += value
+        self.total_sq += value * value
+        if self.ewma is None:
+            self.ewma = value
+        else:
+            # West's incremental form of the exponentially weighted variance
+            difference = value - self.ewma
+            increment = ALPHA * difference
+            self.ewma += increment
+            self.ewvar = (1 - ALPHA) * (self.ewvar + difference * increment)
+
+
+class SeasonalProfile:
+    # Welford's mean and variance of the revenue of every weekday x hour
+
+    def __init__(self):
+        self.count = np.zeros((7, 24), dtype=np.int64)
+        self.mean = np.zeros((7, 24))
+        self.m2 = np.zeros((7, 24))
+
+    def copy(self):
+        profile = SeasonalProfile()
+        profile.count, profile.mean, profile.m2 = self.count.copy(), self.mean.copy(), self.m2.copy()
+        return profile
+
+    def zscore(self, weekday, hour, value):
+        n = self.count[weekday, hour]
+        if n < MIN_HISTORY:
+            return np.nan
+        return _zscore(value, self.mean[weekday, hour], self.m2[weekday, hour] / (n - 1))
+
+    def add(self, weekday, hour, value):
+        self.count[weekday, hour] += 1
+        delta = value - self.mean[weekday, hour]
+        self.mean[weekday, hour] += delta / self.count[weekday, hour]
+        self.m2[weekday, hour] += delta * (value - self.mean[weekday, hour])
+
+    def frame(self):
+        return pd.DataFrame(self.mean, index=pd.RangeIndex(7, name='weekday'), columns=pd.RangeIndex(24, name='hour'))
+
+
+class StoreMonitor:
+    # Open hour and day of one store, the statistics of the closed ones, one
+    # record per closed day and the flagged hours
+
+    def __init__(self):
+        self.hour = None
+        self.hour_revenue = 0.0
+        self.day_revenue = 0.0
+        self.daily = RollingStats(WINDOW_DAYS)
+        self.hourly = RollingStats(24)
+        self.profile = SeasonalProfile()
+        # (day, revenue, expected, z-score); expected is the EWMA before the day
+        self.days = []
+        # (hour, revenue, expected, z-score) of flagged hours only
+        self.flagged_hours = []
+        # Transactions older than the open hour, left out of the statistics
+        self.late = 0
+
+    def copy(self):
+        monitor = StoreMonitor()
+        monitor.hour, monitor.hour_revenue, monitor.day_revenue = self.hour, self.hour_revenue, self.day_revenue
+        monitor.daily, monitor.hourly, monitor.profile = self.daily.copy(), self.hourly.copy(), self.profile.copy()
+        monitor.days, monitor.flagged_hours = list(self.days), list(self.flagged_hours)
+        monitor.late = self.late
+        return monitor
+
+    def observe(self, hour, revenue):
+        # hour: hours since the epoch
+        if self.hour is None:
+            self.hour = hour
+        elif hour != self.hour:
+            if hour < self.hour:
+                self.late += 1
+                return
+            self._close_hour()
+            if hour // 24 != self.hour // 24:
+                self._close_day()
+            self.hour = hour
+        self.hour_revenue += revenue
+
+    def _close_hour(self):
+        value = self.hour_revenue
+        day, hour = divmod(self.hour, 24)
+        weekday = (day + _EPOCH_WEEKDAY) % 7
+        zscore = self.profile.zscore(weekday, hour, value)
+        if abs(zscore) > THRESHOLD:
+            self.flagged_hours.append((self.hour, value, self.profile.mean[weekday, hour], zscore))
+        self.profile.add(weekday, hour, value)
+        self.hourly.add(value)
+        self.day_revenue += value
+        self.hour_revenue = 0.0
+
+    def _close_day(self):
+        value = self.day_revenue
+        expected = value if self.daily.ewma is None else self.daily.ewma
+        self.days.append((self.hour // 24, value, expected, self.daily.zscore(value)))
+        self.daily.add(value)
+        self.day_revenue = 0.0
+
+
+class RevenueMonitor:
+    def __init__(self):
+        self.stores = {}
+
+    def copy(self):
+        monitor = RevenueMonitor()
+        monitor.stores = {store: store_monitor.copy() for store, store_monitor in self.stores.items()}
+        return monitor
+
+    def observe(self, store, timestamp, revenue):
+        # One transaction; timestamp in nanoseconds since the epoch
+        store_monitor = self.stores.get(store)
+        if store_monitor is None:
+            store_monitor = self.stores[store] = StoreMonitor()
+        store_monitor.observe(timestamp // HOUR, revenue)
+
+    def observe_rows(self, rows):
+        # Normalized transactions, newer than everything observed so far
+        timestamps = rows['transaction_timestamp'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        for store, timestamp, revenue in zip(rows['store_location'].to_numpy()[order], timestamps[order],
+                                             rows['revenue'].to_numpy()[order]):
+            self.observe(store, int(timestamp), float(revenue))
+        return self
+
+    @classmethod
+    def from_cube(cls, cube):
+        # Seeded from the hourly revenue of the cube, which is what the
+        # transactions would have added up to
+        monitor = cls()
+        hourly = cube.rollup(['store_location', 'date', 'hour'])['revenue']
+        stores = hourly.index.get_level_values(0)
+        hours = (hourly.index.get_level_values(1).to_numpy(dtype='datetime64[ns]').view(np.int64) // HOUR
+                 + hourly.index.get_level_values(2).to_numpy())
+        for store, hour, revenue in zip(stores, hours.tolist(), hourly.to_numpy().tolist()):
+            monitor.observe(store, hour * HOUR, revenue)
+        return monitor
+
+    def daily_frame(self):
+        # Every closed day of every store with its expected revenue and z-score
+        frames = []
+        for store, store_monitor in self.stores.items():
+            days = pd.DataFrame(store_monitor.days, columns=['day', 'revenue', 'expected', 'zscore'])
+            frames.append(pd.DataFrame({
+                'store_location': store,
+                'date': pd.to_datetime(days['day'], unit='D'),
+                'revenue': days['revenue'],
+                'expected': days['expected'],
+                'zscore': days['zscore'],
+                'anomaly': days['zscore'].abs() > THRESHOLD,
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['store_location', 'date', 'revenue', 'expected', 'zscore', 'anomaly'])
+        return pd.concat(frames, ignore_index=True)
+
+    def anomalies(self):
+        # Flagged days and hours, newest first
+        daily = self.daily_frame()
+        daily = daily.loc[daily['anomaly'], ['store_location', 'date', 'revenue', 'expected', 'zscore']]
+        frames = [daily.rename(columns={'date': 'start'}).assign(period='day')]
+        for store, store_monitor in self.stores.items():
+            hours = pd.DataFrame(store_monitor.flagged_hours, columns=['hour', 'revenue', 'expected', 'zscore'])
+            frames.append(pd.DataFrame({
+                'store_location': store,
+                'start': pd.to_datetime(hours['hour'] * HOUR),
+                'revenue': hours['revenue'],
+                'expected': hours['expected'],
+                'zscore': hours['zscore'],
+                'period': 'hour',
+            }))
+        anomalies = pd.concat(frames, ignore_index=True)
+        columns = ['start', 'period', 'store_location', 'revenue', 'expected', 'zscore']
+        return anomalies[columns].sort_values(['start', 'store_location', 'period'], ascending=[False, True, True],
+                                              ignore_index=True)
+
+    def summary(self):
+        # Latest statistics of every store
+        summary = {}
+        for store, store_monitor in self.stores.items():
+            daily, hourly = store_monitor.daily, store_monitor.hourly
+            last_day = store_monitor.days[-1] if store_monitor.days else (None, np.nan, np.nan, np.nan)
+            summary[store] = {
+                'days': len(store_monitor.days),
+                'last_day': None if last_day[0] is None else pd.Timestamp(last_day[0], unit='D'),
+                'last_day_revenue': last_day[1],
+                'last_day_zscore': last_day[3],
+                'daily_ewma': daily.ewma,
+                'daily_ew_std': np.sqrt(daily.ewvar),
+                'hourly_ewma': hourly.ewma,
+                'hourly_ew_std': np.sqrt(hourly.ewvar),
+                'late_transactions': store_monitor.late,
+            }
+        return pd.DataFrame.from_dict(summary, orient='index').rename_axis('store_location')
+
+    def profiles(self):
+        # Average revenue of every weekday x hour, per store
+        return {store: store_monitor.profile.frame() for store, store_monitor in self.stores.items()}
@@ -0,0 +1,208 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import perf
+import results
+
+# Approximate mode: pages whose result isn't computed yet are first drawn
+# from a sample of the cube cells, with 95% error bounds, and redrawn once
+# the exact result is in. Set COFFEE_APPROX=1 or open the app with ?approx=1.
+ENABLED = os.environ.get("COFFEE_APPROX", "0") == "1"
+
+# Cells sampled per store; the cost of a preview depends on this, not on the history
+SAMPLE_CELLS = int(os.environ.get("COFFEE_APPROX_SAMPLE", 4000))
+
+# Seconds between checks for the exact result behind a preview
+POLL_SECONDS = float(os.environ.get("COFFEE_APPROX_POLL", 0.5))
+
+# Two-sided 95% normal quantile
+Z = 1.96
+
+# Samples kept, one per table version
+MAX_SAMPLES = 16
+
+_samples = OrderedDict()
+_lock = threading.Lock()
+
+# Exact results computed behind a preview
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='refine')
+
+
+def enabled(query_params):
+    return ENABLED or query_params.get('approx') == '1'
+
+
+class CellSample:
+    # Cells of a cube drawn at random within every store (the stratum). Cube
+    # cells are sorted by store first, so each stratum is one contiguous run
+    # found by binary search and only the drawn cells are ever read.
+
+    def __init__(self, cells, size, seed=0):
+        codes = cells['store_location'].cat.codes.to_numpy()
+        stores = cells['store_location'].cat.categories
+        offsets = np.searchsorted(codes, np.arange(len(stores) + 1))
+        rng = np.random.default_rng(seed)
+        positions, cells_per_store = [], {}
+        for code, (low, high) in enumerate(zip(offsets[:-1], offsets[1:])):
+            if high == low:
+                continue
+            drawn = min(size, high - low)
+            positions.append(low + np.sort(rng.choice(high - low, drawn, replace=False)))
+            cells_per_store[stores[code]] = high - low
+        positions = np.concatenate(positions)
+        self.cells = cells.take(positions).reset_index(drop=True)
+        self.population = len(cells)
+        # Cells of every store in the cube and in the sample
+        self.store_cells = pd.Series(cells_per_store, dtype=np.int64)
+        self.sampled = self.cells['store_location'].value_counts().reindex(self.store_cells.index)
+
+    @property
+    def exact(self):
+        return len(self.cells) == self.population
+
+    def total(self, values, by=()):
+        # Estimated sum of `values` (one per sampled cell) per group of `by`
+        # (sample columns or Series along the sample), with the 95% half-width
+        # of the stratified estimator. Groups that include the store are
+        # single strata, the others add up every store's estimate and variance.
+        # Without groups it returns the (estimate, error) of the grand total.
+        keys = [self.cells[key] if isinstance(key, str) else key for key in by]
+        names = [key.name for key in keys]
+        others = [key for key in keys if key.name != 'store_location']
+        values = np.asarray(values, dtype=np.float64)
+        frame = pd.DataFrame({'y': values, 'y2': values ** 2})
+        sums = frame.groupby([self.cells['store_location']] + others, observed=True).sum()
+        stratum = sums.index.get_level_values(0)
+        cells = self.store_cells.reindex(stratum).to_numpy()
+        sampled = self.sampled.reindex(stratum).to_numpy()
+        # Groups absent from a stratum's sample still add zeros to its variance;
+        # that part is left out, so bounds of very rare groups are optimistic
+        mean = sums['y'].to_numpy() / sampled
+        variance = (sums['y2'].to_numpy() - sampled * mean ** 2) / np.maximum(sampled - 1, 1)
+        estimate = pd.DataFrame({
+            'estimate': cells * mean,
+            'variance': cells ** 2 * (1 - sampled / cells) * np.maximum(variance, 0) / sampled,
+        }, index=sums.index)
+        if not keys:
+            totals = estimate.sum()
+            return pd.Series({'estimate': totals['estimate'], 'error': Z * np.sqrt(totals['variance'])})
+        if 'store_location' not in names:
+            estimate = estimate.groupby(level=list(range(1, estimate.index.nlevels)), observed=True).sum()
+        elif len(names) > 1:
+            estimate = estimate.reorder_levels(names)
+        estimate['error'] = Z * np.sqrt(estimate.pop('variance'))
+        return estimate.sort_index()
+
+
+def sample(table):
+    with _lock:
+        cell_sample = _samples.get(table.version)
+        if cell_sample is not None:
+            _samples.move_to_end(table.version)
+            return cell_sample
+    with perf.stage('sample_cells', rows=SAMPLE_CELLS):
+        # Seeded from the version, so every session previews the same numbers
+        seed = int.from_bytes(table.version.encode()[-8:], 'little')
+        cell_sample = CellSample(table.cube.cells, SAMPLE_CELLS, seed)
+    with _lock:
+        _samples[table.version] = cell_sample
+        while len(_samples) > MAX_SAMPLES:
+            _samples.popitem(last=False)
+    return cell_sample
+
+
+# Estimators take the table and its sample and return data shaped like
+# customer.<name>_data and a line describing how far off it can be
+
+
+def transaction_in_hour_basis(table, cell_sample):
+    counts = cell_sample.total(cell_sample.cells['count'], ['store_location', 'hour'])
+    data = counts['estimate'].round().astype(np.int64).unstack(fill_value=0)
+    worst = counts['error'].max()
+    return data, f"transaction counts within ±{worst:,.0f} (95%)"
+
+
+def average_price_basis(table, cell_sample):
+    cells = cell_sample.cells
+    count = cells['count'].to_numpy()
+    price_count = cells['unit_price'].to_numpy() * count
+    total_count = cell_sample.total(count)['estimate']
+    average_price = cell_sample.total(price_count)['estimate'] / total_count
+    # Ratio estimator: its error is that of the total of (price - average) * count
+    price_error = cell_sample.total(price_count - average_price * count)['error'] / total_count
+
+    above_average = (cells['unit_price'] >= average_price).rename('above_average')
+    split = cell_sample.total(cells['transaction_qty'], ['store_location', above_average])
+    # Stores in the order of their first sampled cell, close to the exact first-sale order
+    store_locations = cells.groupby('store_location', observed=True)['first_row'].min().sort_values().index
+    data = {
+        'average_price': average_price,
+        'split_sales': (split['estimate'].round().astype(np.int64).unstack(fill_value=0)
+                        .reindex(columns=[False, True], fill_value=0)),
+        'store_locations': store_locations,
+    }
+    return data, f"average price within ±${price_error:.2f}, sales totals within ±{split['error'].max():,.0f} (95%)"
+
+
+def lowest_sale_product(table, cell_sample):
+    # A long-tail product can have no sampled cell at all, so the product is
+    # picked from the exact per-product totals (one small roll-up of the
+    # cube, the same the exact result starts from) and its breakdown read
+    # from its own cells through the product index. Only the transaction
+    # times, which need the rows, are left for the exact result.
+    products = table.cube.rollup('product_detail')[['transaction_qty']].sort_values('transaction_qty')
+    lowest = products.index[0]
+    product_cells = table.product_cells(lowest)
+
+    hourly_sales = product_cells.groupby(['hour', 'store_location'], observed=True)[['transaction_qty', 'count']].sum()
+    hourly_sales = (hourly_sales['transaction_qty'] / hourly_sales['count']).rename('transaction_qty').reset_index()
+    data = {
+        'product': lowest,
+        'most_sold_time_by_location': None,
+        'hourly_sales': hourly_sales,
+        'location_totals': product_cells.groupby('store_location', observed=True)['transaction_qty'].sum(),
+    }
+    sold, runner_up = products['transaction_qty'].iloc[0], products['transaction_qty'].iloc[min(1, len(products) - 1)]
+    return data, f"{lowest} sold {sold:,} (exact, next lowest {runner_up:,})"
+
+
+ESTIMATORS = {
+    'transaction_in_hour_basis': transaction_in_hour_basis,
+    'average_price_basis': average_price_basis,
+    'lowest_sale_product': lowest_sale_product,
+}
+
+
+class Preview:
+    def __init__(self, table, data, bounds, cell_sample):
+        self.data = data
+        self.bounds = bounds
+        # Charts of the preview are cached apart from the exact ones
+        self.version = f"{table.version}~sample{SAMPLE_CELLS}"
+        self.caption = (f"Approximate, from {len(cell_sample.cells):,} of {cell_sample.population:,} cube cells: "
+                        f"{bounds}. Exact values follow.")
+
+
+def preview(table, name):
+    # None when the result has no estimator, the cube has no cells to sample
+    # (streaming mode) or the sample would be the whole cube
+    estimator = ESTIMATORS.get(name)
+    if estimator is None or not table.cube.has_cells:
+        return None
+    cell_sample = sample(table)
+    if cell_sample.exact:
+        return None
+    with perf.stage('approximate', result=name):
+        data, bounds = estimator(table, cell_sample)
+    return Preview(table, data, bounds, cell_sample)
+
+
+def refine(table, name, params, compute):
+    # Exact result computed in the background; sessions asking for the same
+    # one share the computation through results.get
+    return _executor.submit(results.get, table, name, params, compute)
@@ -0,0 +1,769 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Ridge
+
+import anomaly
+import approx
+import customer
+import data_loader
+import downsample
+import figure_cache
+import filters
+import forecast
+import kpi
+import parallel
+import perf
+import results
+import store
+from cube import SalesCube
+from transactions import TransactionTable, load_table, memory_report
+
+
+def _quiet_streamlit():
+    # Streamlit calls made outside `streamlit run` only log warnings, so every
+    # page function can be timed headless
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+
+_quiet_streamlit()
+
+PAGE_FUNCTIONS = [
+    'transaction_in_hour_basis',
+    'transaction_in_day_basis',
+    'transaction_in_month_basis',
+    'display_barista_revenue',
+    'average_price_basis',
+    'lowest_sale_product',
+    'category_basis_transaction',
+    'average_category_transaction',
+    'category_transaction',
+    'top_product_categories',
+    'revenue_day',
+    'product_drilldown',
+    'demand_forecast',
+    'revenue_anomalies',
+]
+
+DEFAULT_SIZES = [10 ** 5, 10 ** 6, 10 ** 7]
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Coffe_shop.py')
+APP_PAGES = ["🛍 Customer Behaviour", "🏷 Pricing Strategy", "📈 Future Demand"]
+
+# Run in a fresh interpreter: time to the first complete run of the Home page,
+# then, after the user has looked at it for a while, to the first visit of
+# every other page
+COLD_START_SCRIPT = """
+import json, logging, sys, time, warnings
+start = time.perf_counter()
+warnings.filterwarnings("ignore")
+from streamlit.testing.v1 import AppTest
+for name in list(logging.root.manager.loggerDict):
+    if name.startswith("streamlit"):
+        logging.getLogger(name).setLevel(logging.ERROR)
+result = {'import_seconds': time.perf_counter() - start}
+app = AppTest.from_file(sys.argv[1], default_timeout=600)
+run_start = time.perf_counter()
+app.run()
+result['first_paint_seconds'] = time.perf_counter() - run_start
+result['process_seconds'] = time.perf_counter() - start
+result['modules'] = sorted(m for m in ('seaborn', 'plotly', 'matplotlib', 'customer') if m in sys.modules)
+time.sleep(float(sys.argv[3]))
+for page in json.loads(sys.argv[2]):
+    page_start = time.perf_counter()
+    app.sidebar.radio[0].set_value(page).run()
+    result[page] = time.perf_counter() - page_start
+result['exceptions'] = [e.value for e in app.exception]
+print(json.dumps(result))
+"""
+
+# Functions slower than baseline * threshold are reported as regressions
+REGRESSION_THRESHOLD = 1.25
+
+
+def make_transactions(rows, stores=3, products=80, categories=9, days=181, seed=0):
+    # Synthetic transactions with the same columns as New_data.csv. Named
+    # stores and products used by the pages are always included.
+    rng = np.random.default_rng(seed)
+    store_names = np.array(['Lower Manhattan', "Hell's Kitchen", 'Astoria'][:stores]
+                           + [f'Store {i}' for i in range(3, stores)])
+    category_names = np.array([f'Category {i}' for i in range(categories)])
+    product_names = np.array(['Ouro Brasileiro shot'] + [f'Product {i}' for i in range(1, products)])
+    product_category = rng.integers(0, categories, products)
+    product_price = np.round(rng.uniform(0.8, 12.0, products), 2)
+
+    store = rng.integers(0, stores, rows)
+    product = rng.integers(0, products, rows)
+    day = np.sort(rng.integers(0, days, rows))
+    seconds = rng.integers(6 * 3600, 21 * 3600, rows)
+    time_pool = pd.to_datetime(np.arange(24 * 3600), unit='s').strftime('%H:%M:%S')
+
+    return pd.DataFrame({
+        'transaction_id': np.arange(1, rows + 1),
+        'transaction_date': pd.Timestamp('2023-01-01') + pd.to_timedelta(day, unit='D'),
+        'transaction_time': pd.Categorical.from_codes(seconds, time_pool),
+        'transaction_qty': rng.integers(1, 4, rows),
+        'store_id': store + 1,
+        'store_location': pd.Categorical.from_codes(store, store_names),
+        'product_id': product + 1,
+        'unit_price': product_price[product],
+        'product_category': pd.Categorical.from_codes(product_category[product], category_names),
+        'product_type': pd.Categorical.from_codes(product_category[product], category_names),
+        'product_detail': pd.Categorical.from_codes(product, product_names),
+        'hour': seconds // 3600,
+    })
+
+
+def _measure(func):
+    # Wall time and time spent drawing figures of one call with empty result and figure caches
+    results.clear()
+    figure_cache.figures.clear()
+    render_before = figure_cache.figures.render_seconds
+    gc.collect()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    render = figure_cache.figures.render_seconds - render_before
+    return {'seconds': seconds, 'render_seconds': render, 'prep_seconds': seconds - render}
+
+
+def _peak_memory(func):
+    # Traced separately, tracemalloc slows the call down too much to time it
+    results.clear()
+    figure_cache.figures.clear()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_size(rows, stores, products, categories, functions, memory, repeat):
+    raw = make_transactions(rows, stores, products, categories)
+
+    start = time.perf_counter()
+    table = TransactionTable.from_frame(raw)
+    normalize_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    table.cube
+    cube_seconds = time.perf_counter() - start
+    del raw
+
+    result = {
+        'rows': rows,
+        'stores': stores,
+        'products': products,
+        'categories': categories,
+        'cube_cells': len(table.cube.cells),
+        'normalize_seconds': normalize_seconds,
+        'cube_seconds': cube_seconds,
+        'functions': {},
+    }
+    calls = {name: (lambda name=name: getattr(customer, name)(table)) for name in functions}
+    calls['kpi'] = lambda: kpi.compute_kpis(table)
+    # Warm up imports and pyplot before the first timed call
+    _measure(calls['transaction_in_month_basis'] if 'transaction_in_month_basis' in calls else calls['kpi'])
+    for name, call in calls.items():
+        # Best of `repeat` runs, each with an empty figure cache
+        best = min((_measure(call) for _ in range(repeat)), key=lambda run: run['seconds'])
+        best['peak_bytes'] = _peak_memory(call) if memory else 0
+        result['functions'][name] = best
+        print(f"{rows:>10,} rows  {name:<30} {best['prep_seconds'] * 1000:9.1f} ms prep "
+              f"{best['render_seconds'] * 1000:9.1f} ms render {best['peak_bytes'] / 2 ** 20:8.1f} MiB",
+              file=sys.stderr)
+    return result
+
+
+def _per_location_price_split(cells, average_price):
+    # The per-location loop average_price_basis used before, kept as a reference
+    split = {}
+    for location in cells['store_location'].unique():
+        location_data = cells[cells['store_location'] == location]
+        split[location] = {
+            False: location_data[location_data['unit_price'] < average_price]['transaction_qty'].sum(),
+            True: location_data[location_data['unit_price'] >= average_price]['transaction_qty'].sum(),
+        }
+    return pd.DataFrame.from_dict(split, orient='index').sort_index()
+
+
+def _per_category_sales(cells):
+    # The per-category loop category_basis_transaction used before
+    return {category: cells[cells['product_category'] == category]
+            .groupby('product_detail', observed=True)['transaction_qty'].sum()
+            for category in cells['product_category'].unique()}
+
+
+def _per_location_days(daily):
+    # The per-location filter transaction_in_day_basis used before
+    return {location: daily[daily['store_location'] == location]
+            for location in daily['store_location'].unique()}
+
+
+def _best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def run_scaling(rows, counts, products, repeat):
+    # Per-group loops against the grouped versions as stores and categories grow
+    results = []
+    for count in counts:
+        table = TransactionTable.from_frame(
+            make_transactions(rows, stores=count, products=max(products, count), categories=count))
+        cells = table.cube.cells
+        average_price = (cells['unit_price'] * cells['count']).sum() / cells['count'].sum()
+        daily = table.cube.rollup(['date', 'store_location'])['revenue'].reset_index()
+
+        loop_price, expected = _best_of(lambda: _per_location_price_split(cells, average_price), repeat)
+        grouped_price, actual = _best_of(lambda: customer.price_split_sales(cells, average_price), repeat)
+        actual = actual.set_axis(actual.index.astype(str)).sort_index()
+        pd.testing.assert_frame_equal(expected.set_axis(expected.index.astype(str)), actual,
+                                      check_names=False, check_column_type=False)
+
+        loop_category, expected = _best_of(lambda: _per_category_sales(cells), repeat)
+        grouped_category, actual = _best_of(lambda: customer.category_product_sales(cells), repeat)
+        for category, product_sales in expected.items():
+            pd.testing.assert_series_equal(product_sales, actual.loc[category], check_names=False,
+                                           check_categorical=False)
+
+        loop_days, _ = _best_of(lambda: _per_location_days(daily), repeat)
+        grouped_days, _ = _best_of(
+            lambda: dict(list(daily.groupby('store_location', observed=True, sort=False))), repeat)
+
+        result = {
+            'rows': rows,
+            'stores': count,
+            'categories': count,
+            'cube_cells': len(cells),
+            'price_split': {'loop_seconds': loop_price, 'grouped_seconds': grouped_price},
+            'category_sales': {'loop_seconds': loop_category, 'grouped_seconds': grouped_category},
+            'location_days': {'loop_seconds': loop_days, 'grouped_seconds': grouped_days},
+        }
+        results.append(result)
+        for name in ['price_split', 'category_sales', 'location_days']:
+            timing = result[name]
+            print(f"{count:>5} stores/categories  {name:<16} loop {timing['loop_seconds'] * 1000:9.1f} ms "
+                  f"grouped {timing['grouped_seconds'] * 1000:9.1f} ms "
+                  f"speedup {timing['loop_seconds'] / timing['grouped_seconds']:6.1f}x", file=sys.stderr)
+    return results
+
+
+def _mask_filter(frame, day_column, data_filter):
+    # Full boolean-mask scan, what a filter cost before the (store, time) index
+    mask = np.ones(len(frame), dtype=bool)
+    if data_filter.start is not None:
+        mask &= (frame[day_column] >= data_filter.start).to_numpy()
+    if data_filter.end is not None:
+        mask &= (frame[day_column] <= data_filter.end).to_numpy()
+    if data_filter.stores is not None:
+        mask &= frame['store_location'].isin(data_filter.stores).to_numpy()
+    if data_filter.categories is not None:
+        mask &= frame['product_category'].isin(data_filter.categories).to_numpy()
+    return frame[mask].reset_index(drop=True)
+
+
+def run_filters(rows, stores, products, categories, repeat):
+    # Date/store/category filters through the sorted index against a full scan
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories))
+    cells = table.cube.cells
+    start = time.perf_counter()
+    table.filter(filters.DataFilter(stores=['Astoria']))
+    cell_index_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    table.select_rows(filters.DataFilter(stores=['Astoria']))
+    row_index_seconds = time.perf_counter() - start
+
+    first_day = cells['date'].min()
+    cases = {
+        'one_week_one_store': filters.DataFilter(first_day + pd.Timedelta(days=70), first_day + pd.Timedelta(days=76),
+                                                 ['Astoria']),
+        'one_month_all_stores': filters.DataFilter(first_day + pd.Timedelta(days=30), first_day + pd.Timedelta(days=59)),
+        'one_store_one_category': filters.DataFilter(stores=['Astoria'], categories=['Category 0']),
+    }
+    result = {'rows': rows, 'cube_cells': len(cells), 'cell_index_seconds': cell_index_seconds,
+              'row_index_seconds': row_index_seconds, 'cases': {}}
+    for name, data_filter in cases.items():
+        # The cube's selection directly, so the cached filtered views aren't what gets timed
+        indexed_cells, selected = _best_of(lambda: table.cube.select(data_filter), repeat)
+        scan_cells, expected = _best_of(lambda: _mask_filter(cells, 'date', data_filter), repeat)
+        pd.testing.assert_frame_equal(selected, expected)
+        indexed_rows, selected = _best_of(lambda: table.select_rows(data_filter), repeat)
+        scan_rows, expected = _best_of(lambda: _mask_filter(table.frame, 'transaction_day', data_filter), repeat)
+        pd.testing.assert_frame_equal(selected, expected)
+        result['cases'][name] = {'selected_rows': len(selected),
+                                 'cells': {'indexed_seconds': indexed_cells, 'scan_seconds': scan_cells},
+                                 'rows': {'indexed_seconds': indexed_rows, 'scan_seconds': scan_rows}}
+        print(f"{rows:>10,} rows  {name:<24} {len(selected):>10,} selected  "
+              f"cells {indexed_cells * 1000:8.1f} ms (scan {scan_cells * 1000:8.1f} ms)  "
+              f"rows {indexed_rows * 1000:8.1f} ms (scan {scan_rows * 1000:8.1f} ms)", file=sys.stderr)
+    return result
+
+
+def run_drilldown(rows, stores, products, categories, repeat):
+    # Cells and rows of single products through the product index against a
+    # comparison over the whole table, for every product
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories))
+    cells, frame = table.cube.cells, table.frame
+    start = time.perf_counter()
+    names = table.products()
+    table.product_rows(names[0])
+    index_seconds = time.perf_counter() - start
+
+    timings = {'cells_indexed': [], 'cells_scan': [], 'rows_indexed': [], 'rows_scan': [], 'drilldown': []}
+    for product in names:
+        seconds, selected = _best_of(lambda: table.product_cells(product), repeat)
+        timings['cells_indexed'].append(seconds)
+        seconds, expected = _best_of(lambda: cells[cells['product_detail'] == product], repeat)
+        timings['cells_scan'].append(seconds)
+        pd.testing.assert_frame_equal(selected, expected)
+        seconds, selected = _best_of(lambda: table.product_rows(product, customer.TIME_COLUMNS), repeat)
+        timings['rows_indexed'].append(seconds)
+        seconds, expected = _best_of(lambda: frame.loc[frame['product_detail'] == product, customer.TIME_COLUMNS],
+                                     repeat)
+        timings['rows_scan'].append(seconds)
+        pd.testing.assert_frame_equal(selected, expected)
+        seconds, _ = _best_of(lambda: customer.product_drilldown_data(table, product), repeat)
+        timings['drilldown'].append(seconds)
+
+    result = {'rows': rows, 'products': len(names), 'index_seconds': index_seconds,
+              **{f'{name}_median_seconds': statistics.median(values) for name, values in timings.items()}}
+    print(f"{rows:>10,} rows  {len(names)} products  index {index_seconds * 1000:.1f} ms  per product: "
+          f"cells {result['cells_indexed_median_seconds'] * 1000:.2f} ms (scan {result['cells_scan_median_seconds'] * 1000:.2f} ms)  "
+          f"rows {result['rows_indexed_median_seconds'] * 1000:.2f} ms (scan {result['rows_scan_median_seconds'] * 1000:.2f} ms)  "
+          f"drill-down {result['drilldown_median_seconds'] * 1000:.1f} ms", file=sys.stderr)
+    return result
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run_append(rows, stores, products, categories, days, batch_rows, repeat):
+    # Small batches appended one after another to a table whose cube, indexes
+    # and pages are warm, then the first filter, drill-down and Pricing page
+    # data of every new version
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories, days), 'append-0')
+    data_filter = filters.DataFilter(stores=['Astoria'])
+    table.select_rows(data_filter)
+    table.product_rows('Ouro Brasileiro shot')
+    customer.lowest_sale_product_data(table)
+    batch = make_transactions(batch_rows, stores, products, categories, days, seed=1)
+    batch['transaction_date'] = batch['transaction_date'].max()
+
+    timings = {'append': [], 'filter_rows': [], 'product_rows': [], 'pricing': []}
+    for i in range(repeat):
+        start = time.perf_counter()
+        table = table.append(batch, f'append-{i + 1}')
+        timings['append'].append(time.perf_counter() - start)
+        timings['filter_rows'].append(_timed(lambda: table.select_rows(data_filter)))
+        timings['product_rows'].append(_timed(lambda: table.product_rows('Ouro Brasileiro shot', customer.TIME_COLUMNS)))
+        timings['pricing'].append(_timed(lambda: (customer.average_price_basis_data(table),
+                                                  customer.lowest_sale_product_data(table))))
+
+    result = {'rows': rows, 'batch_rows': batch_rows, 'cube_cells': len(table.cube.cells),
+              **{f'{name}_median_seconds': statistics.median(values) for name, values in timings.items()}}
+    print(f"{rows:>10,} rows  {len(table.cube.cells):,} cells  {batch_rows}-row batch: "
+          f"append {result['append_median_seconds'] * 1000:.1f} ms  then "
+          f"filter {result['filter_rows_median_seconds'] * 1000:.1f} ms  "
+          f"product rows {result['product_rows_median_seconds'] * 1000:.1f} ms  "
+          f"pricing {result['pricing_median_seconds'] * 1000:.1f} ms", file=sys.stderr)
+    return result
+
+
+def _per_call(func, calls=1000):
+    # Average seconds of a call that is too fast to time once
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def run_kpis(rows, stores, products, categories, repeat):
+    # Home page KPIs computed from the cube against the cached lookup of every rerun
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories))
+    compute_seconds = min(kpi.compute_kpis(table)['seconds'] for _ in range(repeat))
+    kpi.get_kpis(table)
+    result = {'rows': rows, 'cube_cells': len(table.cube.cells), 'compute_seconds': compute_seconds,
+              'cached_seconds': _per_call(lambda: kpi.get_kpis(table))}
+    print(f"{rows:>10,} rows  {len(table.cube.cells):,} cells  compute {compute_seconds * 1000:.2f} ms  "
+          f"cached lookup {result['cached_seconds'] * 1e6:.2f} us", file=sys.stderr)
+    return result
+
+
+def run_forecast(rows, stores, products, categories, days, repeat):
+    # One multi-output ridge fit against one fit per series, then the whole
+    # forecast and its cached lookup
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories, days))
+    demand = forecast.daily_demand(table.cube)
+    X = forecast.features(demand.index, demand.index[0])
+    Y = demand.to_numpy()
+
+    def per_series():
+        for column in range(Y.shape[1]):
+            Ridge(alpha=1.0).fit(X, Y[:, column])
+
+    batched_seconds, _ = _best_of(lambda: Ridge(alpha=1.0).fit(X, Y), repeat)
+    per_series_seconds, _ = _best_of(per_series, repeat)
+    fit_seconds = min(forecast.DemandForecast.from_cube(table.cube).fit_seconds for _ in range(repeat))
+    forecast.get_forecast(table)
+    result = {'rows': rows, 'series': Y.shape[1], 'days': Y.shape[0], 'batched_fit_seconds': batched_seconds,
+              'per_series_fit_seconds': per_series_seconds, 'forecast_seconds': fit_seconds,
+              'cached_seconds': _per_call(lambda: forecast.get_forecast(table))}
+    print(f"{rows:>10,} rows  {Y.shape[1]} series x {Y.shape[0]} days  fit: batched {batched_seconds * 1000:.2f} ms, "
+          f"per series {per_series_seconds * 1000:.2f} ms; full forecast {fit_seconds * 1000:.1f} ms, "
+          f"cached lookup {result['cached_seconds'] * 1e6:.2f} us", file=sys.stderr)
+    return result
+
+
+def run_anomalies(rows, stores, products, categories, days, repeat):
+    # Revenue monitor seeded from the cube against feeding it every
+    # transaction, and the copy every append makes
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories, days))
+    cube, frame = table.cube, table.frame
+    seed_seconds, monitor = _best_of(lambda: anomaly.RevenueMonitor.from_cube(cube), repeat)
+    observe_seconds, _ = _best_of(lambda: anomaly.RevenueMonitor().observe_rows(frame), 1)
+    copy_seconds, _ = _best_of(monitor.copy, repeat)
+    result = {'rows': rows, 'days': days, 'cube_cells': len(cube.cells), 'seed_seconds': seed_seconds,
+              'per_transaction_seconds': observe_seconds / rows, 'copy_seconds': copy_seconds,
+              'anomalies': len(monitor.anomalies())}
+    print(f"{rows:>10,} rows  {days} days  seeded from {len(cube.cells):,} cells in {seed_seconds * 1000:.1f} ms  "
+          f"one by one {result['per_transaction_seconds'] * 1e6:.2f} us per transaction  "
+          f"copy {copy_seconds * 1000:.2f} ms  {result['anomalies']} anomalies", file=sys.stderr)
+    return result
+
+
+def run_downsample_methods(points, repeat):
+    # Every downsampling method on a random walk of one point per minute
+    rng = np.random.default_rng(0)
+    x = pd.date_range('2010-01-01', periods=points, freq='min')
+    y = np.cumsum(rng.normal(size=points))
+    result = {'points': points, 'methods': {}}
+    for name, method in downsample.METHODS.items():
+        seconds, positions = _best_of(lambda: method(x, y), repeat)
+        result['methods'][name] = {'seconds': seconds, 'kept': len(positions),
+                                   'kept_range': [float(y[positions].min()), float(y[positions].max())]}
+        print(f"{name:<7} {points:,} -> {len(positions):,} points in {seconds * 1000:.1f} ms, "
+              f"range kept {y[positions].min():.1f}..{y[positions].max():.1f} of {y.min():.1f}..{y.max():.1f}",
+              file=sys.stderr)
+    result['range'] = [float(y.min()), float(y.max())]
+    return result
+
+
+def run_memory(sources):
+    # Bytes per column of every source before and after normalizing, and the
+    # raw frame, normalized table and memory-mapped store compared
+    result = {}
+    for path in sources:
+        raw = data_loader.read_source(path)
+        columns = memory_report(raw, load_table(path)).fillna(0).astype(int)
+        comparison = store.memory_comparison(path)
+        result[path] = {'rows': len(raw), 'columns': columns.to_dict(orient='index'),
+                        'store': {name: int(value) for name, value in comparison.items()}}
+        print(f"{path}: {len(raw):,} rows", file=sys.stderr)
+        print(columns.to_string(), file=sys.stderr)
+        print("MiB", file=sys.stderr)
+        print((comparison / 2 ** 20).round(2).to_string(), file=sys.stderr)
+    return result
+
+
+def run_workers(rows, stores, products, categories, worker_counts, repeat):
+    # Cube build across 1..N worker processes; every count has to give the serial cells
+    table = TransactionTable.from_frame(make_transactions(rows, stores, products, categories))
+    frame = table.frame
+    # About one slice per store, or per worker when there are more workers than stores
+    partition_rows = max(10_000, int(rows * 1.1) // max(stores, max(worker_counts)))
+    serial_seconds, expected = _best_of(lambda: SalesCube.from_transactions(frame), repeat)
+    result = {'rows': rows, 'stores': stores, 'cpus': os.cpu_count(), 'partition_rows': partition_rows,
+              'serial_seconds': serial_seconds, 'workers': {}}
+    print(f"{rows:>10,} rows  serial        {serial_seconds * 1000:9.1f} ms", file=sys.stderr)
+    reference = None
+    for workers in worker_counts:
+        # Start the pool outside the timing
+        parallel.build_cube(frame, workers, partition_rows)
+        seconds, cube = _best_of(lambda: parallel.build_cube(frame, workers, partition_rows), repeat)
+        pd.testing.assert_frame_equal(cube.cells, expected.cells, check_exact=False)
+        if reference is None:
+            reference = cube.cells
+        # Bit-for-bit the same whatever the number of workers
+        pd.testing.assert_frame_equal(cube.cells, reference, check_exact=True)
+        result['workers'][workers] = {'seconds': seconds, 'speedup': serial_seconds / seconds}
+        print(f"{rows:>10,} rows  {workers:>2} workers    {seconds * 1000:9.1f} ms  "
+              f"speedup {serial_seconds / seconds:5.2f}x", file=sys.stderr)
+    parallel.shutdown()
+    return result
+
+
+def run_cold_start(app, repeat, pause):
+    # Median over `repeat` fresh processes started in the current directory
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', COLD_START_SCRIPT, app, json.dumps(APP_PAGES), str(pause)],
+                                capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.splitlines()[-1]))
+    result = {key: statistics.median(run[key] for run in runs)
+              for key in ['import_seconds', 'first_paint_seconds', 'process_seconds'] + APP_PAGES}
+    result['modules_after_first_paint'] = runs[0]['modules']
+    result['exceptions'] = runs[0]['exceptions']
+    for key in ['first_paint_seconds', 'process_seconds'] + APP_PAGES:
+        print(f"{key:<30} {result[key] * 1000:9.1f} ms", file=sys.stderr)
+    return result
+
+
+def _serialized(spans):
+    # Charts sent and bytes of PNG or figure JSON that went with them
+    sent = [span for span in spans if span['name'] == 'serialize']
+    return len(sent), sum(span.get('payload_bytes') or 0 for span in sent)
+
+
+def run_charts(app, repeat):
+    # Every page on both chart backends, run in this process so figure caches
+    # and perf spans are shared with the app: server CPU per page view (first
+    # view renders the charts, later views come from the cache) and payload
+    from streamlit.testing.v1 import AppTest
+
+    result = {}
+    for backend in figure_cache.BACKENDS:
+        figure_cache.figures.clear()
+        app_test = AppTest.from_file(app, default_timeout=600)
+        app_test.query_params['charts'] = backend
+        app_test.run()
+        pages = {}
+        for page in APP_PAGES:
+            views = []
+            for _ in range(1 + repeat):
+                perf.clear()
+                cpu_start, start = time.process_time(), time.perf_counter()
+                app_test.sidebar.radio[0].set_value(page).run()
+                views.append({'cpu_seconds': time.process_time() - cpu_start,
+                              'seconds': time.perf_counter() - start})
+                charts, payload = _serialized(perf.spans())
+            pages[page] = {
+                'charts': charts,
+                'payload_bytes': payload,
+                'first_view_cpu_seconds': views[0]['cpu_seconds'],
+                'cached_view_cpu_seconds': statistics.median(view['cpu_seconds'] for view in views[1:]),
+                'cached_view_seconds': statistics.median(view['seconds'] for view in views[1:]),
+            }
+            print(f"{backend:<10} {page:<22} {charts:>2} charts {payload / 1024:9.1f} KiB  "
+                  f"first {views[0]['cpu_seconds'] * 1000:7.1f} ms  "
+                  f"cached {pages[page]['cached_view_cpu_seconds'] * 1000:7.1f} ms CPU", file=sys.stderr)
+        result[backend] = {'pages': pages, 'exceptions': [e.value for e in app_test.exception]}
+    return result
+
+
+def run_downsampling(rows, stores, days_list, repeat):
+    # Payload of the daily line chart as plotly JSON, with and without
+    # downsampling, for growing numbers of days
+    # Running the app resets Streamlit's log levels
+    _quiet_streamlit()
+    backend, max_points = figure_cache.BACKEND, downsample.MAX_POINTS
+    figure_cache.BACKEND = 'plotly'
+    result = []
+    try:
+        for days in days_list:
+            table = TransactionTable.from_frame(make_transactions(rows, stores, days=days))
+            run = {'days': days, 'rows': rows}
+            for label, points in (('full', days + 1), ('downsampled', max_points)):
+                downsample.MAX_POINTS = points
+
+                def view():
+                    results.clear()
+                    figure_cache.figures.clear()
+                    perf.clear()
+                    customer.transaction_in_day_basis(table)
+
+                seconds, _ = _best_of(view, repeat)
+                run[label] = {'payload_bytes': _serialized(perf.spans())[1], 'seconds': seconds}
+            print(f"{days:>6} days  full {run['full']['payload_bytes'] / 1024:9.1f} KiB  "
+                  f"downsampled {run['downsampled']['payload_bytes'] / 1024:9.1f} KiB", file=sys.stderr)
+            result.append(run)
+    finally:
+        figure_cache.BACKEND, downsample.MAX_POINTS = backend, max_points
+    return result
+
+
+def _max_error(estimate, exact):
+    # Largest absolute difference between an approximate and the exact result
+    if isinstance(exact, (pd.DataFrame, pd.Series)):
+        estimate = estimate.reindex_like(exact).fillna(0)
+    return float(np.max(np.abs(np.asarray(estimate - exact, dtype=np.float64))))
+
+
+def run_approximate(rows, stores, days_list, repeat):
+    # First answer of the sampled pages in approximate mode against their
+    # exact computation, for growing histories (more days, more cube cells)
+    result = []
+    for days in days_list:
+        table = TransactionTable.from_frame(make_transactions(rows, stores, days=days))
+        run = {'days': days, 'rows': rows, 'cells': len(table.cube.cells), 'results': {}}
+        for name in approx.ESTIMATORS:
+            compute = customer.PAGE_RESULTS[name][0]
+
+            def first_preview():
+                approx._samples.clear()
+                return approx.preview(table, name)
+
+            approximate_seconds, preview = _best_of(first_preview, repeat)
+            exact_seconds, exact = _best_of(lambda: compute(table), repeat)
+            measured = run['results'][name] = {'approximate_seconds': approximate_seconds,
+                                               'exact_seconds': exact_seconds}
+            if preview is not None:
+                measured['bounds'] = preview.bounds
+                if name == 'transaction_in_hour_basis':
+                    measured['max_error'] = _max_error(preview.data, exact)
+                elif name == 'average_price_basis':
+                    measured['max_error'] = {key: _max_error(preview.data[key], exact[key])
+                                             for key in ('average_price', 'split_sales')}
+                else:
+                    measured['same_product'] = bool(preview.data['product'] == exact['product'])
+            print(f"{days:>6} days {run['cells']:>10,} cells  {name:<26} approximate "
+                  f"{approximate_seconds * 1000:7.1f} ms  exact {exact_seconds * 1000:7.1f} ms", file=sys.stderr)
+        result.append(run)
+    return result
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    # Ratio of current to baseline time for every (rows, function) in both reports
+    previous = {(run['rows'], name): stats['seconds']
+                for run in baseline['runs'] for name, stats in run['functions'].items()}
+    regressions = []
+    for run in report['runs']:
+        for name, stats in run['functions'].items():
+            before = previous.get((run['rows'], name))
+            if not before:
+                continue
+            ratio = stats['seconds'] / before
+            stats['baseline_seconds'] = before
+            stats['baseline_ratio'] = ratio
+            if ratio > threshold:
+                regressions.append({'rows': run['rows'], 'function': name, 'ratio': ratio})
+    return regressions
+
+
+# Modes other than the page timing run: (argument, run). The first argument
+# given picks the mode, and run(args) returns the report entries it adds.
+MODES = [
+    ('workers', lambda args: {'workers': [run_workers(rows, args.stores, args.products, args.categories,
+                                                      args.workers, args.repeat) for rows in args.rows]}),
+    ('filters', lambda args: {'filters': [run_filters(rows, args.stores, args.products, args.categories,
+                                                      args.repeat) for rows in args.rows]}),
+    ('drilldown', lambda args: {'drilldown': [run_drilldown(rows, args.stores, args.products, args.categories,
+                                                            args.repeat) for rows in args.rows]}),
+    ('append', lambda args: {'append': [run_append(rows, args.stores, args.products, args.categories, args.days[-1],
+                                                   args.batch_rows, args.repeat) for rows in args.rows]}),
+    ('kpis', lambda args: {'kpis': [run_kpis(rows, args.stores, args.products, args.categories, args.repeat)
+                                    for rows in args.rows]}),
+    ('forecast', lambda args: {'forecast': [run_forecast(rows, args.stores, args.products, args.categories,
+                                                         args.days[0], args.repeat) for rows in args.rows]}),
+    ('anomalies', lambda args: {'anomalies': [run_anomalies(rows, args.stores, args.products, args.categories, days,
+                                                            args.repeat)
+                                              for rows in args.rows for days in args.days]}),
+    ('downsample_methods', lambda args: {'downsample_methods': [run_downsample_methods(points, args.repeat)
+                                                                for points in args.rows]}),
+    ('memory_report', lambda args: {'memory': run_memory(
+        args.memory_report or [data_loader.TRANSACTIONS_PATH, data_loader.NEW_DATA_PATH])}),
+    ('cold_start', lambda args: {'cold_start': run_cold_start(args.app, args.repeat, args.pause)}),
+    ('charts', lambda args: {'charts': run_charts(args.app, args.repeat),
+                             'downsampling': run_downsampling(args.rows[0], args.stores, args.days, args.repeat)}),
+    ('approximate', lambda args: {'approximate': run_approximate(args.rows[0], args.stores, args.days, args.repeat)}),
+    ('scaling', lambda args: {'scaling': run_scaling(args.rows[0], args.scaling, args.products, args.repeat)}),
+]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every dashboard page function on synthetic data.")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--stores', type=int, default=3)
+    parser.add_argument('--products', type=int, default=80)
+    parser.add_argument('--categories', type=int, default=9)
+    parser.add_argument('--functions', nargs='+', default=PAGE_FUNCTIONS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="skip peak memory tracing (faster)")
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--scaling', type=int, nargs='+', metavar='COUNT',
+                        help="compare per-group loops with grouped passes for these store/category counts")
+    parser.add_argument('--workers', type=int, nargs='+', metavar='COUNT',
+                        help="time the cube build on these numbers of worker processes")
+    parser.add_argument('--filters', action='store_true',
+                        help="time sidebar filters through the (store, time) index against a full scan")
+    parser.add_argument('--drilldown', action='store_true',
+                        help="time single-product cells and rows through the product index against a full scan")
+    parser.add_argument('--append', action='store_true',
+                        help="time appending small batches and the first page data of every new version")
+    parser.add_argument('--batch-rows', type=int, default=100, help="rows per batch for --append")
+    parser.add_argument('--kpis', action='store_true', help="time the Home page KPIs and their cached lookup")
+    parser.add_argument('--forecast', action='store_true',
+                        help="time batched against per-series forecast fits and the cached forecast")
+    parser.add_argument('--anomalies', action='store_true',
+                        help="time seeding the revenue monitor from the cube against one transaction at a time")
+    parser.add_argument('--downsample-methods', action='store_true',
+                        help="time every downsampling method on a random walk of --rows points")
+    parser.add_argument('--memory-report', nargs='*', metavar='SOURCE',
+                        help="memory of the raw, normalized and memory-mapped forms of these sources "
+                             "(the dashboard's own by default)")
+    parser.add_argument('--cold-start', action='store_true',
+                        help="time the app's first paint and first page visits in fresh processes")
+    parser.add_argument('--charts', action='store_true',
+                        help="compare PNG and plotly charts: payload and server CPU per page view")
+    parser.add_argument('--days', type=int, nargs='+', default=[181, 3650],
+                        help="days of history for the downsampling part of --charts and for --approximate")
+    parser.add_argument('--approximate', action='store_true',
+                        help="time approximate previews of the sampled pages against their exact results")
+    parser.add_argument('--app', default=APP_PATH)
+    parser.add_argument('--pause', type=float, default=3.0,
+                        help="seconds spent on the Home page before visiting the others")
+    args = parser.parse_args(argv)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    regressions = []
+    mode = next((run for name, run in MODES if getattr(args, name) not in (None, False)), None)
+    if mode is not None:
+        report.update(mode(args))
+    else:
+        report.update({
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'runs': [run_size(rows, args.stores, args.products, args.categories, args.functions,
+                              not args.no_memory, args.repeat)
+                     for rows in args.rows],
+        })
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = compare(report, json.load(f), args.threshold)
+            report['regressions'] = regressions
+            for regression in regressions:
+                print(f"REGRESSION {regression['function']} at {regression['rows']:,} rows: "
+                      f"{regression['ratio']:.2f}x baseline", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import filters
+import perf
+
+# Finest grain kept by the cube, every page is a roll-up over these keys
+DIMENSIONS = ['store_location', 'product_category', 'product_detail', 'unit_price', 'date', 'hour']
+
+# Measures per cell; revenue_m2 is the sum of squared deviations of the
+# transaction revenues from the cell mean (Welford), and first_row is the
+# position of the first transaction in the cell so roll-ups can reproduce
+# first-appearance order
+MEASURES = {
+    'transaction_qty': 'sum',
+    'revenue': 'sum',
+    'count': 'sum',
+    'revenue_m2': 'sum',
+    'first_row': 'min',
+}
+
+ADDITIVE_MEASURES = {name: how for name, how in MEASURES.items() if name != 'revenue_m2'}
+
+CATEGORY_DIMENSIONS = ['store_location', 'product_category', 'product_detail']
+
+DAY = 86_400 * 10 ** 9
+
+# Days past the last one the packed keys leave room for, so appending new
+# days rarely changes the key layout
+SPARE_DAYS = 366
+
+
+def _aggregate(store_df, row_offset=0, first_row=None):
+    # Expects a normalized transaction frame (see transactions.normalize_transactions);
+    # first_row gives the row positions when the frame is a slice of a larger table
+    if first_row is None:
+        first_row = np.arange(row_offset, row_offset + len(store_df))
+    revenue = store_df['revenue'].to_numpy()
+    rows = pd.DataFrame({
+        'store_location': store_df['store_location'].to_numpy(),
+        'product_category': store_df['product_category'].to_numpy(),
+        'product_detail': store_df['product_detail'].to_numpy(),
+        'unit_price': store_df['unit_price'].to_numpy(),
+        'date': store_df['transaction_day'].to_numpy(),
+        'hour': store_df['hour'].to_numpy(),
+        'transaction_qty': store_df['transaction_qty'].to_numpy(),
+        'revenue': revenue,
+        'count': np.ones(len(store_df), dtype=np.int64),
+        'revenue_m2': np.zeros(len(store_df)),
+        'first_row': first_row,
+    })
+    return _combine(rows)
+
+
+def _merge(cells, by):
+    # Parallel form of Welford's update (Chan et al.): the M2 of merged cells
+    # is their own M2 plus count * (cell mean - merged mean)^2
+    grouped = cells.groupby(by, observed=True, sort=True)
+    merged = grouped.agg(MEASURES)
+    merged_mean = grouped['revenue'].transform('sum') / grouped['count'].transform('sum')
+    spread = cells['count'] * (cells['revenue'] / cells['count'] - merged_mean) ** 2
+    merged['revenue_m2'] += spread.groupby(grouped.ngroup()).sum().to_numpy()
+    return merged
+
+
+def _combine(cells):
+    for col in CATEGORY_DIMENSIONS:
+        if not isinstance(cells[col].dtype, pd.CategoricalDtype):
+            cells[col] = cells[col].astype('category')
+    return _merge(cells, DIMENSIONS).reset_index()
+
+
+def _days(dates):
+    return dates.to_numpy(dtype='datetime64[ns]').view(np.int64) // DAY
+
+
+class _KeyLayout:
+    # Cells packed into one int64 per key, ordered like the cells: category
+    # codes, rank of the unit price, day number and hour, each in its own
+    # radix. Only valid for the categories and the price and day ranges it
+    # was made for.
+
+    def __init__(self, categories, prices, first_day, last_day):
+        self.categories = categories
+        self.prices = prices
+        self.first_day = first_day
+        self.days = last_day - first_day + 1 + SPARE_DAYS
+        self.radices = [len(values) for values in categories] + [len(prices), self.days, 24]
+
+    @property
+    def fits(self):
+        return np.prod(self.radices, dtype=np.float64) < 2 ** 62
+
+    def pack(self, codes, prices, days, hours):
+        keys = np.zeros(len(hours), dtype=np.int64)
+        values = codes + [np.searchsorted(self.prices, prices), days - self.first_day, hours]
+        for value, radix in zip(values, self.radices):
+            keys = keys * radix + value
+        return keys
+
+
+def _in_range(days, span, hours):
+    return len(hours) == 0 or (days.min() >= 0 and days.max() < span and hours.min() >= 0 and hours.max() < 24)
+
+
+def _merged_m2(n_a, sum_a, m2_a, n_b, sum_b, m2_b):
+    # Same as _merge, for two cells of one key
+    mean = (sum_a + sum_b) / (n_a + n_b)
+    return m2_a + m2_b + n_a * (sum_a / n_a - mean) ** 2 + n_b * (sum_b / n_b - mean) ** 2
+
+
+def _insert(cells, new):
+    # Sorted cells of two disjoint sets of transactions merged: keys found in
+    # `cells` get the measures of `new` added (on copies of the measure
+    # columns), the other keys are inserted at their sorted position. None
+    # when the cells can't be packed into int64 keys.
+    categories, codes, new_codes = [], [], []
+    for col in CATEGORY_DIMENSIONS:
+        mine, theirs = cells[col].array, new[col].array
+        if not mine.categories.is_monotonic_increasing:
+            return None
+        merged = mine.categories
+        if not theirs.categories.isin(merged).all():
+            merged = merged.union(theirs.categories)
+            codes.append(merged.get_indexer(mine.categories)[mine.codes])
+        else:
+            codes.append(mine.codes)
+        categories.append(merged)
+        new_codes.append(merged.get_indexer(theirs.categories)[theirs.codes])
+    prices, new_prices = cells['unit_price'].to_numpy(), new['unit_price'].to_numpy()
+    days, new_days = _days(cells['date']), _days(new['date'])
+    hours, new_hours = cells['hour'].to_numpy().astype(np.int64), new['hour'].to_numpy().astype(np.int64)
+    first_day = min(days.min(), new_days.min())
+    layout = _KeyLayout(categories, np.union1d(prices, new_prices), first_day, max(days.max(), new_days.max()))
+    if not layout.fits or not _in_range(days - first_day, layout.days, hours):
+        return None
+    keys = layout.pack([code.astype(np.int64) for code in codes], prices, days, hours)
+    new_keys = layout.pack([code.astype(np.int64) for code in new_codes], new_prices, new_days, new_hours)
+
+    # Cells are sorted by key, and so are the new ones
+    positions = np.searchsorted(keys, new_keys)
+    found = positions < len(keys)
+    found[found] = keys[positions[found]] == new_keys[found]
+    at, source = positions[found], np.flatnonzero(found)
+    added, inserted = np.flatnonzero(~found), positions[~found]
+
+    measures = {name: cells[name].to_numpy().copy() for name in MEASURES}
+    theirs = {name: new[name].to_numpy() for name in MEASURES}
+    count, revenue = measures['count'][at], measures['revenue'][at]
+    measures['revenue_m2'][at] = _merged_m2(count, revenue, measures['revenue_m2'][at], theirs['count'][source],
+                                            theirs['revenue'][source], theirs['revenue_m2'][source])
+    for name in ['transaction_qty', 'revenue', 'count']:
+        measures[name][at] += theirs[name][source]
+    measures['first_row'][at] = np.minimum(measures['first_row'][at], theirs['first_row'][source])
+
+    data = {}
+    for col in cells.columns:
+        if col in CATEGORY_DIMENSIONS:
+            i = CATEGORY_DIMENSIONS.index(col)
+            values = np.insert(codes[i], inserted, new_codes[i][added].astype(codes[i].dtype, copy=False))
+            data[col] = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories[i]), validate=False)
+        else:
+            values = measures[col] if col in measures else cells[col].to_numpy()
+            data[col] = np.insert(values, inserted, new[col].to_numpy()[added].astype(values.dtype, copy=False))
+    return pd.DataFrame(data, copy=False)
+
+
+def _merge_cells(cells, new):
+    # Sorted, key-unique cells of two disjoint sets of transactions as one
+    if not len(cells) or not len(new):
+        return new if not len(cells) else cells
+    merged = _insert(cells, new)
+    if merged is None:
+        merged = pd.concat([cells, new], ignore_index=True)
+        for col in CATEGORY_DIMENSIONS:
+            merged[col] = union_categoricals([cells[col], new[col]], sort_categories=True)
+        merged = _combine(merged)
+    return merged
+
+
+# Cubes merged into one before the roll-ups carried forward from it are
+# brought up to date anyway
+MAX_BEHIND = 32
+
+# Keys roll-ups can group by besides the cell columns
+DERIVED_KEYS = {
+    'month': lambda cells: cells['date'].dt.month.rename('month'),
+}
+
+
+def _names(by):
+    return (by,) if isinstance(by, str) else tuple(by)
+
+
+def _fold(totals, by):
+    # Roll-ups by the same keys (as _merge makes them) of disjoint sets of
+    # transactions merged into one, with the same Chan et al. update
+    if len(totals) == 1:
+        return totals[0]
+    frames = [frame.reset_index() for frame in totals]
+    merged = pd.concat(frames, ignore_index=True)
+    for name in by:
+        if isinstance(frames[0][name].dtype, pd.CategoricalDtype):
+            merged[name] = union_categoricals([frame[name] for frame in frames], sort_categories=True)
+    return _merge(merged, list(by))
+
+
+class _Run:
+    # Sorted, key-unique cells of a stretch of transactions and the indexes
+    # over them, shared by every cube version that includes it
+
+    def __init__(self, cells):
+        self.cells = cells
+        self._lock = threading.Lock()
+        self._store_index = None
+        self._product_index = None
+
+    def store_index(self):
+        # (store, date) index, built on the first filter
+        with self._lock:
+            if self._store_index is None:
+                with perf.stage('index_cells', rows=len(self.cells)):
+                    self._store_index = filters.SortedIndex(self.cells['store_location'], self.cells['date'])
+            return self._store_index
+
+    def product_index(self):
+        # product_detail index, built on the first drill-down
+        with self._lock:
+            if self._product_index is None:
+                with perf.stage('index_product_cells', rows=len(self.cells)):
+                    self._product_index = filters.ValueIndex(self.cells['product_detail'])
+            return self._product_index
+
+    def totals(self, by):
+        return _merge(self.cells, [self.cells[name] if name in self.cells.columns else DERIVED_KEYS[name](self.cells)
+                                   for name in by])
+
+
+class SalesCube:
+    # Cells are kept as runs (see merge) and roll-ups (see totals) are kept
+    # per cube and carried forward to the cubes merged from it, so neither
+    # an append nor the pages after it go over every cell again
+
+    def __init__(self, cells, rows):
+        self.rows = rows
+        self._runs = [_Run(cells)]
+        # Roll-ups of this cube by key, and roll-ups of an earlier state
+        # with the cubes merged since, folded in on first use
+        self._totals = {}
+        self._behind = {}
+        # Months of the latest days kept per daily roll-up, for coarse cubes
+        self._windows = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_transactions(cls, store_df, row_offset=0, first_row=None):
+        return cls(_aggregate(store_df, row_offset, first_row), len(store_df))
+
+    @classmethod
+    def from_partitions(cls, cells, rows):
+        # Cells aggregated separately from disjoint slices of the same
+        # transactions; merging sorts them, so the order they come in doesn't matter
+        return cls(_combine(pd.concat(cells, ignore_index=True)), rows)
+
+    @classmethod
+    def coarse(cls, keys, windowed=(), months=None):
+        # No cells, only the roll-ups by `keys` and `windowed`, each merged
+        # with the other cube's on every merge; for sources too large to keep
+        # the cells. The ones by `windowed` (which include the date) only keep
+        # the days of the last `months` months.
+        cube = cls(None, 0)
+        cube._runs = None
+        cube._totals = {_names(by): None for by in list(keys) + list(windowed)}
+        cube._windows = {_names(by): months for by in windowed}
+        return cube
+
+    @property
+    def has_cells(self):
+        return self._runs is not None
+
+    @property
+    def cells(self):
+        # Every cell in one frame; the runs are merged into one on first use
+        with self._lock:
+            if self._runs is None:
+                raise ValueError("Only roll-ups are kept for this cube")
+            if len(self._runs) > 1:
+                with perf.stage('compact_cells', rows=self.rows):
+                    cells = self._runs[-1].cells
+                    for run in reversed(self._runs[:-1]):
+                        cells = _merge_cells(run.cells, cells)
+                self._runs = [_Run(cells)]
+            return self._runs[0].cells
+
+    def merge(self, other):
+        # Fold another cube (built from later transactions) into this one.
+        # Its cells become the newest run, which absorbs the runs before it
+        # while they are no larger (log-structured, like the table parts), so
+        # there are O(log n) runs and every cell is merged O(log n) times.
+        # Roll-ups are merged with the other cube's on first use, or right
+        # away for a coarse cube.
+        with self._lock:
+            self.rows += other.rows
+            if self._runs is None:
+                for by, totals in self._totals.items():
+                    theirs = other.totals(by)
+                    self._totals[by] = theirs if totals is None else _fold([totals, theirs], by)
+                self._trim()
+                return self
+            runs, block = list(self._runs), other.cells
+            while runs and len(runs[-1].cells) <= len(block):
+                block = _merge_cells(runs.pop().cells, block)
+            self._runs = runs + [_Run(block)]
+            for by, totals in self._totals.items():
+                self._behind[by] = (totals, [])
+            self._totals = {}
+            for by, (totals, cubes) in self._behind.items():
+                cubes = cubes + [other]
+                if len(cubes) >= MAX_BEHIND:
+                    # Nobody asked for this roll-up in a while, merge now so the list stays short
+                    totals, cubes = _fold([totals] + [cube.totals(by) for cube in cubes], by), []
+                self._behind[by] = (totals, cubes)
+        return self
+
+    def copy(self):
+        cube = SalesCube(None, self.rows)
+        with self._lock:
+            cube._runs = None if self._runs is None else list(self._runs)
+            cube._totals = dict(self._totals)
+            cube._behind = dict(self._behind)
+            cube._windows = self._windows
+        return cube
+
+    def update(self, new_transactions):
+        return self.merge(SalesCube.from_transactions(new_transactions, row_offset=self.rows))
+
+    def totals(self, by):
+        # Every measure per group of `by` (cell columns or DERIVED_KEYS), as
+        # _merge makes it; what rollup and revenue_stats read
+        by = _names(by)
+        with self._lock:
+            totals = self._totals.get(by)
+            if totals is not None:
+                return totals
+            if by in self._behind:
+                totals, cubes = self._behind.pop(by)
+                with perf.stage('merge_rollup', by=', '.join(by), rows=sum(cube.rows for cube in cubes)):
+                    totals = _fold([totals] + [cube.totals(by) for cube in cubes], by)
+            elif self._runs is None:
+                raise ValueError(f"No roll-up by {', '.join(by)} is kept for this cube")
+            else:
+                with perf.stage('rollup', by=', '.join(by), rows=self.rows):
+                    totals = _fold([run.totals(by) for run in self._runs], by)
+            self._totals[by] = totals
+            return totals
+
+    def rollup(self, by, cells=None):
+        # Single grouped pass over the additive measures; use revenue_stats
+        # when the spread of revenue is needed as well
+        if cells is None:
+            return self.totals(by)[list(ADDITIVE_MEASURES)]
+        return cells.groupby(by, observed=True, sort=True).agg(ADDITIVE_MEASURES)
+
+    def revenue_stats(self, by, cells=None):
+        # Revenue sum, mean and (sample) standard deviation per transaction
+        totals = self.totals(by) if cells is None else _merge(cells, by)
+        n = totals['count']
+        return pd.DataFrame({
+            'sum': totals['revenue'],
+            'mean': totals['revenue'] / n,
+            'std': np.sqrt(totals['revenue_m2'] / (n - 1)).where(n > 1),
+        })
+
+    def rollup_last_months(self, by, months):
+        # rollup over the last `months` months, counted back from the latest
+        # date, added up from the daily roll-up
+        by = list(_names(by))
+        if self._windows.get(tuple(by) + ('date',), months) < months:
+            raise ValueError(f"Only the last {self._windows[tuple(by) + ('date',)]} months are kept by day")
+        daily = self.rollup(by + ['date'])
+        dates = daily.index.get_level_values('date')
+        end_date = dates.max()
+        start_date = end_date - pd.DateOffset(months=months)
+        recent = daily[(dates >= start_date) & (dates <= end_date)]
+        return recent.groupby(level=by, observed=True, sort=True).agg(ADDITIVE_MEASURES)
+
+    def _trim(self):
+        # Days before the window of a coarse daily roll-up dropped. The
+        # latest date only moves forward, so nothing dropped here would be
+        # back in the window after later merges.
+        for by, months in self._windows.items():
+            totals = self._totals[by]
+            if totals is not None and len(totals):
+                dates = totals.index.get_level_values('date')
+                self._totals[by] = totals[dates >= dates.max() - pd.DateOffset(months=months)]
+
+    def first_seen(self, column, cells=None):
+        # Values of a dimension in the order they first appear in the transactions
+        if cells is None:
+            return self.rollup(column)['first_row'].sort_values().index
+        return cells.groupby(column, observed=True)['first_row'].min().sort_values().index
+
+    def _cell_runs(self):
+        with self._lock:
+            if self._runs is None:
+                raise ValueError("Only roll-ups are kept for this cube")
+            return list(self._runs)
+
+    def select(self, data_filter):
+        # Cells passing a filters.DataFilter, one index slice per run
+        runs = self._cell_runs()
+        selected = [filters.select(run.cells, run.store_index(), data_filter) for run in runs]
+        return self._merged(selected)
+
+    def product_cells(self, product):
+        # Cells of one product_detail, in cube order: a slice of the product
+        # index of every run instead of a comparison over every cell
+        runs = self._cell_runs()
+        return self._merged([run.cells.take(run.product_index().positions(product)) for run in runs])
+
+    def _merged(self, selected):
+        cells = selected[-1]
+        for frame in reversed(selected[:-1]):
+            cells = _merge_cells(frame, cells)
+        return cells.reset_index(drop=True) if len(selected) > 1 else cells
+
+    def memory_usage(self):
+        if self._runs is None:
+            return pd.Series({', '.join(by): int(totals.memory_usage(index=True, deep=True).sum())
+                              for by, totals in self._totals.items() if totals is not None})
+        return self.cells.memory_usage(index=True, deep=True)
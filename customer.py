@@ -1,375 +1,980 @@
-from typing import Any
-
-import matplotlib.pyplot as plt
-import streamlit as st
-import plotly.express as px
-import datetime
-import pandas as pd
-import seaborn as sns
-
-def top_product_categories(df):
-    top_products = df.groupby(['store_location', 'product_detail', 'unit_price'])['transaction_qty'].sum().reset_index()
-    top_products_by_location = top_products.loc[top_products.groupby('store_location')['transaction_qty'].idxmax()]
-    top_products_by_location = top_products_by_location.sort_values('transaction_qty', ascending=False)
-
-    # Create the bar plot
-    plt.figure(figsize=(16, 10))
-    sns.barplot(data=top_products_by_location, x='store_location', y='transaction_qty', hue='product_detail')
-    plt.title('Highest Selling Products by Location')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    # Display the plot in Streamlit
-    st.pyplot(plt)
-
-def transaction_in_hour_basis(store_df):
-    transaction_count_by_hour_location = store_df.groupby(['store_location', 'hour'])['transaction_id'].count().unstack(
-        fill_value=0)
-    num_bars = transaction_count_by_hour_location.shape[0] * transaction_count_by_hour_location.shape[1]
-    # Define a list of colors (make sure you have enough colors to cover all bars)
-    colors = ['skyblue', 'lightgreen', 'salmon', 'black', 'orange', 'yellow', 'lightpink', 'purple', 'darkcyan',
-              'mediumseagreen', 'gold', 'lightsteelblue', 'tomato', 'navy', 'mediumorchid']
-    # If you have fewer colors than bars, you can repeat the list of colors to match the number of bars
-    if len(colors) < num_bars:
-        colors = (colors * ((num_bars // len(colors)) + 1))[:num_bars]
-    # Set the Streamlit title
-    st.title("Transactions by Hour of the Day for Each Location")
-    # Plotting the result with time labels using Matplotlib
-    fig, ax = plt.subplots(figsize=(10, 6))
-    transaction_count_by_hour_location.plot(kind='bar', ax=ax, color=colors)
-    # Set plot labels and title
-    ax.set_title('Transactions by Hour of the Day for Each Location')
-    ax.set_xlabel('Hour')
-    ax.set_ylabel('Number of Transactions')
-    ax.set_xticklabels(transaction_count_by_hour_location.index, rotation=0)
-    ax.legend(title='Store Location')
-    # Display the plot in Streamlit
-    st.pyplot(fig)
-
-
-def transaction_in_day_basis(store_df):
-    # Load data into DataFrame (assuming it's already loaded as store_df)
-    # store_df = pd.read_csv('Coffee_Shop_Sales.csv')  # Uncomment if loading from a file
-    store_df['transaction_date'] = pd.to_datetime(store_df['transaction_date'])
-    # Calculate the transaction amount for each transaction
-    store_df['transaction_amount'] = store_df['transaction_qty'] * store_df['unit_price']
-    # Create a new column for the day of the transaction
-    store_df['transaction_day'] = store_df['transaction_date'].dt.floor('D')
-    # Group by 'transaction_day' and 'store_location' and calculate the average transaction amount per day for each store
-    average_transaction_per_day_location = store_df.groupby(['transaction_day', 'store_location'])['transaction_amount'].mean().reset_index()
-    # Set up Streamlit app layout and title
-    st.title("Average Transaction Amount per Day by Store Location")
-    st.write("This chart shows the daily average transaction amount for each store location.")
-    # Plot the average transaction amount per day for each store location using matplotlib
-    fig, ax = plt.subplots(figsize=(12, 6))
-    for location in average_transaction_per_day_location['store_location'].unique():
-        location_data = average_transaction_per_day_location[
-            average_transaction_per_day_location['store_location'] == location]
-        ax.plot(location_data['transaction_day'], location_data['transaction_amount'], label=location)
-    # Customize plot
-    ax.set_title('Average Transaction Amount per Day by Store Location')
-    ax.set_xlabel('Transaction Day')
-    ax.set_ylabel('Average Transaction Amount')
-    ax.grid(axis='y', linestyle='--', alpha=0.7)
-    ax.spines[['top', 'right']].set_visible(False)
-    plt.xticks(rotation=45)
-    plt.legend(title='Store Location')
-    plt.tight_layout()
-    # Display plot in Streamlit
-    st.pyplot(fig)
-
-def transaction_in_month_basis(store_df):
-    # Calculate revenue
-    store_df['revenue'] = store_df['transaction_qty'] * store_df['unit_price']
-    # Calculate daily revenue
-    daily_revenue = store_df.groupby('transaction_date')['revenue'].sum().reset_index()
-    # Extract the month and calculate monthly statistics
-    store_df['month'] = store_df['transaction_date'].dt.month
-    monthly_stats = store_df.groupby('month').agg({
-        'revenue': ['sum', 'mean', 'std']
-    }).round(2)
-    # Display monthly statistics in Streamlit
-    st.header("Monthly Revenue Statistics")
-    st.write(monthly_stats)
-    # Plotting Monthly Revenue
-    fig, ax = plt.subplots(figsize=(10, 6))
-    ax.bar(monthly_stats.index, monthly_stats[('revenue', 'sum')], color='skyblue')
-    ax.set_title('Monthly Revenue')
-    ax.set_xlabel('Month')
-    ax.set_ylabel('Revenue ($)')
-    ax.set_xticks(monthly_stats.index)
-    plt.tight_layout()
-    # Display the plot in Streamlit
-    st.pyplot(fig)
-
-def average_price_basis(store_df):
-
-    # Assuming store_df is already loaded with transaction data
-    store_df['transaction_date'] = pd.to_datetime(store_df['transaction_date'])
-
-    # Calculate the overall average price across all locations
-    average_price = store_df['unit_price'].mean()
-
-    # Get unique store locations
-    store_locations = store_df['store_location'].unique()
-
-    # Display average price
-    st.write(f"### Overall Average Unit Price: ${average_price:.2f}")
-
-    # Loop over each store location to create a bar plot
-    for location in store_locations:
-        # Filter data for the specific location
-        location_data = store_df[store_df['store_location'] == location]
-
-        # Separate data based on price relative to the average price
-        lower_than_average = location_data[location_data['unit_price'] < average_price]
-        higher_than_average = location_data[location_data['unit_price'] >= average_price]
-
-        # Calculate total sales quantity for each category
-        lower_sales = lower_than_average['transaction_qty'].sum()
-        higher_sales = higher_than_average['transaction_qty'].sum()
-
-        # Prepare data for plotting
-        categories = ['Lower than Average Price', 'Higher than Average Price']
-        sales = [lower_sales, higher_sales]
-
-        # Plotting
-        fig, ax = plt.subplots(figsize=(8, 4))
-        ax.bar(categories, sales, color=['blue', 'orange'])
-        ax.set_title(f'Sales Comparison: Lower vs Higher than Average Price in {location}')
-        ax.set_ylabel('Total Sales Quantity')
-        ax.set_xlabel('Price Category')
-
-        # Display plot in Streamlit
-        st.pyplot(fig)
-
-        # Display details for each location in Streamlit
-        st.write(f"#### Store Location: {location}")
-        st.write(f"Average Unit Price: ${average_price:.2f}")
-        st.write(f"Total Sales for Lower than Average Price: {lower_sales}")
-        st.write(f"Total Sales for Higher than Average Price: {higher_sales}")
-        st.write("---")
-
-def average_category_transaction(store_df):
-
-    # Filter data for the last 6 months
-    end_date = store_df['transaction_date'].max()
-    start_date = end_date - pd.DateOffset(months=6)
-    filtered_data = store_df[(store_df['transaction_date'] >= start_date) & (store_df['transaction_date'] <= end_date)]
-
-    # Calculate average daily sales
-    average_daily_sales = filtered_data.groupby(['store_location', 'product_category'])['transaction_qty'].mean().reset_index()
-
-    # Get the maximum and minimum sales for each store
-    max_sales = average_daily_sales.loc[average_daily_sales.groupby('store_location')['transaction_qty'].idxmax()]
-    min_sales = average_daily_sales.loc[average_daily_sales.groupby('store_location')['transaction_qty'].idxmin()]
-
-    # Merge the max and min sales data
-    result = pd.merge(max_sales, min_sales, on='store_location', suffixes=('_max', '_min'))
-
-    # Display the result table in Streamlit
-    st.write("Highest and Lowest Average Sales by Store Location", result)
-
-    # Create the bar plot
-    fig, ax = plt.subplots(figsize=(10, 6))
-
-    bar_width = 0.4
-    locations = range(len(result))
-
-    # Plot the highest average sales
-    ax.bar(
-        [pos - bar_width / 2 for pos in locations],
-        result['transaction_qty_max'],
-        width=bar_width,
-        color='skyblue',
-        label='Highest Average Sales'
-    )
-
-    # Plot the lowest average sales
-    ax.bar(
-        [pos + bar_width / 2 for pos in locations],
-        result['transaction_qty_min'],
-        width=bar_width,
-        color='salmon',
-        label='Lowest Average Sales'
-    )
-
-    # Set labels and title
-    ax.set_xticks(locations)
-    ax.set_xticklabels(result['store_location'])
-    ax.set_xlabel('Store Location')
-    ax.set_ylabel('Average Sold Quantity')
-    ax.set_title('Highest and Lowest Average Sold Quantity by Product Category for Each Location')
-    plt.legend()
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
-
-def category_basis_transaction(store_df):
-    # Automatically convert any date-related columns to datetime format
-    for col in store_df.columns:
-        if 'date' in col.lower():
-            store_df[col] = pd.to_datetime(store_df[col], errors='coerce')  # Handle conversion errors gracefully
-
-    # Assuming store_df is your DataFrame containing product sales data
-    for category in store_df['product_category'].unique():
-        # Filter data for this category
-        category_data : Any = store_df[store_df['product_category'] == category]
-
-        # Calculate total sales for each product in this category
-        product_sales : Any = category_data.groupby('product_detail')['transaction_qty'].sum().sort_values(ascending=True)
-
-        # Create the plot
-        plt.figure(figsize=(12, max(6, len(product_sales) * 0.4)))  # Adjust height dynamically based on the number of products
-
-        # Create horizontal bar plot
-        bars = plt.barh(product_sales.index, product_sales.values, color='skyblue')
-
-        # Add value labels on the bars
-        for bar in bars:
-            width = bar.get_width()
-            plt.text(width, bar.get_y() + bar.get_height() / 2,
-                     f'{int(width):,}',
-                     ha='left', va='center', fontweight='bold')
-
-        plt.title(f'Total Sales by Product - {category}')
-        plt.xlabel('Total Quantity Sold')
-        plt.ylabel('Product Name')
-
-        # Adjust layout
-        plt.tight_layout()
-
-        # Display the plot using Streamlit
-        st.pyplot(plt)
-
-        # Clear the figure to avoid overlap with the next plot
-        plt.clf()
-def category_transaction(store_df):
-    # Convert 'transaction_date' to datetime format
-    store_df['transaction_date'] = pd.to_datetime(store_df['transaction_date'])
-
-    # Filter data for the last 6 months
-    end_date = store_df['transaction_date'].max()
-    start_date = end_date - pd.DateOffset(months=6)
-    filtered_data = store_df[(store_df['transaction_date'] >= start_date) & (store_df['transaction_date'] <= end_date)]
-
-    # Calculate total sales quantity for each product category in each location
-    category_sales = filtered_data.groupby(['store_location', 'product_category'])[
-        'transaction_qty'].sum().unstack().fillna(0)
-
-    # Create the plot
-    fig, ax = plt.subplots(figsize=(12, 6))
-    category_sales.plot(kind='bar', ax=ax, colormap='tab20')  # Use a colormap for distinct category colors
-    ax.set_title('Total Sales Quantity of Each Product Category in Each Location (Last 6 Months)')
-    ax.set_xlabel('Store Location')
-    ax.set_ylabel('Total Sales Quantity')
-    plt.xticks(rotation=45)
-    plt.legend(title='Product Category', bbox_to_anchor=(1.05, 1), loc='upper left')  # Place legend outside the plot
-    plt.tight_layout()
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
-
-def revenue_day(store_df):
-    # Calculate revenue
-    store_df['revenue'] = store_df['transaction_qty'] * store_df['unit_price']
-
-    # Extract the hour and categorize time of day
-    store_df['hour'] = pd.to_datetime(store_df['transaction_time']).dt.hour
-    store_df['time_of_day'] = pd.cut(
-        store_df['hour'],
-        bins=[0, 11, 16, 23],
-        labels=['Morning', 'Afternoon', 'Evening']
-    )
-
-    # Calculate revenue by time of day for Lower Manhattan
-    lower_manhattan_revenue = store_df[store_df['store_location'] == "Lower Manhattan"].groupby('time_of_day')[
-        'revenue'].sum()
-
-    # Display the revenue data
-    st.write("Lower Manhattan Revenue by Time of Day:")
-    st.write(lower_manhattan_revenue)
-
-    # Set up the plot style
-    sns.set(style='whitegrid')
-
-    # Create the plot
-    fig, ax = plt.subplots(figsize=(10, 6))
-    sns.barplot(x=lower_manhattan_revenue.index, y=lower_manhattan_revenue.values, palette='viridis', ax=ax)
-
-    # Customize plot appearance
-    ax.set_title('Lower Manhattan Revenue by Time of Day')
-    ax.set_xlabel('Time of Day')
-    ax.set_ylabel('Revenue ($)')
-
-    # Display the plot in Streamlit
-    st.pyplot(fig)
-
-
-def lowest_sale_product(store_df):
-    # Convert 'transaction_date' to datetime format
-    store_df['transaction_date'] = pd.to_datetime(store_df['transaction_date'])
-
-    # Get the product with the lowest sales
-    product_sales = store_df.groupby('product_detail').agg({'transaction_qty': 'sum'}).sort_values('transaction_qty')
-    lowest_sales_product = product_sales.index[0]
-    lowest_sales_data = store_df[store_df['product_detail'] == lowest_sales_product]
-
-    # Get the most sold time by location for the product with the lowest sales
-    lowest_sales_time_location = lowest_sales_data.groupby(['store_location', 'transaction_time']).agg(
-        {'transaction_qty': 'sum'}).reset_index()
-    most_sold_time_by_location = lowest_sales_time_location.loc[
-        lowest_sales_time_location.groupby('store_location')['transaction_qty'].idxmax()]
-
-    # Display the product with the lowest sales and the most sold time by location
-    st.write("### Product with the Lowest Sales:", lowest_sales_product)
-    st.write("Most Sold Time by Location for the Product with the Lowest Sales:")
-    st.write(most_sold_time_by_location)
-
-    # Add hour column for plotting
-    lowest_sales_data['hour'] = pd.to_datetime(lowest_sales_data['transaction_time']).dt.hour
-
-    # Plot hourly sales distribution for the lowest sales product
-    st.write(f"### Hourly Sales Distribution of {lowest_sales_product} by Location")
-    plt.figure(figsize=(12, 6))
-    sns.barplot(data=lowest_sales_data, x='hour', y='transaction_qty', hue='store_location', ci=None)
-    plt.title(f'Hourly Sales Distribution of {lowest_sales_product} by Location')
-    plt.xlabel('Hour of Day')
-    plt.ylabel('Quantity Sold')
-    plt.ylim(0, 2)  # Set the y-axis range from 1 to 10 to fit your specified range
-    plt.legend(title='Location')
-    plt.tight_layout()
-
-    # Display the plot in Streamlit
-    st.pyplot(plt)
-
-    # Display total quantity sold by location
-    st.write("### Total Quantity Sold by Location")
-    st.write(lowest_sales_data.groupby('store_location')['transaction_qty'].sum())
-
-
-def display_barista_revenue(store_df):
-    # Filter for 'Ouro Brasileiro shot' and calculate total revenue by store location
-    barista_revenue = store_df[store_df['product_detail'] == 'Ouro Brasileiro shot'].groupby("store_location").agg({
-        'transaction_qty': 'sum',
-        'unit_price': 'first'  # Assuming unit_price is the same for each store_location-product_detail
-    }).assign(total_revenue=lambda x: x['transaction_qty'] * x['unit_price'])
-
-    # Sort by total revenue
-    barista_revenue = barista_revenue.sort_values('total_revenue', ascending=False)
-
-    # Plotting the total revenue by store location
-    st.write("### Total Revenue from Ouro Brasileiro shot by Location")
-    plt.figure(figsize=(12, 6))
-    sns.barplot(data=barista_revenue.reset_index(), x='store_location', y='total_revenue')
-    plt.xticks(rotation=45, ha='right')
-    plt.title('Total Revenue from Ouro Brasileiro shot by Location')
-    plt.ylabel('Total Revenue ($)')
-    plt.tight_layout()
-
-    # Display the plot in Streamlit
-    st.pyplot(plt)
-
-    # Display the detailed revenue breakdown in Streamlit
-    st.write("### Detailed Revenue Breakdown")
-    st.write(barista_revenue[['transaction_qty', 'unit_price', 'total_revenue']])
+from typing import Any
+
+import matplotlib.pyplot as plt
+import streamlit as st
+import plotly.express as px
+import plotly.graph_objects as go
+import pandas as pd
+import seaborn as sns
+
+import anomaly
+import approx
+import downsample
+import figure_cache
+import forecast
+import perf
+import results
+from transactions import as_table
+
+# Every page function is split in three: <name>_data(table, *params) computes
+# what the page shows without touching Streamlit, <name>_figures(data, *params)
+# lists its charts as (chart, chart params, draw, plot) and the page function
+# itself only displays them. precompute.py runs the first two headless.
+
+
+def show_figures(table, figures, version=None):
+    # version: charts drawn from other data than the table's (approximate previews)
+    for name, params, draw, plot in figures:
+        if version is None:
+            figure_cache.show(name, params, table.version, draw, plot, table.persistent)
+        else:
+            figure_cache.show(name, params, version, draw, plot)
+
+
+def show_result(table, name, params, display):
+    # display(data, version) draws a page result. In approximate mode a result
+    # that isn't computed yet is drawn from a sample first, and the rest of
+    # the page goes on without waiting for the exact one, computed in the
+    # background. A fragment polls for it and reruns the app once it is in.
+    compute = PAGE_RESULTS[name][0]
+    preview = None
+    if approx.enabled(st.query_params) and not results.ready(table, name, params):
+        preview = approx.preview(table, name)
+    if preview is None:
+        display(results.get(table, name, params, compute), None)
+        return
+    pending = approx.refine(table, name, params, compute)
+
+    @st.fragment(run_every=approx.POLL_SECONDS)
+    def refined():
+        if pending.done():
+            # Raises here if the exact computation failed
+            pending.result()
+            st.rerun()
+        st.caption(preview.caption)
+        display(preview.data, preview.version)
+
+    refined()
+
+
+def top_product_categories_data(table):
+    top_products = table.cube.rollup(['store_location', 'product_detail', 'unit_price'])['transaction_qty'].reset_index()
+    top_products_by_location = top_products.loc[top_products.groupby('store_location', observed=True)['transaction_qty'].idxmax()]
+    return top_products_by_location.sort_values('transaction_qty', ascending=False)
+
+
+def top_product_categories_figures(top_products_by_location):
+    # Create the bar plot
+    def draw():
+        fig = plt.figure(figsize=(16, 10))
+        sns.barplot(data=top_products_by_location, x='store_location', y='transaction_qty', hue='product_detail')
+        plt.title('Highest Selling Products by Location')
+        plt.xticks(rotation=45)
+        plt.tight_layout()
+        return fig
+
+    def plot():
+        return px.bar(top_products_by_location, x='store_location', y='transaction_qty', color='product_detail',
+                      barmode='group', title='Highest Selling Products by Location')
+
+    return [('top_product_categories', (), draw, plot)]
+
+@perf.traced
+def top_product_categories(df):
+    table = as_table(df)
+    data = results.get(table, 'top_product_categories', (), top_product_categories_data)
+
+    # Display the plot in Streamlit
+    show_figures(table, top_product_categories_figures(data))
+
+
+def transaction_in_hour_basis_data(table):
+    return table.cube.rollup(['store_location', 'hour'])['count'].unstack(fill_value=0)
+
+
+def transaction_in_hour_basis_figures(transaction_count_by_hour_location):
+    num_bars = transaction_count_by_hour_location.shape[0] * transaction_count_by_hour_location.shape[1]
+    # Define a list of colors (make sure you have enough colors to cover all bars)
+    colors = ['skyblue', 'lightgreen', 'salmon', 'black', 'orange', 'yellow', 'lightpink', 'purple', 'darkcyan',
+              'mediumseagreen', 'gold', 'lightsteelblue', 'tomato', 'navy', 'mediumorchid']
+    # If you have fewer colors than bars, you can repeat the list of colors to match the number of bars
+    if len(colors) < num_bars:
+        colors = (colors * ((num_bars // len(colors)) + 1))[:num_bars]
+
+    # Plotting the result with time labels using Matplotlib
+    def draw():
+        fig, ax = plt.subplots(figsize=(10, 6))
+        transaction_count_by_hour_location.plot(kind='bar', ax=ax, color=colors)
+        # Set plot labels and title
+        ax.set_title('Transactions by Hour of the Day for Each Location')
+        ax.set_xlabel('Hour')
+        ax.set_ylabel('Number of Transactions')
+        ax.set_xticklabels(transaction_count_by_hour_location.index, rotation=0)
+        ax.legend(title='Store Location')
+        return fig
+
+    def plot():
+        counts = transaction_count_by_hour_location.stack().rename('count').reset_index()
+        fig = px.bar(counts, x='store_location', y='count', color=counts['hour'].astype(str), barmode='group',
+                     color_discrete_sequence=colors, title='Transactions by Hour of the Day for Each Location',
+                     labels={'store_location': 'Store Location', 'count': 'Number of Transactions', 'color': 'Hour'})
+        return fig
+
+    return [('transaction_in_hour_basis', (), draw, plot)]
+
+@perf.traced
+def transaction_in_hour_basis(store_df):
+    table = as_table(store_df)
+    # Set the Streamlit title
+    st.title("Transactions by Hour of the Day for Each Location")
+
+    # Display the plot in Streamlit
+    def display(data, version):
+        show_figures(table, transaction_in_hour_basis_figures(data), version)
+
+    show_result(table, 'transaction_in_hour_basis', (), display)
+
+
+def transaction_in_day_basis_data(table):
+    # Average transaction amount per day for each store, rolled up from the cube
+    daily = table.cube.rollup(['date', 'store_location'])
+    average_transaction_per_day_location = (daily['revenue'] / daily['count']).rename('transaction_amount').reset_index()
+    return average_transaction_per_day_location.rename(columns={'date': 'transaction_day'})
+
+
+def transaction_in_day_basis_figures(average_transaction_per_day_location):
+    # Plot the average transaction amount per day for each store location using matplotlib
+    def draw():
+        fig, ax = plt.subplots(figsize=(12, 6))
+        # One grouped pass, locations in order of appearance
+        for location, location_data in average_transaction_per_day_location.groupby(
+                'store_location', observed=True, sort=False):
+            ax.plot(location_data['transaction_day'], location_data['transaction_amount'], label=location)
+        # Customize plot
+        ax.set_title('Average Transaction Amount per Day by Store Location')
+        ax.set_xlabel('Transaction Day')
+        ax.set_ylabel('Average Transaction Amount')
+        ax.grid(axis='y', linestyle='--', alpha=0.7)
+        ax.spines[['top', 'right']].set_visible(False)
+        plt.xticks(rotation=45)
+        plt.legend(title='Store Location')
+        plt.tight_layout()
+        return fig
+
+    # Client-side version: at most downsample.MAX_POINTS points per location
+    def plot():
+        fig = go.Figure()
+        for location, location_data in average_transaction_per_day_location.groupby(
+                'store_location', observed=True, sort=False):
+            location_data = downsample.series(location_data, 'transaction_day', 'transaction_amount')
+            fig.add_trace(go.Scatter(x=location_data['transaction_day'], y=location_data['transaction_amount'],
+                                     mode='lines', name=location))
+        fig.update_layout(title='Average Transaction Amount per Day by Store Location',
+                          xaxis_title='Transaction Day', yaxis_title='Average Transaction Amount',
+                          legend_title='Store Location')
+        return fig
+
+    return [('transaction_in_day_basis', (), draw, plot)]
+
+@perf.traced
+def transaction_in_day_basis(store_df):
+    table = as_table(store_df)
+    data = results.get(table, 'transaction_in_day_basis', (), transaction_in_day_basis_data)
+    # Set up Streamlit app layout and title
+    st.title("Average Transaction Amount per Day by Store Location")
+    st.write("This chart shows the daily average transaction amount for each store location.")
+
+    # Display plot in Streamlit
+    show_figures(table, transaction_in_day_basis_figures(data))
+
+
+def transaction_in_month_basis_data(table):
+    # Monthly revenue sum, mean and std merged from the cube cells
+    monthly_stats = table.cube.revenue_stats('month')
+    monthly_stats.columns = pd.MultiIndex.from_product([['revenue'], monthly_stats.columns])
+    return monthly_stats.round(2)
+
+
+def transaction_in_month_basis_figures(monthly_stats):
+    # Plotting Monthly Revenue
+    def draw():
+        fig, ax = plt.subplots(figsize=(10, 6))
+        ax.bar(monthly_stats.index, monthly_stats[('revenue', 'sum')], color='skyblue')
+        ax.set_title('Monthly Revenue')
+        ax.set_xlabel('Month')
+        ax.set_ylabel('Revenue ($)')
+        ax.set_xticks(monthly_stats.index)
+        plt.tight_layout()
+        return fig
+
+    def plot():
+        fig = px.bar(x=monthly_stats.index, y=monthly_stats[('revenue', 'sum')], title='Monthly Revenue',
+                     labels={'x': 'Month', 'y': 'Revenue ($)'}, color_discrete_sequence=['skyblue'])
+        fig.update_xaxes(tickmode='array', tickvals=monthly_stats.index)
+        return fig
+
+    return [('transaction_in_month_basis', (), draw, plot)]
+
+@perf.traced
+def transaction_in_month_basis(store_df):
+    table = as_table(store_df)
+    monthly_stats = results.get(table, 'transaction_in_month_basis', (), transaction_in_month_basis_data)
+    # Display monthly statistics in Streamlit
+    st.header("Monthly Revenue Statistics")
+    st.write(monthly_stats)
+
+    # Display the plot in Streamlit
+    show_figures(table, transaction_in_month_basis_figures(monthly_stats))
+
+
+def average_price_basis_data(table):
+    cube = table.cube
+    prices = cube.rollup(['store_location', 'unit_price']).reset_index()
+
+    # Calculate the overall average price across all locations
+    average_price = (prices['unit_price'] * prices['count']).sum() / prices['count'].sum()
+
+    return {
+        'average_price': average_price,
+        # Total sales below and above the average price for every location at once
+        'split_sales': price_split_sales(prices, average_price),
+        # Get unique store locations
+        'store_locations': cube.first_seen('store_location'),
+    }
+
+
+def average_price_basis_figures(data):
+    # One bar plot per store location
+    figures = []
+    for location in data['store_locations']:
+        # Prepare data for plotting
+        categories = ['Lower than Average Price', 'Higher than Average Price']
+        sales = [data['split_sales'].at[location, False], data['split_sales'].at[location, True]]
+
+        # Plotting
+        def draw(location=location, sales=sales):
+            fig, ax = plt.subplots(figsize=(8, 4))
+            ax.bar(categories, sales, color=['blue', 'orange'])
+            ax.set_title(f'Sales Comparison: Lower vs Higher than Average Price in {location}')
+            ax.set_ylabel('Total Sales Quantity')
+            ax.set_xlabel('Price Category')
+            return fig
+
+        def plot(location=location, sales=sales):
+            return px.bar(x=categories, y=sales, color=categories, color_discrete_sequence=['blue', 'orange'],
+                          title=f'Sales Comparison: Lower vs Higher than Average Price in {location}',
+                          labels={'x': 'Price Category', 'y': 'Total Sales Quantity', 'color': ''})
+
+        figures.append(('average_price_basis', (location,), draw, plot))
+    return figures
+
+@perf.traced
+def average_price_basis(store_df):
+
+    table = as_table(store_df)
+
+    def display(data, version):
+        average_price = data['average_price']
+        split_sales = data['split_sales']
+
+        # Display average price
+        st.write(f"### Overall Average Unit Price: ${average_price:.2f}")
+
+        # Loop over each store location to show its bar plot
+        for figure in average_price_basis_figures(data):
+            location = figure[1][0]
+            # Calculate total sales quantity for each category
+            lower_sales = split_sales.at[location, False]
+            higher_sales = split_sales.at[location, True]
+
+            # Display plot in Streamlit
+            show_figures(table, [figure], version)
+
+            # Display details for each location in Streamlit
+            st.write(f"#### Store Location: {location}")
+            st.write(f"Average Unit Price: ${average_price:.2f}")
+            st.write(f"Total Sales for Lower than Average Price: {lower_sales}")
+            st.write(f"Total Sales for Higher than Average Price: {higher_sales}")
+            st.write("---")
+
+    show_result(table, 'average_price_basis', (), display)
+
+def price_split_sales(cells, average_price):
+    # cells: cube cells or any roll-up of them by store_location and unit_price
+    # Quantity sold per location below (False) and at or above (True) the
+    # average price, grouped on a price bucket key in a single pass
+    above_average = (cells['unit_price'] >= average_price).rename('above_average')
+    split = cells.groupby([cells['store_location'], above_average], observed=True)['transaction_qty'].sum()
+    return split.unstack(fill_value=0).reindex(columns=[False, True], fill_value=0)
+
+
+def average_category_transaction_data(table, months=6):
+    # Filter data for the last 6 months (months=None keeps the whole, already filtered, date range)
+    cube = table.cube
+    by = ['store_location', 'product_category']
+
+    # Calculate average daily sales
+    category_totals = cube.rollup_last_months(by, months) if months else cube.rollup(by)
+    average_daily_sales = (category_totals['transaction_qty'] / category_totals['count']).rename('transaction_qty').reset_index()
+
+    # Get the maximum and minimum sales for each store
+    max_sales = average_daily_sales.loc[average_daily_sales.groupby('store_location', observed=True)['transaction_qty'].idxmax()]
+    min_sales = average_daily_sales.loc[average_daily_sales.groupby('store_location', observed=True)['transaction_qty'].idxmin()]
+
+    # Merge the max and min sales data
+    return pd.merge(max_sales, min_sales, on='store_location', suffixes=('_max', '_min'))
+
+
+def average_category_transaction_figures(result, months=6):
+    # Create the bar plot
+    def draw():
+        fig, ax = plt.subplots(figsize=(10, 6))
+
+        bar_width = 0.4
+        locations = range(len(result))
+
+        # Plot the highest average sales
+        ax.bar(
+            [pos - bar_width / 2 for pos in locations],
+            result['transaction_qty_max'],
+            width=bar_width,
+            color='skyblue',
+            label='Highest Average Sales'
+        )
+
+        # Plot the lowest average sales
+        ax.bar(
+            [pos + bar_width / 2 for pos in locations],
+            result['transaction_qty_min'],
+            width=bar_width,
+            color='salmon',
+            label='Lowest Average Sales'
+        )
+
+        # Set labels and title
+        ax.set_xticks(locations)
+        ax.set_xticklabels(result['store_location'])
+        ax.set_xlabel('Store Location')
+        ax.set_ylabel('Average Sold Quantity')
+        ax.set_title('Highest and Lowest Average Sold Quantity by Product Category for Each Location')
+        plt.legend()
+        return fig
+
+    def plot():
+        fig = go.Figure([
+            go.Bar(x=result['store_location'], y=result['transaction_qty_max'], name='Highest Average Sales',
+                   marker_color='skyblue', customdata=result['product_category_max']),
+            go.Bar(x=result['store_location'], y=result['transaction_qty_min'], name='Lowest Average Sales',
+                   marker_color='salmon', customdata=result['product_category_min']),
+        ])
+        fig.update_traces(hovertemplate='%{x}<br>%{customdata}: %{y:.2f}')
+        fig.update_layout(barmode='group', xaxis_title='Store Location', yaxis_title='Average Sold Quantity',
+                          title='Highest and Lowest Average Sold Quantity by Product Category for Each Location')
+        return fig
+
+    return [('average_category_transaction', (months,), draw, plot)]
+
+@perf.traced
+def average_category_transaction(store_df, months=6):
+
+    table = as_table(store_df)
+    result = results.get(table, 'average_category_transaction', (months,), average_category_transaction_data)
+
+    # Display the result table in Streamlit
+    st.write("Highest and Lowest Average Sales by Store Location", result)
+
+    # Display the plot in Streamlit
+    show_figures(table, average_category_transaction_figures(result, months))
+
+
+def category_basis_transaction_data(table):
+    cube = table.cube
+    return {
+        # Total sales for each product of every category, grouped once
+        'sales_by_category': category_product_sales(cube.rollup(['product_category', 'product_detail']).reset_index()),
+        'categories': cube.first_seen('product_category'),
+    }
+
+
+def category_basis_transaction_figures(data):
+    figures = []
+    for category in data['categories']:
+        # Calculate total sales for each product in this category (a contiguous slice of the sorted index)
+        product_sales : Any = data['sales_by_category'].loc[category].sort_values(ascending=True)
+
+        # Create the plot
+        def draw(category=category, product_sales=product_sales):
+            fig = plt.figure(figsize=(12, max(6, len(product_sales) * 0.4)))  # Adjust height dynamically based on the number of products
+
+            # Create horizontal bar plot
+            bars = plt.barh(product_sales.index, product_sales.values, color='skyblue')
+
+            # Add value labels on the bars
+            for bar in bars:
+                width = bar.get_width()
+                plt.text(width, bar.get_y() + bar.get_height() / 2,
+                         f'{int(width):,}',
+                         ha='left', va='center', fontweight='bold')
+
+            plt.title(f'Total Sales by Product - {category}')
+            plt.xlabel('Total Quantity Sold')
+            plt.ylabel('Product Name')
+
+            # Adjust layout
+            plt.tight_layout()
+            return fig
+
+        def plot(category=category, product_sales=product_sales):
+            fig = px.bar(x=product_sales.values, y=product_sales.index, orientation='h', text_auto=',d',
+                         color_discrete_sequence=['skyblue'], title=f'Total Sales by Product - {category}',
+                         labels={'x': 'Total Quantity Sold', 'y': 'Product Name'},
+                         height=max(450, len(product_sales) * 30))
+            fig.update_traces(textposition='outside')
+            return fig
+
+        figures.append(('category_basis_transaction', (category,), draw, plot))
+    return figures
+
+@perf.traced
+def category_basis_transaction(store_df):
+    table = as_table(store_df)
+    data = results.get(table, 'category_basis_transaction', (), category_basis_transaction_data)
+
+    # Display the plots using Streamlit
+    show_figures(table, category_basis_transaction_figures(data))
+
+def category_product_sales(cells):
+    # cells: cube cells or a roll-up of them by category and product.
+    # Quantity sold per (category, product), sorted so each category is one slice
+    return cells.groupby(['product_category', 'product_detail'], observed=True, sort=True)['transaction_qty'].sum()
+
+
+def category_transaction_data(table, months=6):
+    # Filter data for the last 6 months (months=None keeps the whole, already filtered, date range)
+    cube = table.cube
+    by = ['store_location', 'product_category']
+    category_totals = cube.rollup_last_months(by, months) if months else cube.rollup(by)
+
+    # Calculate total sales quantity for each product category in each location
+    return category_totals['transaction_qty'].unstack().fillna(0)
+
+
+def category_transaction_figures(category_sales, months=6):
+    period = f"Last {months} Months" if months else "Selected Dates"
+
+    # Create the plot
+    def draw():
+        fig, ax = plt.subplots(figsize=(12, 6))
+        category_sales.plot(kind='bar', ax=ax, colormap='tab20')  # Use a colormap for distinct category colors
+        ax.set_title(f'Total Sales Quantity of Each Product Category in Each Location ({period})')
+        ax.set_xlabel('Store Location')
+        ax.set_ylabel('Total Sales Quantity')
+        plt.xticks(rotation=45)
+        plt.legend(title='Product Category', bbox_to_anchor=(1.05, 1), loc='upper left')  # Place legend outside the plot
+        plt.tight_layout()
+        return fig
+
+    def plot():
+        sales = category_sales.stack().rename('transaction_qty').reset_index()
+        return px.bar(sales, x='store_location', y='transaction_qty', color='product_category', barmode='group',
+                      title=f'Total Sales Quantity of Each Product Category in Each Location ({period})',
+                      labels={'store_location': 'Store Location', 'transaction_qty': 'Total Sales Quantity',
+                              'product_category': 'Product Category'})
+
+    return [('category_transaction', (months,), draw, plot)]
+
+@perf.traced
+def category_transaction(store_df, months=6):
+    table = as_table(store_df)
+    category_sales = results.get(table, 'category_transaction', (months,), category_transaction_data)
+
+    # Display the plot in Streamlit
+    show_figures(table, category_transaction_figures(category_sales, months))
+
+
+def revenue_day_data(table, location="Lower Manhattan"):
+    # Revenue per hour, then categorize time of day
+    hourly = table.cube.rollup(['store_location', 'hour']).reset_index()
+    hourly_revenue = hourly[hourly['store_location'] == location].set_index('hour')['revenue']
+    time_of_day = pd.cut(
+        hourly_revenue.index,
+        bins=[0, 11, 16, 23],
+        labels=['Morning', 'Afternoon', 'Evening']
+    )
+
+    # Calculate revenue by time of day for the location
+    return hourly_revenue.groupby(time_of_day, observed=False).sum().rename_axis('time_of_day')
+
+
+def revenue_day_figures(lower_manhattan_revenue, location="Lower Manhattan"):
+    # Create the plot
+    def draw():
+        # Set up the plot style
+        sns.set(style='whitegrid')
+
+        fig, ax = plt.subplots(figsize=(10, 6))
+        sns.barplot(x=lower_manhattan_revenue.index, y=lower_manhattan_revenue.values, palette='viridis', ax=ax)
+
+        # Customize plot appearance
+        ax.set_title(f'{location} Revenue by Time of Day')
+        ax.set_xlabel('Time of Day')
+        ax.set_ylabel('Revenue ($)')
+        return fig
+
+    def plot():
+        return px.bar(x=lower_manhattan_revenue.index.astype(str), y=lower_manhattan_revenue.values,
+                      color=lower_manhattan_revenue.index.astype(str), color_discrete_sequence=px.colors.sequential.Viridis[::4],
+                      title=f'{location} Revenue by Time of Day',
+                      labels={'x': 'Time of Day', 'y': 'Revenue ($)', 'color': 'Time of Day'})
+
+    return [('revenue_day', (location,), draw, plot)]
+
+@perf.traced
+def revenue_day(store_df, location="Lower Manhattan"):
+    table = as_table(store_df)
+    lower_manhattan_revenue = results.get(table, 'revenue_day', (location,), revenue_day_data)
+
+    # Display the revenue data
+    st.write(f"{location} Revenue by Time of Day:")
+    st.write(lower_manhattan_revenue)
+
+    # Display the plot in Streamlit
+    show_figures(table, revenue_day_figures(lower_manhattan_revenue, location))
+
+
+def lowest_sale_product_data(table):
+    cube = table.cube
+
+    # Get the product with the lowest sales
+    product_sales = cube.rollup('product_detail')[['transaction_qty']].sort_values('transaction_qty')
+    lowest_sales_product = product_sales.index[0]
+    # Its part of the per product, location and hour roll-up the drill-downs share
+    lowest_sales = results.get(table, 'product_aggregates', (), product_aggregates_data).loc[lowest_sales_product]
+
+    most_sold_time_by_location = None
+    if table.has_rows:
+        # Exact transaction times are finer than the cube, so this needs the rows
+        most_sold_time_by_location = most_sold_time(table.product_rows(lowest_sales_product, TIME_COLUMNS))
+
+    # Average quantity per hour and location for plotting
+    hourly_sales = lowest_sales.swaplevel().sort_index()
+    hourly_sales = (hourly_sales['transaction_qty'] / hourly_sales['count']).rename('transaction_qty').reset_index()
+
+    return {
+        'product': lowest_sales_product,
+        'most_sold_time_by_location': most_sold_time_by_location,
+        'hourly_sales': hourly_sales,
+        'location_totals': lowest_sales.groupby('store_location', observed=True)['transaction_qty'].sum(),
+    }
+
+
+# Columns of the rows most_sold_time reads
+TIME_COLUMNS = ['store_location', 'transaction_time', 'transaction_qty']
+
+
+def most_sold_time(product_rows):
+    # Time of day each location sold the most of a product
+    time_location = product_rows.groupby(['store_location', 'transaction_time'], observed=True).agg(
+        {'transaction_qty': 'sum'}).reset_index()
+    return time_location.loc[time_location.groupby('store_location', observed=True)['transaction_qty'].idxmax()]
+
+
+def lowest_sale_product_figures(data):
+    lowest_sales_product = data['product']
+    hourly_sales = data['hourly_sales']
+
+    def draw():
+        fig = plt.figure(figsize=(12, 6))
+        sns.barplot(data=hourly_sales, x='hour', y='transaction_qty', hue='store_location', errorbar=None)
+        plt.title(f'Hourly Sales Distribution of {lowest_sales_product} by Location')
+        plt.xlabel('Hour of Day')
+        plt.ylabel('Quantity Sold')
+        plt.ylim(0, 2)  # Set the y-axis range from 1 to 10 to fit your specified range
+        plt.legend(title='Location')
+        plt.tight_layout()
+        return fig
+
+    def plot():
+        return px.bar(hourly_sales, x='hour', y='transaction_qty', color='store_location', barmode='group',
+                      range_y=(0, 2), title=f'Hourly Sales Distribution of {lowest_sales_product} by Location',
+                      labels={'hour': 'Hour of Day', 'transaction_qty': 'Quantity Sold', 'store_location': 'Location'})
+
+    return [('lowest_sale_product', (lowest_sales_product,), draw, plot)]
+
+
+@perf.traced
+def lowest_sale_product(store_df):
+    table = as_table(store_df)
+
+    def display(data, version):
+        lowest_sales_product = data['product']
+
+        # Display the product with the lowest sales and the most sold time by location
+        st.write("### Product with the Lowest Sales:", lowest_sales_product)
+        st.write("Most Sold Time by Location for the Product with the Lowest Sales:")
+        if data['most_sold_time_by_location'] is not None:
+            st.write(data['most_sold_time_by_location'])
+        elif version is not None:
+            st.info("Transaction times follow with the exact result.")
+        else:
+            st.info("Transaction times are not available in streaming mode.")
+
+        # Plot hourly sales distribution for the lowest sales product
+        st.write(f"### Hourly Sales Distribution of {lowest_sales_product} by Location")
+
+        # Display the plot in Streamlit
+        show_figures(table, lowest_sale_product_figures(data), version)
+
+        # Display total quantity sold by location
+        st.write("### Total Quantity Sold by Location")
+        st.write(data['location_totals'])
+
+    show_result(table, 'lowest_sale_product', (), display)
+
+
+def revenue_anomalies_data(table):
+    # Read from the table's revenue monitor, which new transactions update as
+    # they arrive; only the stores and dates of the filter are kept
+    monitor = table.monitor
+    daily, anomalies, summary = monitor.daily_frame(), monitor.anomalies(), monitor.summary()
+    data_filter = getattr(table, 'data_filter', None)
+    if data_filter is not None:
+        if data_filter.stores is not None:
+            daily = daily[daily['store_location'].isin(data_filter.stores)]
+            anomalies = anomalies[anomalies['store_location'].isin(data_filter.stores)]
+            summary = summary[summary.index.isin(data_filter.stores)]
+        if data_filter.start is not None:
+            daily = daily[daily['date'] >= data_filter.start]
+            anomalies = anomalies[anomalies['start'] >= data_filter.start]
+        if data_filter.end is not None:
+            daily = daily[daily['date'] < data_filter.end_exclusive]
+            anomalies = anomalies[anomalies['start'] < data_filter.end_exclusive]
+    return {'daily': daily, 'anomalies': anomalies, 'summary': summary}
+
+
+def revenue_anomalies_figures(data):
+    daily = data['daily']
+    flagged = daily[daily['anomaly']]
+
+    def draw():
+        fig, ax = plt.subplots(figsize=(12, 6))
+        for location, location_data in daily.groupby('store_location', sort=False):
+            line, = ax.plot(location_data['date'], location_data['revenue'], label=location)
+            ax.plot(location_data['date'], location_data['expected'], linestyle='--', color=line.get_color(), alpha=0.6)
+        ax.scatter(flagged['date'], flagged['revenue'], color='red', zorder=3, label='Anomaly')
+        ax.set_title('Daily Revenue, Expected Revenue (EWMA) and Anomalies by Store Location')
+        ax.set_xlabel('Day')
+        ax.set_ylabel('Revenue ($)')
+        ax.spines[['top', 'right']].set_visible(False)
+        plt.xticks(rotation=45)
+        plt.legend(title='Store Location')
+        plt.tight_layout()
+        return fig
+
+    # Client-side version: at most downsample.MAX_POINTS points per line
+    def plot():
+        fig = go.Figure()
+        for location, location_data in daily.groupby('store_location', sort=False):
+            revenue = downsample.series(location_data, 'date', 'revenue')
+            expected = downsample.series(location_data, 'date', 'expected')
+            fig.add_trace(go.Scatter(x=revenue['date'], y=revenue['revenue'], mode='lines', name=location))
+            fig.add_trace(go.Scatter(x=expected['date'], y=expected['expected'], mode='lines',
+                                     line={'dash': 'dash'}, name=f'{location} expected'))
+        fig.add_trace(go.Scatter(x=flagged['date'], y=flagged['revenue'], mode='markers', marker={'color': 'red'},
+                                 name='Anomaly', text=flagged['store_location']))
+        fig.update_layout(title='Daily Revenue, Expected Revenue (EWMA) and Anomalies by Store Location',
+                          xaxis_title='Day', yaxis_title='Revenue ($)', legend_title='Store Location')
+        return fig
+
+    return [('revenue_anomalies', (), draw, plot)]
+
+
+@perf.traced
+def revenue_anomalies(store_df):
+    table = as_table(store_df)
+    data = results.get(table, 'revenue_anomalies', (), revenue_anomalies_data)
+
+    st.write("### Revenue Anomalies")
+    st.caption(f"Days more than {anomaly.THRESHOLD:g} standard deviations from the previous "
+               f"{anomaly.WINDOW_DAYS} days, hours from the same hour of the same weekday. "
+               f"Covers every product category.")
+    show_figures(table, revenue_anomalies_figures(data))
+    st.write("Flagged days and hours, newest first")
+    st.write(data['anomalies'])
+    st.write("Latest statistics by location")
+    st.write(data['summary'])
+
+
+def display_barista_revenue_data(table):
+    # Filter for 'Ouro Brasileiro shot' and calculate total revenue by store location
+    prices = table.cube.rollup(['store_location', 'product_detail', 'unit_price']).reset_index()
+    prices = prices[prices['product_detail'] == 'Ouro Brasileiro shot'].sort_values('first_row')
+    barista_revenue = prices.groupby("store_location", observed=True).agg({
+        'transaction_qty': 'sum',
+        'unit_price': 'first'  # Assuming unit_price is the same for each store_location-product_detail
+    }).assign(total_revenue=lambda x: x['transaction_qty'] * x['unit_price'])
+
+    # Sort by total revenue
+    return barista_revenue.sort_values('total_revenue', ascending=False)
+
+
+def display_barista_revenue_figures(barista_revenue):
+    def draw():
+        fig = plt.figure(figsize=(12, 6))
+        sns.barplot(data=barista_revenue.reset_index(), x='store_location', y='total_revenue')
+        plt.xticks(rotation=45, ha='right')
+        plt.title('Total Revenue from Ouro Brasileiro shot by Location')
+        plt.ylabel('Total Revenue ($)')
+        plt.tight_layout()
+        return fig
+
+    def plot():
+        return px.bar(barista_revenue.reset_index(), x='store_location', y='total_revenue',
+                      title='Total Revenue from Ouro Brasileiro shot by Location',
+                      labels={'store_location': 'Store Location', 'total_revenue': 'Total Revenue ($)'})
+
+    return [('display_barista_revenue', (), draw, plot)]
+
+
+@perf.traced
+def display_barista_revenue(store_df):
+    table = as_table(store_df)
+    barista_revenue = results.get(table, 'display_barista_revenue', (), display_barista_revenue_data)
+
+    # Plotting the total revenue by store location
+    st.write("### Total Revenue from Ouro Brasileiro shot by Location")
+
+    # Display the plot in Streamlit
+    show_figures(table, display_barista_revenue_figures(barista_revenue))
+
+    # Display the detailed revenue breakdown in Streamlit
+    st.write("### Detailed Revenue Breakdown")
+    st.write(barista_revenue[['transaction_qty', 'unit_price', 'total_revenue']])
+
+
+def product_aggregates_data(table):
+    # Quantity, revenue and transactions of every product per location and
+    # hour, rolled up once per table and shared by all drill-downs
+    return table.cube.rollup(['product_detail', 'store_location', 'hour'])[['transaction_qty', 'revenue', 'count']]
+
+
+def product_drilldown_data(table, product):
+    # Only the product's own cells and rows (slices of the product index) and
+    # its part of the shared aggregates are read, never the whole table
+    aggregates = results.get(table, 'product_aggregates', (), product_aggregates_data)
+    hourly_sales = aggregates.loc[product].reset_index()
+    location_totals = hourly_sales.groupby('store_location', observed=True)[['transaction_qty', 'revenue', 'count']].sum()
+
+    if table.cube.has_cells:
+        cells = table.product_cells(product)
+        category = cells['product_category'].iloc[0]
+        daily_sales = cells.groupby(['date', 'store_location'], observed=True)['transaction_qty'].sum().reset_index()
+    else:
+        # Streaming mode keeps no roll-up by product and day
+        category = table.cube.rollup(['product_category', 'product_detail']).xs(product, level='product_detail').index[0]
+        daily_sales = None
+
+    most_sold_time_by_location = None
+    if table.has_rows:
+        most_sold_time_by_location = most_sold_time(table.product_rows(product, TIME_COLUMNS))
+
+    quantity, revenue = location_totals['transaction_qty'].sum(), location_totals['revenue'].sum()
+    return {
+        'product': product,
+        'category': category,
+        'quantity': quantity,
+        'revenue': revenue,
+        'transactions': location_totals['count'].sum(),
+        'average_price': revenue / quantity if quantity else 0.0,
+        'hourly_sales': hourly_sales,
+        'daily_sales': daily_sales,
+        'location_totals': location_totals,
+        'most_sold_time_by_location': most_sold_time_by_location,
+    }
+
+
+def product_drilldown_figures(data, product):
+    hourly_sales = data['hourly_sales']
+    daily_sales = data['daily_sales']
+
+    def draw_hourly():
+        fig = plt.figure(figsize=(12, 6))
+        sns.barplot(data=hourly_sales, x='hour', y='transaction_qty', hue='store_location', errorbar=None)
+        plt.title(f'Quantity Sold per Hour of {product} by Location')
+        plt.xlabel('Hour of Day')
+        plt.ylabel('Quantity Sold')
+        plt.legend(title='Location')
+        plt.tight_layout()
+        return fig
+
+    def plot_hourly():
+        return px.bar(hourly_sales, x='hour', y='transaction_qty', color='store_location', barmode='group',
+                      title=f'Quantity Sold per Hour of {product} by Location',
+                      labels={'hour': 'Hour of Day', 'transaction_qty': 'Quantity Sold', 'store_location': 'Location'})
+
+    def draw_daily():
+        fig, ax = plt.subplots(figsize=(12, 6))
+        for location, location_data in daily_sales.groupby('store_location', observed=True, sort=False):
+            ax.plot(location_data['date'], location_data['transaction_qty'], label=location)
+        ax.set_title(f'Daily Quantity Sold of {product} by Location')
+        ax.set_xlabel('Day')
+        ax.set_ylabel('Quantity Sold')
+        ax.spines[['top', 'right']].set_visible(False)
+        plt.xticks(rotation=45)
+        plt.legend(title='Location')
+        plt.tight_layout()
+        return fig
+
+    # Client-side version: at most downsample.MAX_POINTS points per location
+    def plot_daily():
+        fig = go.Figure()
+        for location, location_data in daily_sales.groupby('store_location', observed=True, sort=False):
+            location_data = downsample.series(location_data, 'date', 'transaction_qty')
+            fig.add_trace(go.Scatter(x=location_data['date'], y=location_data['transaction_qty'],
+                                     mode='lines', name=location))
+        fig.update_layout(title=f'Daily Quantity Sold of {product} by Location', xaxis_title='Day',
+                          yaxis_title='Quantity Sold', legend_title='Location')
+        return fig
+
+    figures = [('product_drilldown_hourly', (product,), draw_hourly, plot_hourly)]
+    if daily_sales is not None:
+        figures.append(('product_drilldown_daily', (product,), draw_daily, plot_daily))
+    return figures
+
+
+@perf.traced
+def product_drilldown(store_df):
+    table = as_table(store_df)
+    product = st.selectbox("Product", table.products(), key='drilldown_product')
+    data = results.get(table, 'product_drilldown', (product,), product_drilldown_data)
+
+    st.write(f"### {product}")
+    st.write(f"Category: {data['category']}")
+    quantity, revenue, transactions, average_price = st.columns(4)
+    quantity.metric("Quantity Sold", f"{data['quantity']:,}")
+    revenue.metric("Revenue", f"${data['revenue']:,.2f}")
+    transactions.metric("Transactions", f"{data['transactions']:,}")
+    average_price.metric("Average Unit Price", f"${data['average_price']:.2f}")
+
+    show_figures(table, product_drilldown_figures(data, product))
+    if data['daily_sales'] is None:
+        st.info("Daily sales per product are not available in streaming mode.")
+
+    st.write("### Sales by Location")
+    st.write(data['location_totals'].rename(columns={'count': 'transactions'}))
+    st.write("### Most Sold Time by Location")
+    if data['most_sold_time_by_location'] is not None:
+        st.write(data['most_sold_time_by_location'])
+    else:
+        st.info("Transaction times are not available in streaming mode.")
+
+
+def demand_forecast_data(table, horizon=forecast.HORIZON):
+    # The fitted forecast of every series, None without enough history
+    if not forecast.has_history(table):
+        return None
+    return forecast.get_forecast(table, horizon)
+
+
+def demand_forecast_figures(fitted, horizon=forecast.HORIZON, series=None):
+    # Daily and next-day hourly chart of the given (store, category) series, all by default
+    figures = []
+    for store_location, category in fitted.series if series is None else series:
+        daily = fitted.daily(store_location, category).iloc[-(horizon + 8 * 7):]
+
+        def draw(store_location=store_location, category=category, daily=daily):
+            fig, ax = plt.subplots(figsize=(12, 6))
+            ax.plot(daily.index, daily['actual'], color='#6F4E37', label='Actual')
+            ax.plot(daily.index, daily['predicted'], color='orange', label='Forecast')
+            ax.fill_between(daily.index, daily['lower'], daily['upper'], color='orange', alpha=0.25,
+                            label=f'{fitted.interval:.0%} Interval')
+            ax.set_title(f'Daily Demand Forecast - {category} in {store_location}')
+            ax.set_xlabel('Date')
+            ax.set_ylabel('Quantity Sold')
+            plt.xticks(rotation=45)
+            plt.legend()
+            plt.tight_layout()
+            return fig
+
+        def plot(store_location=store_location, category=category, daily=daily):
+            fig = go.Figure([
+                go.Scatter(x=daily.index, y=daily['upper'], mode='lines', line_width=0, showlegend=False,
+                           hoverinfo='skip'),
+                go.Scatter(x=daily.index, y=daily['lower'], mode='lines', line_width=0, fill='tonexty',
+                           fillcolor='rgba(255, 165, 0, 0.25)', name=f'{fitted.interval:.0%} Interval'),
+                go.Scatter(x=daily.index, y=daily['actual'], mode='lines', line_color='#6F4E37', name='Actual'),
+                go.Scatter(x=daily.index, y=daily['predicted'], mode='lines', line_color='orange', name='Forecast'),
+            ])
+            fig.update_layout(title=f'Daily Demand Forecast - {category} in {store_location}',
+                              xaxis_title='Date', yaxis_title='Quantity Sold')
+            return fig
+
+        figures.append(('demand_forecast', (store_location, category, horizon), draw, plot))
+
+        # Next day split over the hours
+        next_day = fitted.days[0]
+        hourly = fitted.hourly(store_location, category, next_day)
+        hourly = hourly[hourly['predicted'] > 0]
+
+        def draw_hourly(store_location=store_location, category=category, hourly=hourly):
+            fig, ax = plt.subplots(figsize=(12, 5))
+            ax.bar(hourly.index, hourly['predicted'], color='skyblue',
+                   yerr=[hourly['predicted'] - hourly['lower'], hourly['upper'] - hourly['predicted']], capsize=3)
+            ax.set_title(f'Hourly Demand Forecast for {next_day:%Y-%m-%d} - {category} in {store_location}')
+            ax.set_xlabel('Hour of Day')
+            ax.set_ylabel('Quantity Sold')
+            ax.set_xticks(hourly.index)
+            plt.tight_layout()
+            return fig
+
+        def plot_hourly(store_location=store_location, category=category, hourly=hourly):
+            fig = go.Figure(go.Bar(
+                x=hourly.index, y=hourly['predicted'], marker_color='skyblue',
+                error_y=dict(type='data', symmetric=False, array=hourly['upper'] - hourly['predicted'],
+                             arrayminus=hourly['predicted'] - hourly['lower'])))
+            fig.update_layout(title=f'Hourly Demand Forecast for {next_day:%Y-%m-%d} - {category} in {store_location}',
+                              xaxis_title='Hour of Day', yaxis_title='Quantity Sold')
+            fig.update_xaxes(tickmode='array', tickvals=hourly.index)
+            return fig
+
+        figures.append(('demand_forecast_hourly', (store_location, category, horizon), draw_hourly, plot_hourly))
+    return figures
+
+
+@perf.traced
+def demand_forecast(store_df, horizon=forecast.HORIZON):
+    # Daily and hourly demand forecast per store and category, fitted once per data version
+    table = as_table(store_df)
+    st.header("Demand Forecast")
+    fitted = results.get(table, 'demand_forecast', (horizon,), demand_forecast_data)
+    if fitted is None:
+        st.info(f"At least {forecast.MIN_HISTORY_DAYS} days of data are needed for a forecast.")
+        return
+
+    # Forecast totals for every store and category
+    st.write(f"Forecast Quantity for the Next {horizon} Days ({fitted.interval:.0%} Interval)")
+    st.write(fitted.totals())
+
+    store_location = st.selectbox("Store location", fitted.series.unique(level=0), key='forecast_store')
+    category = st.selectbox("Product category",
+                            fitted.series[fitted.series.get_level_values(0) == store_location].unique(level=1),
+                            key='forecast_category')
+    show_figures(table, demand_forecast_figures(fitted, horizon, [(store_location, category)]))
+
+
+# What precompute.py computes and renders: page result -> (compute, figures)
+PAGE_RESULTS = {
+    'top_product_categories': (top_product_categories_data, top_product_categories_figures),
+    'transaction_in_hour_basis': (transaction_in_hour_basis_data, transaction_in_hour_basis_figures),
+    'transaction_in_day_basis': (transaction_in_day_basis_data, transaction_in_day_basis_figures),
+    'transaction_in_month_basis': (transaction_in_month_basis_data, transaction_in_month_basis_figures),
+    'average_price_basis': (average_price_basis_data, average_price_basis_figures),
+    'average_category_transaction': (average_category_transaction_data, average_category_transaction_figures),
+    'category_basis_transaction': (category_basis_transaction_data, category_basis_transaction_figures),
+    'category_transaction': (category_transaction_data, category_transaction_figures),
+    'revenue_day': (revenue_day_data, revenue_day_figures),
+    'lowest_sale_product': (lowest_sale_product_data, lowest_sale_product_figures),
+    'display_barista_revenue': (display_barista_revenue_data, display_barista_revenue_figures),
+    'revenue_anomalies': (revenue_anomalies_data, revenue_anomalies_figures),
+    'demand_forecast': (demand_forecast_data, demand_forecast_figures),
+}
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import perf
+
+# Source files read by the dashboard
+TRANSACTIONS_PATH = "coffee_shop.xlsx"
+NEW_DATA_PATH = "New_data.csv"
+
+# Parsed sources are kept as a bundle of .npy column files under this directory
+CACHE_DIR = os.environ.get("COFFEE_CACHE_DIR", ".cache")
+
+# Text columns that are handed out as pandas categoricals, all other text
+# columns are dictionary-encoded on disk but decoded back to plain strings
+CATEGORICAL_COLUMNS = ["store_location", "product_category", "product_type", "product_detail"]
+
+logger = logging.getLogger(__name__)
+
+# Process-wide cache: path -> (mtime_ns, size, version, DataFrame)
+_frames = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_source(path):
+    if path.lower().endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+
+def _source_dir(path):
+    return os.path.join(CACHE_DIR, os.path.basename(path))
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def write_bundle(df, bundle_dir):
+    # Numeric and datetime columns are saved as they are, text columns as
+    # int32 codes plus a separate array holding the dictionary
+    tmp_dir = f"{bundle_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    columns = []
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        if values.dtype.kind in 'biufM':
+            np.save(os.path.join(tmp_dir, f"{i}.npy"), values.to_numpy())
+            columns.append({'name': col, 'kind': 'array'})
+        else:
+            cat = pd.Categorical(values.astype(str).where(values.notna()))
+            np.save(os.path.join(tmp_dir, f"{i}.npy"), cat.codes.astype(np.int32))
+            np.save(os.path.join(tmp_dir, f"{i}.dict.npy"), np.asarray(cat.categories, dtype=str))
+            columns.append({'name': col, 'kind': 'dictionary'})
+    _write_json(os.path.join(tmp_dir, 'columns.json'), {'columns': columns, 'rows': len(df)})
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    os.replace(tmp_dir, bundle_dir)
+
+
+def read_bundle(bundle_dir):
+    layout = _read_json(os.path.join(bundle_dir, 'columns.json'))
+    if layout is None:
+        return None
+    data = {}
+    for i, column in enumerate(layout['columns']):
+        values = np.load(os.path.join(bundle_dir, f"{i}.npy"))
+        if column['kind'] == 'dictionary':
+            categories = np.load(os.path.join(bundle_dir, f"{i}.dict.npy"))
+            values = pd.Categorical.from_codes(values, categories)
+            if column['name'] not in CATEGORICAL_COLUMNS:
+                values = np.asarray(values, dtype=object)
+        data[column['name']] = values
+    return pd.DataFrame(data)
+
+
+def _source_info(path):
+    return _read_json(os.path.join(_source_dir(path), 'source.json')) or {}
+
+
+def _recorded_version(info, stat):
+    # Same mtime and size as last time: trust the recorded hash
+    if info.get('mtime_ns') == stat.st_mtime_ns and info.get('size') == stat.st_size:
+        return info['sha1']
+    return None
+
+
+def source_version(path, stat=None, stats=None):
+    # Content hash of a source file, without reading it when it hasn't changed;
+    # a new hash is recorded so the next process doesn't read it either
+    stat = os.stat(path) if stat is None else stat
+    version = _recorded_version(_source_info(path), stat)
+    if version is None:
+        start = time.perf_counter()
+        version = file_digest(path)
+        if stats is not None:
+            stats['hash_seconds'] = time.perf_counter() - start
+        os.makedirs(_source_dir(path), exist_ok=True)
+        _write_json(os.path.join(_source_dir(path), 'source.json'),
+                    {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha1': version})
+    return version
+
+
+def _load_from_disk(path, stat, stats):
+    source_dir = _source_dir(path)
+    version = source_version(path, stat, stats)
+
+    bundle_dir = os.path.join(source_dir, version)
+    start = time.perf_counter()
+    df = read_bundle(bundle_dir)
+    stats['load_seconds'] = time.perf_counter() - start
+
+    if df is None:
+        stats['cache'] = 'miss'
+        start = time.perf_counter()
+        with perf.stage('parse_source', path=path):
+            df = read_source(path)
+        stats['parse_seconds'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        write_bundle(df, bundle_dir)
+        # Reload from the bundle so a miss and a hit hand out identical frames
+        df = read_bundle(bundle_dir)
+        stats['write_seconds'] = time.perf_counter() - start
+
+        # Drop bundles of older versions of the same source
+        for name in os.listdir(source_dir):
+            old_dir = os.path.join(source_dir, name)
+            if name != version and os.path.isdir(old_dir):
+                shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        stats['cache'] = 'disk'
+    return version, df
+
+
+def read_frame(path, stats):
+    # The parsed source through the on-disk bundle, like load_frame, but not
+    # kept in this process; for loaders that keep their own copy of the data
+    return _load_from_disk(path, os.stat(path), stats)[1]
+
+
+def load_frame(path):
+    # Serve the parsed source from memory, then from the on-disk bundle, and
+    # only parse the spreadsheet itself when its contents have changed
+    stat = os.stat(path)
+    with _lock:
+        cached = _frames.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            _stats[path]['memory_hits'] += 1
+            return cached[3]
+
+        start = time.perf_counter()
+        stats = {'hash_seconds': 0.0, 'parse_seconds': 0.0, 'write_seconds': 0.0}
+        version, df = _load_from_disk(path, stat, stats)
+        stats['total_seconds'] = time.perf_counter() - start
+        stats['rows'] = len(df)
+        stats['version'] = version
+        stats['memory_hits'] = 0
+
+        _frames[path] = (stat.st_mtime_ns, stat.st_size, version, df)
+        _stats[path] = stats
+        logger.info("Loaded %s (%d rows, %s) in %.3fs", path, len(df), stats['cache'], stats['total_seconds'])
+        return df
+
+
+def data_version(path):
+    cached = _frames.get(path)
+    return cached[2] if cached is not None else None
+
+
+def record_stats(path, stats):
+    # Loaders that bypass load_frame (the mmap store) report their timings here
+    with _lock:
+        _stats[path] = stats
+
+
+def load_stats():
+    return {path: dict(stats) for path, stats in _stats.items()}
+
+
+def load_transactions():
+    return load_frame(TRANSACTIONS_PATH)
+
+
+def load_new_data():
+    return load_frame(NEW_DATA_PATH)
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+# Most points sent to the browser for one line of a client-side chart
+MAX_POINTS = int(os.environ.get("COFFEE_MAX_POINTS", 1000))
+
+
+def _numeric(x):
+    x = np.asarray(x)
+    if x.dtype.kind in 'mM':
+        return x.view(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def lttb(x, y, threshold=MAX_POINTS):
+    # Largest-Triangle-Three-Buckets (Steinarsson, 2013): positions of
+    # `threshold` points, first and last always kept, one point per bucket
+    # chosen to span the largest triangle with its neighbours. x must be sorted.
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = _numeric(x)
+    y = np.asarray(y, dtype=np.float64)
+    # threshold - 2 buckets over the inner points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the last bucket)
+        next_start, next_stop = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        next_x = x[next_start:next_stop].mean()
+        next_y = y[next_start:next_stop].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def min_max(x, y, threshold=MAX_POINTS):
+    # Positions of the lowest and highest point of threshold // 2 equal-sized
+    # buckets, in x order; cheaper than LTTB and never hides a spike
+    n = len(y)
+    buckets = threshold // 2
+    if threshold >= n or buckets < 1:
+        return np.arange(n)
+    y = np.asarray(y, dtype=np.float64)
+    bucket = np.minimum((np.arange(n) * buckets) // n, buckets - 1)
+    starts = np.searchsorted(bucket, np.arange(buckets))
+    lows = np.minimum.reduceat(y, starts)
+    highs = np.maximum.reduceat(y, starts)
+    # First position in each bucket holding its low and its high
+    low_at = np.flatnonzero(y == lows[bucket])
+    high_at = np.flatnonzero(y == highs[bucket])
+    low_at = low_at[np.unique(bucket[low_at], return_index=True)[1]]
+    high_at = high_at[np.unique(bucket[high_at], return_index=True)[1]]
+    return np.unique(np.concatenate([low_at, high_at]))
+
+
+METHODS = {'lttb': lttb, 'minmax': min_max}
+
+# LTTB keeps the shape of a line, min/max keeps its extremes
+METHOD = os.environ.get("COFFEE_DOWNSAMPLE", "lttb")
+
+
+def series(frame, x, y, threshold=None, method=None):
+    # Rows of a frame sorted on x, thinned out to at most `threshold` points of y
+    threshold = threshold or MAX_POINTS
+    if len(frame) <= threshold:
+        return frame
+    positions = METHODS[method or METHOD](frame[x].to_numpy(), frame[y].to_numpy(), threshold)
+    return frame.iloc[positions]
@@ -0,0 +1,174 @@
+import contextlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import matplotlib.pyplot as plt
+import streamlit as st
+
+import perf
+import results
+
+# Budget for the rendered images kept in memory
+MAX_BYTES = int(os.environ.get("COFFEE_FIGURE_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Same output st.pyplot would produce
+SAVEFIG_OPTIONS = {"format": "png", "bbox_inches": "tight", "dpi": 200}
+
+# "matplotlib" sends server-rendered PNGs, "plotly" sends figure JSON that the
+# browser draws (long series are downsampled first, see downsample.py).
+# ?charts=plotly or ?charts=matplotlib picks one for a single session.
+BACKENDS = ('matplotlib', 'plotly')
+BACKEND = os.environ.get("COFFEE_CHART_BACKEND", "matplotlib")
+
+
+def encode_png(fig):
+    # (image bytes, bytes sent to the browser)
+    try:
+        buffer = io.BytesIO()
+        fig.savefig(buffer, **SAVEFIG_OPTIONS)
+    finally:
+        plt.close(fig)
+    image = buffer.getvalue()
+    return image, len(image)
+
+
+def encode_plotly(fig):
+    # Plotly figures are kept as they are, Streamlit serializes them on every
+    # view; their size is the JSON spec that goes over the wire. Imported
+    # here, plotly is only loaded by pages that draw with it.
+    import plotly.io
+
+    return fig, len(plotly.io.to_json(fig, validate=False))
+
+
+class FigureCache:
+    # Rendered figures keyed on (chart, parameters, data version, backend),
+    # evicted least recently used first once the byte budget is exceeded
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._images = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # pyplot keeps global state, so only one figure is drawn at a time
+        self._render_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.render_seconds = 0.0
+
+    def _entry(self, key):
+        with self._lock:
+            entry = self._images.get(key)
+            if entry is not None:
+                self._images.move_to_end(key)
+            return entry
+
+    def get(self, key):
+        entry = self._entry(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, image, size=None):
+        size = len(image) if size is None else size
+        with self._lock:
+            if key in self._images:
+                self._bytes -= self._images.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._images[key] = (image, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._images.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def render(self, key, draw, encode=encode_png):
+        # draw() builds and returns a figure, encode() turns it into what is
+        # cached and its size; both only run on a miss. Returns (image, size).
+        entry = self._entry(key)
+        if entry is not None:
+            self.hits += 1
+            return entry
+        # pyplot keeps global state, plotly figures can be built side by side
+        with self._render_lock if encode is encode_png else contextlib.nullcontext():
+            entry = self._entry(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            start = time.perf_counter()
+            with perf.stage('render', chart=key[0] if key else None):
+                entry = encode(draw())
+            self.render_seconds += time.perf_counter() - start
+        self.put(key, *entry)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._images),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'render_seconds': self.render_seconds,
+            }
+
+
+# Shared by every session in the process
+figures = FigureCache()
+
+
+def backend():
+    # Chart backend of the current session
+    chosen = st.query_params.get('charts', BACKEND)
+    return chosen if chosen in BACKENDS else BACKEND
+
+
+def _decode_plotly(spec):
+    import plotly.io
+
+    return plotly.io.from_json(spec.decode())
+
+
+def _load_snapshot(key, extension, decode=None):
+    # Chart rendered ahead of time by precompute.py, if there is one
+    name, params, version, _ = key
+    if figures.get(key) is not None:
+        return
+    content = results.load_figure(version, name, params, extension)
+    if content is not None:
+        figures.put(key, decode(content) if decode else content, len(content))
+
+
+def show(name, params, version, draw, plot=None, persistent=False):
+    # draw() returns a matplotlib figure, plot() the same chart as a plotly
+    # figure; charts without plot() stay PNGs on either backend. Versions that
+    # identify the data (persistent) can be served from a precomputed snapshot.
+    if plot is not None and backend() == 'plotly':
+        key = (name, params, version, 'plotly')
+        if persistent:
+            _load_snapshot(key, 'json', _decode_plotly)
+        fig, size = figures.render(key, plot, encode_plotly)
+        with perf.stage('serialize', chart=name, backend='plotly', payload_bytes=size):
+            st.plotly_chart(fig, width="stretch")
+        return
+    key = (name, params, version, 'matplotlib')
+    if persistent:
+        _load_snapshot(key, 'png')
+    image, size = figures.render(key, draw)
+    with perf.stage('serialize', chart=name, backend='matplotlib', payload_bytes=size):
+        st.image(image, width="stretch")
+
+
+def stats():
+    return figures.stats()
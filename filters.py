@@ -0,0 +1,124 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# Above this share of the rows, selected positions are put back in table order
+# with a mask instead of sorting them
+MASK_FRACTION = 0.125
+
+
+def _nanoseconds(value):
+    return pd.Timestamp(value).as_unit('ns').value
+
+
+class DataFilter:
+    # Date range (whole days, both ends included), stores and product
+    # categories selected in the sidebar; None means no restriction
+
+    def __init__(self, start=None, end=None, stores=None, categories=None):
+        self.start = None if start is None else pd.Timestamp(start).floor('D')
+        self.end = None if end is None else pd.Timestamp(end).floor('D')
+        self.stores = None if not stores else tuple(sorted(str(store) for store in stores))
+        self.categories = None if not categories else tuple(sorted(str(category) for category in categories))
+
+    @property
+    def is_empty(self):
+        return self.start is None and self.end is None and self.stores is None and self.categories is None
+
+    @property
+    def end_exclusive(self):
+        return None if self.end is None else self.end + pd.Timedelta(days=1)
+
+    @property
+    def key(self):
+        # Short, stable id used in the version of filtered tables
+        spec = repr((self.start, self.end, self.stores, self.categories))
+        return hashlib.sha1(spec.encode()).hexdigest()[:12]
+
+    def __repr__(self):
+        return (f"DataFilter(start={self.start}, end={self.end}, stores={self.stores}, "
+                f"categories={self.categories})")
+
+
+class SortedIndex:
+    # Positions of a frame ordered by (store, timestamp) plus the offset of
+    # every store's run in that order, so a store and time window is one
+    # binary search per selected store instead of a scan of every row
+
+    def __init__(self, stores, timestamps):
+        codes = stores.cat.codes.to_numpy()
+        times = timestamps.to_numpy(dtype='datetime64[ns]').view(np.int64)
+        self.stores = stores.cat.categories
+        self.order = np.lexsort((times, codes))
+        self.times = times[self.order]
+        self.offsets = np.searchsorted(codes[self.order], np.arange(len(self.stores) + 1))
+
+    def __len__(self):
+        return len(self.order)
+
+    def store_codes(self, stores=None):
+        if stores is None:
+            return range(len(self.stores))
+        codes = self.stores.get_indexer(list(stores))
+        return sorted(code for code in codes if code >= 0)
+
+    def positions(self, stores=None, start=None, end=None):
+        # Row positions (in table order) of the given stores between start
+        # (included) and end (excluded)
+        start = None if start is None else _nanoseconds(start)
+        end = None if end is None else _nanoseconds(end)
+        runs = []
+        for code in self.store_codes(stores):
+            low, high = self.offsets[code], self.offsets[code + 1]
+            times = self.times[low:high]
+            first = low + (0 if start is None else np.searchsorted(times, start, 'left'))
+            last = high if end is None else low + np.searchsorted(times, end, 'left')
+            if last > first:
+                runs.append(self.order[first:last])
+        if not runs:
+            return np.empty(0, dtype=np.intp)
+        selected = np.concatenate(runs)
+        if len(selected) < MASK_FRACTION * len(self.order):
+            return np.sort(selected)
+        mask = np.zeros(len(self.order), dtype=bool)
+        mask[selected] = True
+        return np.flatnonzero(mask)
+
+
+class ValueIndex:
+    # Positions of a frame grouped by the value of one categorical column,
+    # in table order within every value, plus the offset of every value's
+    # run, so all rows of one value are a slice instead of a scan
+
+    def __init__(self, values):
+        codes = values.cat.codes.to_numpy()
+        self.values = values.cat.categories
+        # Stable, so the rows of a value keep their order in the table
+        self.order = np.argsort(codes, kind='stable')
+        self.offsets = np.searchsorted(codes[self.order], np.arange(len(self.values) + 1))
+
+    def __len__(self):
+        return len(self.order)
+
+    def positions(self, value):
+        code = self.values.get_indexer([value])[0]
+        if code < 0:
+            return np.empty(0, dtype=np.intp)
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+    def sizes(self):
+        # Rows of every value, without looking at them
+        return pd.Series(np.diff(self.offsets), index=self.values)
+
+
+def select(frame, index, data_filter):
+    # Rows of `frame` passing the filter; the category test only looks at the
+    # rows already inside the store and date slices
+    positions = index.positions(data_filter.stores, data_filter.start, data_filter.end_exclusive)
+    if data_filter.categories is not None:
+        categories = frame['product_category']
+        wanted = categories.cat.categories.get_indexer(list(data_filter.categories))
+        codes = categories.cat.codes.to_numpy()[positions]
+        positions = positions[np.isin(codes, wanted[wanted >= 0])]
+    return frame.take(positions).reset_index(drop=True)
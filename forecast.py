@@ -0,0 +1,123 @@
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import Ridge
+
+import perf
+import results
+
+# Days forecast past the last day of data
+HORIZON = 14
+
+# Share of outcomes inside the prediction interval
+INTERVAL = 0.9
+
+# Days of history needed before anything is forecast
+MIN_HISTORY_DAYS = 28
+
+
+def daily_demand(cube):
+    # Quantity sold per day (rows) for every (store, category) series (columns),
+    # days without sales filled with 0
+    daily = cube.rollup(['store_location', 'product_category', 'date'])['transaction_qty']
+    demand = daily.unstack(['store_location', 'product_category'], fill_value=0)
+    days = pd.date_range(demand.index.min(), demand.index.max(), freq='D')
+    return demand.reindex(days, fill_value=0).astype(np.float64)
+
+
+def hourly_shares(cube, series):
+    # Share of each series' quantity sold in every hour of the day
+    hourly = cube.rollup(['store_location', 'product_category', 'hour'])['transaction_qty']
+    hourly = hourly.unstack('hour', fill_value=0).reindex(columns=range(24), fill_value=0)
+    hourly = hourly.reindex(series, fill_value=0).to_numpy(dtype=np.float64)
+    totals = hourly.sum(axis=1, keepdims=True)
+    return np.divide(hourly, totals, out=np.zeros_like(hourly), where=totals > 0)
+
+
+def features(days, origin):
+    # Shared by every series: trend in years and one column per weekday
+    trend = ((days - origin).days.to_numpy() / 365.0)[:, None]
+    weekdays = np.eye(7)[days.dayofweek.to_numpy()]
+    return np.hstack([trend, weekdays])
+
+
+class DemandForecast:
+    # Daily demand forecast of every (store, category) series from one
+    # multi-output Ridge fit: all series share the design matrix, so the whole
+    # batch is solved with a single factorization
+
+    def __init__(self, demand, hourly_share, horizon=HORIZON, interval=INTERVAL, alpha=1.0):
+        start = time.perf_counter()
+        self.series = demand.columns
+        self.history = demand.index
+        self.days = pd.date_range(demand.index[-1] + pd.Timedelta(days=1), periods=horizon, freq='D')
+        self.interval = interval
+        self.hourly_share = hourly_share
+
+        X = features(demand.index, demand.index[0])
+        Y = demand.to_numpy()
+        self.model = Ridge(alpha=alpha).fit(X, Y)
+        fitted = self.model.predict(X).reshape(Y.shape)
+        # Empirical residual quantiles per series, so skewed demand gets a skewed interval
+        residual = np.quantile(Y - fitted, [(1 - interval) / 2, (1 + interval) / 2], axis=0)
+
+        predicted = self.model.predict(features(self.days, demand.index[0])).reshape(horizon, -1)
+        self.predicted = np.clip(predicted, 0, None)
+        self.lower = np.clip(predicted + residual[0], 0, None)
+        self.upper = np.clip(predicted + residual[1], 0, None)
+        self.actual = Y
+        self.fit_seconds = time.perf_counter() - start
+
+    @classmethod
+    def from_cube(cls, cube, horizon=HORIZON):
+        demand = daily_demand(cube)
+        return cls(demand, hourly_shares(cube, demand.columns), horizon)
+
+    def _column(self, store, category):
+        return self.series.get_loc((store, category))
+
+    def daily(self, store, category):
+        # History and forecast of one series, one row per day
+        column = self._column(store, category)
+        history = pd.DataFrame({'actual': self.actual[:, column]}, index=self.history)
+        forecast = pd.DataFrame({
+            'predicted': self.predicted[:, column],
+            'lower': self.lower[:, column],
+            'upper': self.upper[:, column],
+        }, index=self.days)
+        return pd.concat([history, forecast]).rename_axis('date')
+
+    def hourly(self, store, category, day):
+        # A forecast day split over the hours by the series' historical profile
+        column = self._column(store, category)
+        step = self.days.get_loc(pd.Timestamp(day))
+        share = self.hourly_share[column]
+        return pd.DataFrame({
+            'predicted': self.predicted[step, column] * share,
+            'lower': self.lower[step, column] * share,
+            'upper': self.upper[step, column] * share,
+        }, index=pd.RangeIndex(24, name='hour'))
+
+    def totals(self):
+        # Forecast quantity over the whole horizon for every series
+        return pd.DataFrame({
+            'predicted': self.predicted.sum(axis=0),
+            'lower': self.lower.sum(axis=0),
+            'upper': self.upper.sum(axis=0),
+        }, index=self.series).round(1)
+
+
+def has_history(table):
+    days = table.cube.rollup('date').index
+    return (days.max() - days.min()).days + 1 >= MIN_HISTORY_DAYS
+
+
+def _fit(table, horizon):
+    with perf.stage('fit_forecast', rows=table.cube.rows):
+        return DemandForecast.from_cube(table.cube, horizon)
+
+
+def get_forecast(table, horizon=HORIZON):
+    # Fitted once per data version, kept with the other page results
+    return results.get(table, 'forecast', (horizon,), _fit)
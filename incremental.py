@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+import transactions
+
+# New transaction batches are dropped into INCOMING_DIR/<source name>/ as
+# .csv or .jsonl files. Write them under another name and rename them into
+# place, so a half-written file is never picked up.
+INCOMING_DIR = os.environ.get("COFFEE_INCOMING_DIR", "incoming")
+BATCH_EXTENSIONS = ('.csv', '.jsonl')
+
+logger = logging.getLogger(__name__)
+
+# source path -> state of the batches applied on top of its base table
+_sources = {}
+_lock = threading.Lock()
+
+
+class _SourceState:
+    def __init__(self, base):
+        self.base_version = base.version
+        self.table = base
+        # batch file name -> (mtime_ns, size) it had when it was read, and the
+        # names of those that were malformed and left out of the table
+        self.applied = {}
+        self.skipped = set()
+
+
+def batch_dir(source_path):
+    return os.path.join(INCOMING_DIR, os.path.splitext(os.path.basename(source_path))[0])
+
+
+def read_batch(path):
+    if path.endswith('.jsonl'):
+        # Keep dates and times as text, normalize_transactions parses them
+        return pd.read_json(path, lines=True, convert_dates=False, keep_default_dates=False)
+    return pd.read_csv(path)
+
+
+def _batches(source_path):
+    # name -> (path, (mtime_ns, size)) of every batch in the drop folder
+    directory = batch_dir(source_path)
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return {}
+    batches = {}
+    for name in names:
+        if not name.endswith(BATCH_EXTENSIONS):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        batches[name] = (path, (stat.st_mtime_ns, stat.st_size))
+    return batches
+
+
+def _next_version(version, key):
+    return hashlib.sha1(f"{version}|{key}".encode()).hexdigest()
+
+
+def _changed(state, batches):
+    # Whether a batch already in the table was rewritten or removed since
+    for name, signature in state.applied.items():
+        if name in state.skipped:
+            continue
+        if name not in batches or batches[name][1] != signature:
+            return True
+    return False
+
+
+def refresh(source_path, base):
+    # Apply every batch in the drop folder that the current table hasn't seen
+    # yet. Batches are known by file name, so touching one doesn't apply it
+    # twice. Only new batches are normalized and aggregated; when the base
+    # table changes, or a batch already applied is rewritten or removed, the
+    # table is rebuilt from the base with the batches there are now.
+    with _lock:
+        batches = _batches(source_path)
+        state = _sources.get(source_path)
+        if state is None or state.base_version != base.version or _changed(state, batches):
+            state = _SourceState(base)
+            _sources[source_path] = state
+
+        for name, (path, signature) in batches.items():
+            if state.applied.get(name) == signature:
+                continue
+            start = time.perf_counter()
+            state.applied[name] = signature
+            state.skipped.discard(name)
+            try:
+                batch = read_batch(path)
+                state.table = state.table.append(batch, _next_version(state.table.version, (name,) + signature))
+            except (ValueError, OSError) as e:
+                # Malformed batches are skipped until the file is replaced
+                logger.warning("Skipping transaction batch %s: %s", path, e)
+                state.skipped.add(name)
+            else:
+                logger.info("Appended %d transactions from %s in %.3fs",
+                            len(batch), path, time.perf_counter() - start)
+        return state.table
+
+
+def load_table(source_path, base_loader=transactions.load_table):
+    return refresh(source_path, base_loader(source_path))
+
+
+def append_transactions(source_path, batch, base_loader=transactions.load_table):
+    # Persist the batch into the drop folder, then fold it into the shared table
+    directory = batch_dir(source_path)
+    os.makedirs(directory, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 1_000_000_000:09d}.csv"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    batch.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, os.path.join(directory, name))
+    return load_table(source_path, base_loader)
@@ -0,0 +1,48 @@
+import base64
+import time
+
+import matplotlib.pyplot as plt
+
+import figure_cache
+import results
+
+
+def compute_kpis(table):
+    # One roll-up of the cube by location gives every number on the Home page
+    start = time.perf_counter()
+    by_location = table.cube.rollup('store_location')
+    revenue = by_location['revenue'].sort_values(ascending=False)
+    total_revenue = revenue.sum()
+    return {
+        'total_revenue': float(total_revenue),
+        'total_orders': int(by_location['count'].sum()),
+        'top_location': revenue.index[0],
+        'top_location_revenue': float(revenue.iloc[0]),
+        'location_share': revenue / total_revenue,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def get_kpis(table):
+    # Computed once per data version, kept with the page results
+    return results.get(table, 'kpis', (), compute_kpis)
+
+
+def location_share_pie(table):
+    # Revenue share per location as a base64 PNG, for embedding in the Home page HTML
+    kpis = get_kpis(table)
+    if 'pie_base64' not in kpis:
+        share = kpis['location_share']
+
+        def draw():
+            fig, ax = plt.subplots(figsize=(5, 5))
+            fig.patch.set_alpha(0)
+            ax.pie(share.values, labels=share.index, autopct='%1.1f%%', startangle=90,
+                   colors=['#6F4E37', '#C4A484', '#E6CCB2', '#A67B5B', '#ECE0D1'],
+                   textprops={'color': 'white', 'fontsize': 12})
+            ax.axis('equal')
+            return fig
+
+        image, _ = figure_cache.figures.render(('location_share_pie', (), table.version), draw)
+        kpis['pie_base64'] = base64.b64encode(image).decode()
+    return kpis['pie_base64']
@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import numpy as np
+# Not in requirements.txt: pip install -r requirements-dev.txt, which also pins
+# the Streamlit release whose protobuf messages are decoded below
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+import benchmark
+
+# Every page of the app, Home first as in a new browser session
+PAGES = ["🏠 Home"] + benchmark.APP_PAGES
+PERFORMANCE_PAGE = "⏱ Performance"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def _rss_bytes(pid):
+    with open(f'/proc/{pid}/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def start_server(app, port, timeout=120):
+    # A real `streamlit run`, so every user is a websocket session of one server process
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', app, '--server.headless', 'true',
+         '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited with {server.returncode}")
+        try:
+            with urllib.request.urlopen(f'http://localhost:{port}/_stcore/health', timeout=1):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"streamlit did not answer on port {port}")
+
+
+class Session:
+    # One browser tab: reruns the script the way the frontend does and waits
+    # until the server reports the run finished
+
+    def __init__(self, websocket, query_string=''):
+        self.websocket = websocket
+        self.query_string = query_string
+        self.radio = None
+        self.markdown = []
+        self.errors = []
+
+    async def run(self, page=None):
+        msg = BackMsg()
+        msg.rerun_script.query_string = self.query_string
+        if page is not None:
+            widget = msg.rerun_script.widget_states.widgets.add()
+            widget.id = self.radio
+            widget.string_value = page
+        self.markdown = []
+        await self.websocket.send(msg.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self.websocket.recv())
+            kind = forward.WhichOneof('type')
+            if kind == 'script_finished':
+                if forward.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    return
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type == 'radio':
+                    self.radio = element.radio.id
+                elif element_type == 'markdown':
+                    self.markdown.append(element.markdown.body)
+                elif element_type == 'exception':
+                    self.errors.append(f"{element.exception.type}: {element.exception.message}")
+
+
+async def _user(url, rounds, think, views, errors):
+    # Open the app, then click through every page `rounds` times
+    async with websockets.connect(url, max_size=None) as websocket:
+        session = Session(websocket)
+        view_start = time.perf_counter()
+        await session.run()
+        views.append((PAGES[0], time.perf_counter() - view_start))
+        for _ in range(rounds):
+            for page in PAGES[1:] + PAGES[:1]:
+                await asyncio.sleep(think)
+                view_start = time.perf_counter()
+                await session.run(page)
+                views.append((page, time.perf_counter() - view_start))
+        errors.extend(session.errors)
+
+
+async def _stale_reads(url):
+    # Read from the server's own Performance page
+    async with websockets.connect(url, max_size=None) as websocket:
+        session = Session(websocket, 'perf=1')
+        await session.run()
+        await session.run(PERFORMANCE_PAGE)
+    for body in session.markdown:
+        match = re.search(r'Reads served during a refresh: (\d+)', body)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _percentiles(seconds):
+    return {
+        'views': len(seconds),
+        'p50_ms': float(np.percentile(seconds, 50) * 1000),
+        'p95_ms': float(np.percentile(seconds, 95) * 1000),
+        'max_ms': float(max(seconds) * 1000),
+    }
+
+
+async def _run(url, pid, users, rounds, think):
+    views, errors = [], []
+    rss = [_rss_bytes(pid)]
+
+    async def sample():
+        while True:
+            await asyncio.sleep(0.05)
+            rss.append(_rss_bytes(pid))
+
+    sampler = asyncio.create_task(sample())
+    wall_start = time.perf_counter()
+    outcomes = await asyncio.gather(*(_user(url, rounds, think, views, errors) for _ in range(users)),
+                                    return_exceptions=True)
+    wall = time.perf_counter() - wall_start
+    sampler.cancel()
+    rss.append(_rss_bytes(pid))
+    errors += [repr(outcome) for outcome in outcomes if isinstance(outcome, Exception)]
+    return views, errors, rss, wall
+
+
+def run(app, users, rounds, think):
+    # A fresh server per run, so its memory is what `users` sessions need
+    port = _free_port()
+    url = f'ws://localhost:{port}/_stcore/stream'
+    server = start_server(app, port)
+    try:
+        views, errors, rss, wall = asyncio.run(_run(url, server.pid, users, rounds, think))
+        stale_reads = asyncio.run(_stale_reads(url))
+    finally:
+        server.terminate()
+        server.wait()
+
+    by_page = {}
+    for page, seconds in views:
+        by_page.setdefault(page, []).append(seconds)
+    return {
+        'users': users,
+        'rounds': rounds,
+        'think_seconds': think,
+        'wall_seconds': wall,
+        'views_per_second': len(views) / wall,
+        'all': _percentiles([seconds for _, seconds in views]) if views else {},
+        'pages': {page: _percentiles(by_page[page]) for page in PAGES if page in by_page},
+        'server_rss_start_mb': rss[0] / 2 ** 20,
+        'server_rss_peak_mb': max(rss) / 2 ** 20,
+        'server_rss_end_mb': rss[-1] / 2 ** 20,
+        'stale_reads': stale_reads,
+        'errors': sorted(set(errors)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent users clicking through every page.")
+    parser.add_argument('--users', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--rounds', type=int, default=2, help="times every user clicks through all pages")
+    parser.add_argument('--think', type=float, default=0.2, help="seconds between two clicks of a user")
+    parser.add_argument('--app', default=benchmark.APP_PATH)
+    parser.add_argument('--output', default='loadtest_output.json')
+    args = parser.parse_args(argv)
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs': []}
+    for users in args.users:
+        result = run(args.app, users, args.rounds, args.think)
+        report['runs'].append(result)
+        print(f"{users:>3} users  {result['views_per_second']:6.2f} views/s  "
+              f"p50 {result['all'].get('p50_ms', 0):8.1f} ms  p95 {result['all'].get('p95_ms', 0):8.1f} ms  "
+              f"server RSS {result['server_rss_start_mb']:.0f} -> {result['server_rss_peak_mb']:.0f} MiB peak",
+              file=sys.stderr)
+        for page, stats in result['pages'].items():
+            print(f"       {page:<22} p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms",
+                  file=sys.stderr)
+        if result['errors']:
+            print(f"       errors: {result['errors']}", file=sys.stderr)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    return 1 if any(result['errors'] for result in report['runs']) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
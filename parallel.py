@@ -0,0 +1,131 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import perf
+from cube import SalesCube
+
+# Worker processes used to aggregate transactions; 0 keeps everything in the
+# calling process
+WORKERS = int(os.environ.get("COFFEE_WORKERS", 0))
+
+# Largest slice of one store handed to a worker. Partitions depend on the data
+# only, never on the number of workers, so every worker count gives the same cube.
+PARTITION_ROWS = int(os.environ.get("COFFEE_PARTITION_ROWS", 1_000_000))
+
+# Column buffers are written here and memory-mapped by the workers, so the
+# partitions are never pickled; /dev/shm keeps them in RAM where it exists
+BUFFER_DIR = os.environ.get("COFFEE_BUFFER_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+CATEGORY_COLUMNS = ['store_location', 'product_category', 'product_detail']
+NUMERIC_COLUMNS = ['unit_price', 'transaction_day', 'hour', 'transaction_qty', 'revenue']
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(workers):
+    # One long-lived pool per worker count; spawned, not forked, because the
+    # app process runs Streamlit's threads
+    with _lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _pools[workers] = pool
+        return pool
+
+
+@atexit.register
+def shutdown():
+    with _lock:
+        for pool in _pools.values():
+            pool.shutdown(cancel_futures=True)
+        _pools.clear()
+
+
+def partitions(store_codes, partition_rows=PARTITION_ROWS):
+    # (order, [(store, start, stop), ...]): row positions grouped by store
+    # (stable, so file order within a store) and slices of them, never
+    # spanning two stores
+    order = np.argsort(store_codes, kind='stable')
+    offsets = np.searchsorted(store_codes[order], np.arange(store_codes.max() + 2))
+    slices = []
+    for store, (low, high) in enumerate(zip(offsets[:-1], offsets[1:])):
+        for start in range(low, high, partition_rows):
+            slices.append((store, int(start), int(min(start + partition_rows, high))))
+    return order, slices
+
+
+def write_buffers(store_df, order, directory):
+    # Every column the cube needs, in partition order, as .npy files
+    for col in CATEGORY_COLUMNS:
+        np.save(os.path.join(directory, f"{col}.npy"), store_df[col].cat.codes.to_numpy()[order])
+    for col in NUMERIC_COLUMNS:
+        np.save(os.path.join(directory, f"{col}.npy"), store_df[col].to_numpy()[order])
+    np.save(os.path.join(directory, "first_row.npy"), order)
+
+
+def _aggregate_partition(directory, dtypes, start, stop):
+    # Runs in a worker: map the buffers, aggregate one slice
+    columns = {col: np.load(os.path.join(directory, f"{col}.npy"), mmap_mode='r')[start:stop]
+               for col in CATEGORY_COLUMNS + NUMERIC_COLUMNS + ['first_row']}
+    frame = pd.DataFrame({col: pd.Categorical.from_codes(columns[col], dtype=dtypes[col])
+                          for col in CATEGORY_COLUMNS})
+    for col in NUMERIC_COLUMNS:
+        frame[col] = np.asarray(columns[col])
+    return SalesCube.from_transactions(frame, first_row=np.asarray(columns['first_row'])).cells
+
+
+def merge_partitions(slices, cells, rows, dtypes):
+    # Slices of different stores never share a cell, so only the slices of a
+    # split store are merged; stores come out in code order, as in one big groupby
+    parts = []
+    for _, group in itertools.groupby(zip(slices, cells), key=lambda item: item[0][0]):
+        group = [part for _, part in group]
+        parts.append(group[0] if len(group) == 1 else SalesCube.from_partitions(group, 0).cells)
+    merged = pd.concat(parts, ignore_index=True)
+    # Every part has its own categories (only the ones it saw), recode to the table's
+    for col in CATEGORY_COLUMNS:
+        codes = np.concatenate([pd.Categorical(part[col], dtype=dtypes[col]).codes for part in parts])
+        merged[col] = pd.Categorical.from_codes(codes, dtype=dtypes[col])
+    return SalesCube(merged, rows)
+
+
+def build_cube(store_df, workers=None, partition_rows=PARTITION_ROWS):
+    # Same cells as SalesCube.from_transactions, aggregated per store slice
+    # across a process pool and merged in a fixed order
+    workers = WORKERS if workers is None else workers
+    if workers < 1 or len(store_df) <= partition_rows:
+        return SalesCube.from_transactions(store_df)
+
+    start_time = time.perf_counter()
+    dtypes = {col: store_df[col].dtype for col in CATEGORY_COLUMNS}
+    order, slices = partitions(store_df['store_location'].cat.codes.to_numpy(), partition_rows)
+    directory = tempfile.mkdtemp(prefix='coffee-columns-', dir=BUFFER_DIR)
+    try:
+        with perf.stage('write_buffers', rows=len(store_df)):
+            write_buffers(store_df, order, directory)
+        pool = get_pool(workers)
+        with perf.stage('aggregate_partitions', rows=len(store_df), workers=workers, partitions=len(slices)):
+            # map() hands results back in submission order, whichever worker finishes first
+            cells = list(pool.map(_aggregate_partition, [directory] * len(slices), [dtypes] * len(slices),
+                                  [start for _, start, _ in slices], [stop for _, _, stop in slices]))
+        with perf.stage('merge_partitions', rows=sum(len(part) for part in cells)):
+            cube = merge_partitions(slices, cells, len(store_df), dtypes)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    logger.info("Aggregated %d rows in %d partitions on %d workers in %.3fs",
+                len(store_df), len(slices), workers, time.perf_counter() - start_time)
+    return cube
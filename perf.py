@@ -0,0 +1,142 @@
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+# Completed spans kept for the Performance page and exports
+MAX_SPANS = int(os.environ.get("COFFEE_PERF_SPANS", 20000))
+
+# Show the hidden Performance page with COFFEE_PERF_PANEL=1 or ?perf=1
+PANEL_ENABLED = os.environ.get("COFFEE_PERF_PANEL", "0") == "1"
+
+_spans = deque(maxlen=MAX_SPANS)
+_local = threading.local()
+_origin = time.perf_counter()
+_page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    # Current resident set size; falls back to the peak where /proc is missing
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _page_size
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def stage(name, rows=None, **args):
+    # Record wall time, rows processed and RSS change of a block. Stages nest;
+    # the yielded dict can be used to fill in rows once they are known.
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    span = {'name': name, 'rows': rows, 'depth': len(stack), 'thread': threading.get_ident(), **args}
+    stack.append(span)
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        span['seconds'] = time.perf_counter() - start
+        span['start'] = start - _origin
+        span['rss_delta'] = rss_bytes() - rss_before
+        stack.pop()
+        _spans.append(span)
+
+
+def traced(func=None, *, name=None):
+    # Decorator form of stage(); rows default to the length of the first argument
+    if func is None:
+        return functools.partial(traced, name=name)
+    stage_name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        rows = len(args[0]) if args and hasattr(args[0], '__len__') else None
+        with stage(stage_name, rows=rows):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def spans():
+    return list(_spans)
+
+
+def clear():
+    _spans.clear()
+
+
+def summary():
+    # Percentiles of every stage across all recorded runs
+    df = pd.DataFrame(spans())
+    if df.empty:
+        return df
+    df['ms'] = df['seconds'] * 1000
+    grouped = df.groupby('name')
+    result = pd.DataFrame({
+        'calls': grouped.size(),
+        'p50_ms': grouped['ms'].quantile(0.5),
+        'p90_ms': grouped['ms'].quantile(0.9),
+        'p99_ms': grouped['ms'].quantile(0.99),
+        'max_ms': grouped['ms'].max(),
+        'total_ms': grouped['ms'].sum(),
+        'rows': grouped['rows'].max(),
+        'rss_delta_mb': grouped['rss_delta'].mean() / 2 ** 20,
+    })
+    return result.sort_values('total_ms', ascending=False).round(2)
+
+
+def export_json():
+    return json.dumps(spans(), default=str)
+
+
+def export_chrome_trace():
+    # Complete ("X") events, loadable in chrome://tracing or Perfetto
+    events = [{
+        'name': span['name'],
+        'ph': 'X',
+        'ts': span['start'] * 1e6,
+        'dur': span['seconds'] * 1e6,
+        'pid': os.getpid(),
+        'tid': span['thread'],
+        'args': {key: value for key, value in span.items()
+                 if key not in ('name', 'start', 'seconds', 'thread')},
+    } for span in spans()]
+    return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'}, default=str)
+
+
+def panel_enabled(query_params):
+    return PANEL_ENABLED or query_params.get('perf') == '1'
+
+
+def performance_page():
+    import streamlit as st
+
+    import data_loader
+    import figure_cache
+    import shared
+
+    st.header("Performance")
+    st.write("Wall time per stage across reruns of every session in this process.")
+    st.dataframe(summary())
+
+    st.subheader("Data loading")
+    st.write(pd.DataFrame(data_loader.load_stats()).T)
+    st.write("Shared tables:", shared.versions(), f"Reads served during a refresh: {shared.stale_reads}")
+
+    st.subheader("Figure cache")
+    st.write(figure_cache.stats())
+
+    st.download_button("Export traces (JSON)", export_json(), file_name="traces.json", mime="application/json")
+    st.download_button("Export Chrome trace", export_chrome_trace(), file_name="chrome_trace.json",
+                       mime="application/json")
+    if st.button("Clear traces"):
+        clear()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+import plotly.io
+
+import customer
+import data_loader
+import figure_cache
+import filters
+import forecast
+import incremental
+import parallel
+import results
+import store
+import transactions
+
+# Page results computed for each table, as show_page in Coffe_shop.py uses them
+SOURCE_RESULTS = {
+    data_loader.TRANSACTIONS_PATH: ['transaction_in_day_basis', 'transaction_in_month_basis', 'revenue_anomalies'],
+    data_loader.NEW_DATA_PATH: [
+        'transaction_in_hour_basis', 'display_barista_revenue', 'average_price_basis', 'lowest_sale_product',
+        'category_basis_transaction', 'average_category_transaction', 'category_transaction', 'demand_forecast',
+    ],
+}
+
+logger = logging.getLogger(__name__)
+
+
+def load_table(path):
+    # Same table (and version) the app serves
+    return incremental.load_table(path, store.load_table if store.ENABLED else transactions.load_table)
+
+
+def result_params(name, data_filter):
+    # Parameters the pages pass: Future Demand drops its 6 month window when
+    # dates are picked, the forecast uses the default horizon
+    if name in ('average_category_transaction', 'category_transaction'):
+        return (None if data_filter.start or data_filter.end else 6,)
+    if name == 'demand_forecast':
+        return (forecast.HORIZON,)
+    return ()
+
+
+def table_filters(table, per_store=False, per_month=False):
+    # The whole table, then optionally every store and every calendar month,
+    # built the way the sidebar builds them (a bound at the edge of the data is no bound)
+    cube = table.cube
+    data_filters = [filters.DataFilter()]
+    if per_store:
+        data_filters += [filters.DataFilter(stores=[location]) for location in sorted(cube.rollup('store_location').index)]
+    if per_month:
+        days = cube.rollup('date').index
+        first_day, last_day = days.min(), days.max()
+        for month in pd.period_range(first_day, last_day, freq='M'):
+            start = max(month.start_time.floor('D'), first_day)
+            end = min(month.end_time.floor('D'), last_day)
+            data_filters.append(filters.DataFilter(None if start == first_day else start,
+                                                   None if end == last_day else end))
+    return data_filters
+
+
+def precompute_table(path, data_filter, directory, backends):
+    # Runs in a worker: every page result of one (filtered) table and its charts
+    start = time.perf_counter()
+    table = load_table(path).filter(data_filter)
+    summary = {'source': path, 'filter': repr(data_filter), 'version': table.version, 'results': 0, 'figures': 0}
+    if table.cube.rows == 0:
+        return summary
+    for name in SOURCE_RESULTS[path]:
+        compute, figures = customer.PAGE_RESULTS[name]
+        params = result_params(name, data_filter)
+        data = compute(table, *params)
+        results.save(table.version, name, params, data, directory)
+        summary['results'] += 1
+        if data is None:
+            continue
+        for figure_name, figure_params, draw, plot in figures(data, *params):
+            if 'matplotlib' in backends:
+                image, _ = figure_cache.encode_png(draw())
+                results.save_figure(table.version, figure_name, figure_params, image, 'png', directory)
+            if 'plotly' in backends:
+                spec = plotly.io.to_json(plot(), validate=False)
+                results.save_figure(table.version, figure_name, figure_params, spec, 'json', directory)
+            summary['figures'] += 1
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def precompute(sources, directory, workers, per_store=False, per_month=False, backends=('matplotlib', 'plotly')):
+    tasks = []
+    versions = {}
+    for path in sources:
+        table = load_table(path)
+        versions[path] = table.version
+        tasks += [(path, data_filter) for data_filter in table_filters(table, per_store, per_month)]
+
+    args = ([path for path, _ in tasks], [data_filter for _, data_filter in tasks],
+            [directory] * len(tasks), [backends] * len(tasks))
+    if workers < 1:
+        summaries = list(map(precompute_table, *args))
+    else:
+        summaries = list(parallel.get_pool(workers).map(precompute_table, *args))
+        parallel.shutdown()
+
+    # Only the snapshot of the current data is kept
+    written = {os.path.basename(results.version_dir(summary['version'])) for summary in summaries}
+    for name in os.listdir(directory):
+        if os.path.isdir(os.path.join(directory, name)) and name not in written:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    manifest = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'sources': versions, 'tables': summaries}
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute every dashboard page's tables and charts ahead of time.")
+    parser.add_argument('sources', nargs='*', default=list(SOURCE_RESULTS),
+                        help=f"any of {', '.join(SOURCE_RESULTS)} (default: both)")
+    parser.add_argument('--output', default=results.RESULTS_DIR,
+                        help="results directory; the app reads COFFEE_RESULTS_DIR (default %(default)s)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="worker processes, 0 computes everything in this process")
+    parser.add_argument('--per-store', action='store_true', help="also every single-store filter")
+    parser.add_argument('--per-month', action='store_true', help="also every calendar month")
+    parser.add_argument('--backends', nargs='+', choices=['matplotlib', 'plotly'], default=['matplotlib', 'plotly'])
+    args = parser.parse_args(argv)
+    unknown = [path for path in args.sources if path not in SOURCE_RESULTS]
+    if unknown:
+        parser.error(f"no pages use {', '.join(unknown)}")
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.output, exist_ok=True)
+    start = time.perf_counter()
+    manifest = precompute(args.sources, args.output, args.workers, args.per_store, args.per_month,
+                          tuple(args.backends))
+    tables = manifest['tables']
+    print(f"{len(tables)} tables, {sum(t['results'] for t in tables)} results, "
+          f"{sum(t['figures'] for t in tables)} charts in {time.perf_counter() - start:.1f}s -> {args.output}",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
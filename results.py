@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import data_loader
+import perf
+
+# Page results (tables, numbers and rendered charts) precomputed by
+# precompute.py, one directory per data version. The app reads them instead
+# of computing when the snapshot matches the data it has loaded.
+RESULTS_DIR = os.environ.get("COFFEE_RESULTS_DIR", os.path.join(data_loader.CACHE_DIR, 'results'))
+
+# Results kept in memory, across all data versions
+MAX_ENTRIES = int(os.environ.get("COFFEE_RESULTS_ENTRIES", 256))
+
+logger = logging.getLogger(__name__)
+
+_results = OrderedDict()
+# Locks of results being computed, so concurrent sessions compute each one once
+_pending = {}
+_lock = threading.Lock()
+
+
+def version_dir(version, directory=None):
+    # Filtered versions are "<version>:<filter key>"
+    return os.path.join(directory or RESULTS_DIR, version.replace(':', '-'))
+
+
+def path(version, name, params, extension='pkl', directory=None):
+    digest = hashlib.sha1(repr(params).encode()).hexdigest()[:12]
+    return os.path.join(version_dir(version, directory), f"{name}-{digest}.{extension}")
+
+
+def _write(file_path, content):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+
+
+def _read(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def save(version, name, params, data, directory=None):
+    file_path = path(version, name, params, 'pkl', directory)
+    _write(file_path, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    return file_path
+
+
+def load(version, name, params, directory=None):
+    content = _read(path(version, name, params, 'pkl', directory))
+    if content is None:
+        return None
+    try:
+        return pickle.loads(content)
+    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        logger.warning("Ignoring unreadable result %s %r: %s", name, params, e)
+        return None
+
+
+def save_figure(version, name, params, content, extension, directory=None):
+    # content: PNG bytes or plotly JSON
+    file_path = path(version, name, params, extension, directory)
+    _write(file_path, content if isinstance(content, bytes) else content.encode())
+    return file_path
+
+
+def load_figure(version, name, params, extension, directory=None):
+    return _read(path(version, name, params, extension, directory))
+
+
+def get(table, name, params, compute):
+    # compute(table, *params) at most once per data version: memory first,
+    # then the precomputed snapshot (only for versions that identify the data).
+    # Sessions asking for a result another one is computing wait for it.
+    key = (table.version, name, params)
+    with _lock:
+        if key in _results:
+            _results.move_to_end(key)
+            return _results[key]
+        pending = _pending.setdefault(key, threading.Lock())
+
+    with pending:
+        with _lock:
+            if key in _results:
+                return _results[key]
+        try:
+            data = load(table.version, name, params) if table.persistent else None
+            if data is None:
+                with perf.stage('compute', result=name):
+                    data = compute(table, *params)
+            with _lock:
+                _results[key] = data
+                while len(_results) > MAX_ENTRIES:
+                    _results.popitem(last=False)
+        finally:
+            with _lock:
+                _pending.pop(key, None)
+    return data
+
+
+def ready(table, name, params):
+    # Whether get() can answer without computing
+    with _lock:
+        if (table.version, name, params) in _results:
+            return True
+    return table.persistent and os.path.exists(path(table.version, name, params))
+
+
+def clear():
+    with _lock:
+        _results.clear()
@@ -0,0 +1,41 @@
+import threading
+
+# Tables read by every session of the process. Once a table is loaded no
+# session waits for a refresh: the first one to notice a change rebuilds it
+# while the others keep reading the previous version, then the new table
+# replaces it in a single assignment. Tables are never modified after they
+# are built (pages only get copy-on-write views), so the old one stays valid
+# for the sessions still rendering with it.
+
+_tables = {}
+_locks = {}
+_lock = threading.Lock()
+
+# Reads answered with the current table while another session was refreshing it
+stale_reads = 0
+
+
+def get_table(path, loader):
+    # loader(path) returns the table of the current data, rebuilding it only
+    # when the source changed; it runs in one session at a time per path
+    global stale_reads
+    with _lock:
+        current = _tables.get(path)
+        refresh_lock = _locks.setdefault(path, threading.Lock())
+    # Only the very first load is waited for
+    if not refresh_lock.acquire(blocking=current is None):
+        with _lock:
+            stale_reads += 1
+        return current
+    try:
+        table = loader(path)
+        with _lock:
+            _tables[path] = table
+        return table
+    finally:
+        refresh_lock.release()
+
+
+def versions():
+    with _lock:
+        return {path: table.version for path, table in _tables.items()}
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+import perf
+from cube import SalesCube
+from transactions import TransactionTable
+
+# Normalized transactions and their cube, converted once per source version
+# into fixed-width .npy columns and memory-mapped read-only by every process,
+# so all Streamlit processes on a machine share one physical copy
+STORE_DIR = os.path.join(data_loader.CACHE_DIR, 'store')
+FORMAT_VERSION = 1
+
+# Set COFFEE_MMAP_STORE=0 to keep a private, parsed copy in every process instead
+ENABLED = os.environ.get("COFFEE_MMAP_STORE", "1") == "1"
+
+logger = logging.getLogger(__name__)
+
+# path -> (mtime_ns, size, table, load stats)
+_tables = {}
+_lock = threading.Lock()
+
+
+def _code_dtype(categories):
+    for dtype in (np.int8, np.int16, np.int32):
+        if len(categories) < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def write_columns(df, directory):
+    # Numbers as they are, timestamps as int64 ticks, text as the smallest
+    # integer codes that fit plus a dictionary array
+    os.makedirs(directory)
+    columns = []
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        path = os.path.join(directory, f"{i}.npy")
+        if values.dtype.kind == 'M':
+            unit = np.datetime_data(values.dtype)[0]
+            np.save(path, values.to_numpy().view(np.int64))
+            columns.append({'name': col, 'kind': 'timestamp', 'unit': unit})
+        elif values.dtype.kind in 'biuf':
+            np.save(path, values.to_numpy())
+            columns.append({'name': col, 'kind': 'array'})
+        else:
+            categorical = isinstance(values.dtype, pd.CategoricalDtype)
+            cat = values.array if categorical else pd.Categorical(values.astype(str).where(values.notna()))
+            np.save(path, cat.codes.astype(_code_dtype(cat.categories)))
+            np.save(os.path.join(directory, f"{i}.dict.npy"), np.asarray(cat.categories, dtype=str))
+            columns.append({'name': col, 'kind': 'dictionary', 'categorical': categorical})
+    with open(os.path.join(directory, 'columns.json'), 'w') as f:
+        json.dump({'format': FORMAT_VERSION, 'rows': len(df), 'columns': columns}, f)
+
+
+def open_columns(directory):
+    # DataFrame over memory-mapped columns; numeric, timestamp and
+    # categorical code arrays are used in place, nothing is copied
+    with open(os.path.join(directory, 'columns.json')) as f:
+        layout = json.load(f)
+    data = {}
+    for i, column in enumerate(layout['columns']):
+        # Plain ndarray views of the maps, so pandas never sees np.memmap
+        values = np.load(os.path.join(directory, f"{i}.npy"), mmap_mode='r').view(np.ndarray)
+        if column['kind'] == 'timestamp':
+            values = values.view(f"M8[{column['unit']}]")
+        elif column['kind'] == 'dictionary':
+            categories = np.load(os.path.join(directory, f"{i}.dict.npy"))
+            values = pd.Categorical.from_codes(values, dtype=pd.CategoricalDtype(categories), validate=False)
+            if not column['categorical']:
+                values = np.asarray(values, dtype=object)
+        data[column['name']] = values
+    return pd.DataFrame(data, copy=False), layout
+
+
+def store_dir(path, version):
+    return os.path.join(STORE_DIR, os.path.basename(path), f"{version}-v{FORMAT_VERSION}")
+
+
+def convert(path, directory, stats=None):
+    # Normalize the parsed source, read through data_loader's bundle so the
+    # spreadsheet itself is parsed at most once per version, then write its
+    # rows and cube
+    stats = {} if stats is None else stats
+    frame = data_loader.read_frame(path, stats)
+    start = time.perf_counter()
+    table = TransactionTable.from_frame(frame)
+    tmp_dir = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    write_columns(table.frame, os.path.join(tmp_dir, 'rows'))
+    write_columns(table.cube.cells, os.path.join(tmp_dir, 'cube'))
+    try:
+        os.replace(tmp_dir, directory)
+    except OSError:
+        # Another process converted the same version first, its copy is just as good
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        # Drop stores of older versions of the source; processes that still
+        # have them mapped keep their pages until they let go
+        parent = os.path.dirname(directory)
+        for name in os.listdir(parent):
+            old_dir = os.path.join(parent, name)
+            if old_dir != directory and not name.endswith('.tmp'):
+                shutil.rmtree(old_dir, ignore_errors=True)
+    stats['convert_seconds'] = time.perf_counter() - start
+    logger.info("Converted %s (%d rows) in %.3fs", path, len(table), stats['convert_seconds'])
+
+
+def open_table(directory, version):
+    frame, _ = open_columns(os.path.join(directory, 'rows'))
+    cells, _ = open_columns(os.path.join(directory, 'cube'))
+    return TransactionTable(frame, version, SalesCube(cells, len(frame)))
+
+
+def load_table(path):
+    # Converted on first use of a source version, mapped once per process.
+    # Like data_loader.load_frame, an unchanged mtime and size answers from
+    # memory, so reruns never read the source.
+    stat = os.stat(path)
+    with _lock:
+        cached = _tables.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            cached[3]['memory_hits'] += 1
+            return cached[2]
+
+        start = time.perf_counter()
+        stats = {'hash_seconds': 0.0, 'parse_seconds': 0.0, 'write_seconds': 0.0, 'convert_seconds': 0.0,
+                 'map_seconds': 0.0}
+        version = data_loader.source_version(path, stat, stats)
+        table = cached[2] if cached is not None else None
+        if table is not None and table.version == version:
+            # Touched but not changed
+            stats['store'] = 'memory'
+        else:
+            directory = store_dir(path, version)
+            if os.path.exists(os.path.join(directory, 'cube', 'columns.json')):
+                stats['store'] = 'mapped'
+            else:
+                stats['store'] = 'converted'
+                with perf.stage('convert_store', path=path):
+                    convert(path, directory, stats)
+            map_start = time.perf_counter()
+            table = open_table(directory, version)
+            stats['map_seconds'] = time.perf_counter() - map_start
+        stats['total_seconds'] = time.perf_counter() - start
+        stats['rows'] = len(table)
+        stats['version'] = version
+        stats['memory_hits'] = 0
+
+        _tables[path] = (stat.st_mtime_ns, stat.st_size, table, stats)
+        data_loader.record_stats(path, stats)
+        return table
+
+
+def private_bytes():
+    # Anonymous (not file-backed) resident memory of this process
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return perf.rss_bytes()
+
+
+def _touch(table):
+    # Read every column once, as the pages eventually do
+    for frame in (table.frame, table.cube.cells):
+        for col in frame.columns:
+            values = frame[col]
+            values = values.cat.codes if isinstance(values.dtype, pd.CategoricalDtype) else values
+            values.to_numpy().view(np.uint8).sum()
+
+
+def memory_comparison(path):
+    # Bytes held by the raw frame, the normalized table and the mapped store
+    raw = data_loader.read_source(path)
+    raw_bytes = int(raw.memory_usage(index=True, deep=True).sum())
+
+    before = private_bytes()
+    parsed = TransactionTable.from_frame(raw)
+    _touch(parsed)
+    parsed_private = private_bytes() - before
+    parsed_bytes = int(parsed.memory_usage().sum() + parsed.cube.cells.memory_usage(index=True, deep=True).sum())
+    del raw, parsed
+
+    version = data_loader.source_version(path)
+    directory = store_dir(path, version)
+    if not os.path.exists(os.path.join(directory, 'cube', 'columns.json')):
+        convert(path, directory)
+    disk_bytes = sum(os.path.getsize(os.path.join(root, name))
+                     for root, _, names in os.walk(directory) for name in names)
+    before = private_bytes()
+    mapped = open_table(directory, version)
+    _touch(mapped)
+    mapped_private = private_bytes() - before
+    return pd.Series({
+        'raw_frame_bytes': raw_bytes,
+        'normalized_table_bytes': parsed_bytes,
+        'normalized_private_rss': parsed_private,
+        'store_disk_bytes': disk_bytes,
+        'store_private_rss': mapped_private,
+    }, name=os.path.basename(path))
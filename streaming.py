@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+import data_loader
+from cube import SalesCube
+from transactions import TransactionTable, normalize_transactions
+
+# Rows parsed and folded into the aggregates at a time
+CHUNK_ROWS = int(os.environ.get("COFFEE_CHUNK_ROWS", 100_000))
+
+# Set COFFEE_STREAMING=1 to build the dashboard from aggregates only
+ENABLED = os.environ.get("COFFEE_STREAMING", "0") == "1"
+
+# Roll-ups the pages read, the only aggregates kept in streaming mode; the
+# (location, category, day) one only for the last WINDOW_MONTHS months, what
+# the category pages show
+WINDOW_MONTHS = int(os.environ.get("COFFEE_STREAMING_MONTHS", 6))
+WINDOWED_ROLLUPS = [['store_location', 'product_category', 'date']]
+ROLLUPS = [
+    'store_location', 'product_category', 'product_detail', 'month', 'date',
+    ['date', 'store_location'],
+    ['store_location', 'hour'],
+    ['store_location', 'unit_price'],
+    ['product_category', 'product_detail'],
+    ['store_location', 'product_detail', 'unit_price'],
+    ['product_detail', 'store_location', 'hour'],
+    ['store_location', 'product_category', 'hour'],
+    ['store_location', 'date', 'hour'],
+]
+
+logger = logging.getLogger(__name__)
+
+_tables = {}
+_lock = threading.Lock()
+
+
+def _iter_excel_chunks(path, chunksize):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def iter_chunks(path, chunksize=CHUNK_ROWS):
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        yield from _iter_excel_chunks(path, chunksize)
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def stream_cube(path, chunksize=CHUNK_ROWS):
+    # Fold the source into the page roll-ups one chunk at a time, so memory
+    # is bounded by the chunk size and the roll-ups, never by the rows or the
+    # cells (which can come close to one per transaction on long histories).
+    # Every chunk is aggregated on its own and merged into the coarse cube.
+    cube = SalesCube.coarse(ROLLUPS, WINDOWED_ROLLUPS, WINDOW_MONTHS)
+    rows = 0
+    for chunk in iter_chunks(path, chunksize):
+        chunk_cube = SalesCube.from_transactions(normalize_transactions(chunk), row_offset=rows)
+        rows += chunk_cube.rows
+        cube.merge(chunk_cube)
+    if not rows:
+        raise ValueError(f"No transactions in {path}")
+    return cube
+
+
+def load_table(path, chunksize=CHUNK_ROWS):
+    stat = os.stat(path)
+    with _lock:
+        cached = _tables.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        start = time.perf_counter()
+        table = TransactionTable.from_cube(stream_cube(path, chunksize), data_loader.file_digest(path))
+        _tables[path] = (stat.st_mtime_ns, stat.st_size, table)
+        logger.info("Streamed %s (%d rows, %d roll-up bytes) in %.3fs",
+                    path, table.cube.rows, table.cube.memory_usage().sum(), time.perf_counter() - start)
+        return table
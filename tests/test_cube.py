@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import cube
+import filters
+from benchmark import make_transactions
+from cube import SalesCube
+from transactions import normalize_transactions
+
+BATCHES = [(4000, 4100), (4100, 4150), (4150, 4650), (4650, 5000)]
+
+
+@pytest.fixture(scope='module')
+def rows():
+    frame = normalize_transactions(make_transactions(5000, days=400))
+    # A batch with a new product, a new store, a new price and a day before the first
+    batch = frame.iloc[4100:4150].copy()
+    for col, values in [('product_detail', 'AAA new'), ('store_location', 'Zed')]:
+        batch[col] = batch[col].cat.add_categories([values])
+    batch.iloc[:5, batch.columns.get_loc('product_detail')] = 'AAA new'
+    batch.iloc[5:9, batch.columns.get_loc('store_location')] = 'Zed'
+    batch.iloc[:3, batch.columns.get_loc('unit_price')] = 99.125
+    batch['revenue'] = batch['transaction_qty'] * batch['unit_price']
+    batch.iloc[9:12, batch.columns.get_loc('transaction_day')] = pd.Timestamp('2020-01-01')
+    frame = pd.concat([frame.iloc[:4100], batch, frame.iloc[4150:]], ignore_index=True)
+    for col in cube.CATEGORY_DIMENSIONS:
+        frame[col] = frame[col].astype(str).astype('category')
+    return frame
+
+
+def merged(rows, rollups=()):
+    # Base cube plus every batch merged in, asking for the given roll-ups
+    # before each merge so they are carried forward
+    built = SalesCube.from_transactions(rows.iloc[:BATCHES[0][0]])
+    for low, high in BATCHES:
+        for by in rollups:
+            built.rollup(by)
+        built = built.copy().merge(SalesCube.from_transactions(rows.iloc[low:high], row_offset=low))
+    return built
+
+
+def test_insert_matches_regroup(rows):
+    cells = SalesCube.from_transactions(rows.iloc[:4000]).cells
+    new = SalesCube.from_transactions(rows.iloc[4000:4650], row_offset=4000).cells
+    inserted = cube._insert(cells, new)
+    assert inserted is not None
+    pd.testing.assert_frame_equal(inserted, SalesCube.from_transactions(rows.iloc[:4650]).cells, rtol=1e-9)
+
+
+def test_merged_cells_match_regroup(rows):
+    built = merged(rows)
+    assert built.rows == len(rows)
+    assert len(built._runs) > 1
+    expected = SalesCube.from_transactions(rows).cells
+    pd.testing.assert_frame_equal(built.cells, expected, rtol=1e-9)
+    assert len(built._runs) == 1
+
+
+@pytest.mark.parametrize('by', [
+    'store_location',
+    ['store_location', 'hour'],
+    ['date', 'store_location'],
+    ['store_location', 'product_detail', 'unit_price'],
+    ['store_location', 'product_category', 'date'],
+])
+def test_carried_rollups_match_regroup(rows, by):
+    built = merged(rows, [by])
+    assert cube._names(by) in built._behind
+    expected = SalesCube.from_transactions(rows)
+    pd.testing.assert_frame_equal(built.rollup(by), expected.rollup(by), rtol=1e-9)
+    pd.testing.assert_frame_equal(built.totals(by), expected.totals(by), rtol=1e-9)
+
+
+def test_revenue_stats_match_transactions(rows):
+    # Chan et al. merged M2 against the standard deviation of the transactions
+    built = merged(rows, ['month', ['store_location', 'hour']])
+    stats = built.revenue_stats('month')
+    expected = rows.groupby(rows['transaction_day'].dt.month.rename('month'))['revenue'].agg(['sum', 'mean', 'std'])
+    pd.testing.assert_frame_equal(stats, expected, check_dtype=False, check_index_type=False, rtol=1e-9)
+
+    stats = built.revenue_stats(['store_location', 'hour'])
+    expected = rows.groupby(['store_location', 'hour'], observed=True)['revenue'].agg(['sum', 'mean', 'std'])
+    pd.testing.assert_frame_equal(stats, expected, check_dtype=False, rtol=1e-9)
+
+
+def test_rollups_behind_many_merges_are_merged(rows):
+    built = SalesCube.from_transactions(rows.iloc[:4000])
+    built.rollup(['store_location', 'hour'])
+    for low in range(4000, 5000, 10):
+        built.merge(SalesCube.from_transactions(rows.iloc[low:low + 10], row_offset=low))
+    totals, cubes = built._behind[('store_location', 'hour')]
+    assert len(cubes) < cube.MAX_BEHIND
+    pd.testing.assert_frame_equal(built.rollup(['store_location', 'hour']),
+                                  SalesCube.from_transactions(rows).rollup(['store_location', 'hour']), rtol=1e-9)
+
+
+def test_last_months_matches_cells(rows):
+    built = merged(rows, [['store_location', 'product_category', 'date']])
+    cells = SalesCube.from_transactions(rows).cells
+    start = cells['date'].max() - pd.DateOffset(months=6)
+    expected = built.rollup(['store_location', 'product_category'], cells[cells['date'] >= start])
+    pd.testing.assert_frame_equal(built.rollup_last_months(['store_location', 'product_category'], 6), expected,
+                                  check_index_type=False, rtol=1e-9)
+
+
+def test_selections_across_runs_match_cells(rows):
+    built = merged(rows)
+    assert len(built._runs) > 1
+    cells = SalesCube.from_transactions(rows).cells
+    for product in ['AAA new', 'Product 7']:
+        expected = cells[cells['product_detail'] == product].reset_index(drop=True)
+        pd.testing.assert_frame_equal(built.product_cells(product), expected, rtol=1e-9)
+    data_filter = filters.DataFilter(start=cells['date'].min() + pd.Timedelta(days=30), stores=['Astoria'])
+    expected = cells[(cells['date'] >= data_filter.start) & (cells['store_location'] == 'Astoria')]
+    pd.testing.assert_frame_equal(built.select(data_filter), expected.reset_index(drop=True), rtol=1e-9)
+
+
+def test_base_cube_is_untouched(rows):
+    base = SalesCube.from_transactions(rows.iloc[:4000])
+    cells = base.cells
+    totals = base.rollup('store_location')
+    base.copy().merge(SalesCube.from_transactions(rows.iloc[4000:], row_offset=4000))
+    assert base.cells is cells
+    assert base.rows == 4000
+    pd.testing.assert_frame_equal(base.rollup('store_location'), totals)
+    assert np.array_equal(base.cells['count'].to_numpy(), SalesCube.from_transactions(rows.iloc[:4000]).cells['count'])
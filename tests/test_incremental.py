@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import incremental
+from benchmark import make_transactions
+from transactions import TransactionTable
+
+SOURCE = 'coffee.csv'
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    monkeypatch.setattr(incremental, 'INCOMING_DIR', str(tmp_path))
+    monkeypatch.setattr(incremental, '_sources', {})
+    os.makedirs(incremental.batch_dir(SOURCE))
+    return TransactionTable.from_frame(make_transactions(2000), version='base')
+
+
+def write_batch(name, rows, seed):
+    path = os.path.join(incremental.batch_dir(SOURCE), name)
+    make_transactions(rows, seed=seed).to_csv(path, index=False)
+    return path
+
+
+def test_new_batches_are_appended_once(base):
+    write_batch('b1.csv', 50, seed=1)
+    table = incremental.refresh(SOURCE, base)
+    assert len(table) == 2050
+    assert incremental.refresh(SOURCE, base) is table
+
+    write_batch('b2.csv', 20, seed=2)
+    assert len(incremental.refresh(SOURCE, base)) == 2070
+
+
+def test_touched_batch_is_not_appended_again(base):
+    path = write_batch('b1.csv', 50, seed=1)
+    table = incremental.refresh(SOURCE, base)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    touched = incremental.refresh(SOURCE, base)
+    assert len(touched) == 2050
+    assert len(touched.cube.cells) == len(table.cube.cells)
+
+
+def test_rewritten_batch_rebuilds_from_base(base):
+    path = write_batch('b1.csv', 50, seed=1)
+    write_batch('b2.csv', 20, seed=2)
+    before = incremental.refresh(SOURCE, base)
+    write_batch('b1.csv', 30, seed=3)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+
+    table = incremental.refresh(SOURCE, base)
+    assert len(table) == 2050
+    assert table.version != before.version
+    assert table.cube.rows == 2050
+    assert table.cube.cells['count'].sum() == 2050
+
+
+def test_removed_batch_rebuilds_from_base(base):
+    path = write_batch('b1.csv', 50, seed=1)
+    write_batch('b2.csv', 20, seed=2)
+    assert len(incremental.refresh(SOURCE, base)) == 2070
+    os.remove(path)
+
+    table = incremental.refresh(SOURCE, base)
+    assert len(table) == 2020
+    assert table.cube.cells['count'].sum() == 2020
+
+
+def test_malformed_batch_is_retried_once_replaced(base):
+    path = os.path.join(incremental.batch_dir(SOURCE), 'b1.csv')
+    with open(path, 'w') as f:
+        f.write('not,a\nbatch,file\n')
+    assert len(incremental.refresh(SOURCE, base)) == 2000
+
+    write_batch('b1.csv', 50, seed=1)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert len(incremental.refresh(SOURCE, base)) == 2050
@@ -0,0 +1,62 @@
+import pandas as pd
+import pytest
+
+import streaming
+from benchmark import make_transactions
+from cube import SalesCube
+from transactions import TransactionTable, normalize_transactions
+
+
+@pytest.fixture(scope='module')
+def source(tmp_path_factory):
+    path = tmp_path_factory.mktemp('streaming') / 'coffee.csv'
+    make_transactions(6000, days=400).to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def full(source):
+    return SalesCube.from_transactions(normalize_transactions(pd.read_csv(source)))
+
+
+@pytest.fixture(scope='module')
+def streamed(source):
+    return streaming.stream_cube(source, chunksize=700)
+
+
+def test_rollups_match_full_cube(streamed, full):
+    assert streamed.rows == full.rows
+    assert not streamed.has_cells
+    for by in streaming.ROLLUPS:
+        pd.testing.assert_frame_equal(streamed.totals(by), full.totals(by), check_categorical=False, rtol=1e-9)
+    pd.testing.assert_frame_equal(streamed.revenue_stats('month'), full.revenue_stats('month'), rtol=1e-9)
+
+
+def test_daily_rollup_keeps_window(streamed, full):
+    by = ['store_location', 'product_category']
+    daily = streamed.totals(by + ['date'])
+    dates = full.rollup('date').index
+    assert daily.index.get_level_values('date').min() >= dates.max() - pd.DateOffset(months=streaming.WINDOW_MONTHS)
+    assert daily.index.get_level_values('date').min() > dates.min()
+    pd.testing.assert_frame_equal(streamed.rollup_last_months(by, streaming.WINDOW_MONTHS),
+                                  full.rollup_last_months(by, streaming.WINDOW_MONTHS),
+                                  check_categorical=False, rtol=1e-9)
+    with pytest.raises(ValueError):
+        streamed.rollup_last_months(by, streaming.WINDOW_MONTHS + 1)
+
+
+def test_cells_are_not_kept(streamed):
+    with pytest.raises(ValueError):
+        streamed.cells
+    with pytest.raises(ValueError):
+        streamed.rollup(['store_location', 'product_detail', 'date'])
+
+
+def test_appended_batch_is_merged_into_rollups(source, streamed):
+    batch = make_transactions(300, days=420, seed=3)
+    table = TransactionTable.from_cube(streamed.copy(), 'streamed').append(batch)
+    rows = pd.concat([pd.read_csv(source), batch.astype({'transaction_date': str})], ignore_index=True)
+    expected = SalesCube.from_transactions(normalize_transactions(rows))
+    for by in ['store_location', ['store_location', 'hour'], ['product_detail', 'store_location', 'hour']]:
+        pd.testing.assert_frame_equal(table.cube.rollup(by), expected.rollup(by), check_categorical=False)
+    assert streamed.rows == 6000
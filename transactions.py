@@ -0,0 +1,413 @@
+import itertools
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import anomaly
+import data_loader
+import filters
+import parallel
+import perf
+from cube import SalesCube
+
+# Columns every transaction source has to provide
+REQUIRED_COLUMNS = [
+    'transaction_id', 'transaction_date', 'transaction_time', 'transaction_qty',
+    'store_location', 'unit_price', 'product_category', 'product_detail',
+]
+CATEGORICAL_COLUMNS = ['store_location', 'product_category', 'product_type', 'product_detail', 'transaction_time']
+
+# Columns added by normalize_transactions, any source column of the same name
+# is replaced (except hour, which is kept when the source already has it)
+DERIVED_COLUMNS = ['transaction_timestamp', 'transaction_day', 'revenue', 'hour', 'month']
+
+
+# Versions for tables that don't come from a source file
+_frame_versions = itertools.count(1)
+
+# Filtered views kept per table, the least recently used ones are dropped
+MAX_FILTERED = 16
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _parse_repeated(values, parser):
+    # Dates and times repeat a lot, so parse each distinct value only once;
+    # categorical sources may carry categories no row uses, those are skipped
+    cat = pd.Categorical(values).remove_unused_categories()
+    parsed = parser(pd.Series(cat.categories))
+    return pd.Series(parsed.to_numpy()[cat.codes], index=values.index)
+
+
+def _to_timedelta(values):
+    return pd.to_timedelta(values.astype(str))
+
+
+@perf.traced
+def normalize_transactions(store_df):
+    # Build a new, typed frame from a raw transaction source; the input is never modified
+    missing = [col for col in REQUIRED_COLUMNS if col not in store_df.columns]
+    if missing:
+        raise SchemaError(f"Missing transaction columns: {', '.join(missing)}")
+    incomplete = [col for col in REQUIRED_COLUMNS if store_df[col].isna().any()]
+    if incomplete:
+        raise SchemaError(f"Null values in transaction columns: {', '.join(incomplete)}")
+
+    df = store_df.drop(columns=[col for col in DERIVED_COLUMNS if col in store_df.columns and col != 'hour'])
+    try:
+        dates = store_df['transaction_date']
+        if dates.dtype.kind != 'M':
+            dates = _parse_repeated(dates, pd.to_datetime)
+        times = _parse_repeated(store_df['transaction_time'], _to_timedelta)
+    except (ValueError, TypeError) as e:
+        raise SchemaError(f"Unparseable transaction date or time: {e}") from e
+
+    if (store_df['transaction_qty'] < 0).any() or (store_df['unit_price'] < 0).any():
+        raise SchemaError("Negative transaction_qty or unit_price")
+
+    df['transaction_date'] = dates
+    df['transaction_day'] = dates.dt.floor('D')
+    df['transaction_timestamp'] = df['transaction_day'] + times
+    df['transaction_qty'] = store_df['transaction_qty'].astype(np.int64)
+    df['unit_price'] = store_df['unit_price'].astype(np.float64)
+    df['revenue'] = df['transaction_qty'] * df['unit_price']
+    if 'hour' in store_df.columns:
+        df['hour'] = store_df['hour'].astype(np.int8)
+    else:
+        df['hour'] = (times.dt.total_seconds() // 3600).astype(np.int8)
+    df['month'] = dates.dt.month.astype(np.int8)
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(str).astype('category')
+    return df
+
+
+class _Part:
+    # One block of normalized rows with the indexes over it, shared by every
+    # table version that includes it, so appending never re-indexes old rows
+
+    def __init__(self, rows):
+        self.rows = rows
+        self._lock = threading.Lock()
+        self._row_index = None
+        self._product_index = None
+
+    def row_index(self):
+        # (store, time) index, built on the first filter
+        with self._lock:
+            if self._row_index is None:
+                with perf.stage('index_rows', rows=len(self.rows)):
+                    self._row_index = filters.SortedIndex(self.rows['store_location'],
+                                                          self.rows['transaction_timestamp'])
+            return self._row_index
+
+    def product_index(self):
+        # product_detail index, built on the first drill-down
+        with self._lock:
+            if self._product_index is None:
+                with perf.stage('index_product_rows', rows=len(self.rows)):
+                    self._product_index = filters.ValueIndex(self.rows['product_detail'])
+            return self._product_index
+
+
+class TransactionTable:
+    # Normalized transactions shared by every page and session. Pages only
+    # ever see shallow copies of the frame, so nothing they do leaks back.
+
+    def __init__(self, frame, version=None, cube=None):
+        # Appended batches are kept as separate parts (see append), filters
+        # and drill-downs select from every part; the whole frame is only
+        # concatenated when it is asked for
+        self._parts = [_Part(frame)] if frame is not None else []
+        self._frame = frame
+        self.version = version if version is not None else f"frame-{next(_frame_versions)}"
+        # Versions given by the caller identify the content (file hashes), the
+        # generated ones only mean something inside this process
+        self.persistent = version is not None
+        self._cube = cube
+        self._lock = threading.RLock()
+        self._monitor = None
+        self._maps = None
+        self._filtered = OrderedDict()
+
+    @classmethod
+    def from_frame(cls, store_df, version=None):
+        return cls(normalize_transactions(store_df), version)
+
+    @classmethod
+    def from_cube(cls, cube, version=None):
+        # Aggregates only, for sources too large to keep the rows in memory
+        return cls(None, version, cube)
+
+    @property
+    def has_rows(self):
+        return bool(self._parts)
+
+    def _rows(self):
+        with self._lock:
+            if self._frame is None:
+                if not self._parts:
+                    raise ValueError("Raw transactions are not kept for this table, only its aggregates")
+                self._frame = concat_frames([part.rows for part in self._parts], maps=self._category_maps())
+            return self._frame
+
+    def _row_parts(self):
+        if not self.has_rows:
+            raise ValueError("Raw transactions are not kept for this table, only its aggregates")
+        return self._parts
+
+    def _category_maps(self):
+        # Merged category dictionaries of the parts, so rows selected from
+        # several parts are concatenated without merging them again
+        with self._lock:
+            if self._maps is None:
+                self._maps = category_maps([part.rows for part in self._row_parts()])
+            return self._maps
+
+    @property
+    def frame(self):
+        return self._rows().copy(deep=False)
+
+    @property
+    def cube(self):
+        with self._lock:
+            if self._cube is None:
+                rows = self._rows()
+                with perf.stage('build_cube', rows=len(rows)):
+                    self._cube = parallel.build_cube(rows)
+            return self._cube
+
+    @property
+    def monitor(self):
+        # Revenue statistics and anomalies (anomaly.RevenueMonitor), seeded
+        # from the cube once, then carried forward by append
+        with self._lock:
+            if self._monitor is None:
+                cube = self.cube
+                with perf.stage('seed_monitor', rows=cube.rows):
+                    self._monitor = anomaly.RevenueMonitor.from_cube(cube)
+            return self._monitor
+
+    def append(self, batch, version=None):
+        # New table with a batch of raw transactions added; only the batch is
+        # normalized and aggregated, the existing rows and cells are reused
+        rows = normalize_transactions(batch)
+        table = TransactionTable(None, version, self.cube.copy().update(rows))
+        if self.has_rows:
+            # Log-structured: the batch absorbs the newest parts while they
+            # are no larger than it, so there are O(log n) parts and every
+            # row is re-concatenated and re-indexed O(log n) times
+            parts, block = list(self._parts), rows
+            while parts and len(parts[-1].rows) <= len(block):
+                block = concat_frames([parts.pop().rows, block])
+            table._parts = parts + [_Part(block)]
+            with self._lock:
+                maps = self._maps
+            if maps is not None:
+                table._maps = extend_category_maps(maps, len(parts), block)
+        table.persistent = self.persistent and version is not None
+        with self._lock:
+            monitor = self._monitor
+        if monitor is not None:
+            with perf.stage('update_monitor', rows=len(rows)):
+                table._monitor = monitor.copy().observe_rows(rows)
+        return table
+
+    def filter(self, data_filter):
+        # View of the transactions passing a filters.DataFilter, cached per
+        # filter. Cells are sliced right away, rows only when a page needs them.
+        if data_filter is None or data_filter.is_empty:
+            return self
+        with self._lock:
+            table = self._filtered.get(data_filter.key)
+            if table is not None:
+                self._filtered.move_to_end(data_filter.key)
+                return table
+            cube = self.cube
+            with perf.stage('filter_cells', rows=cube.rows):
+                cells = cube.select(data_filter)
+            table = FilteredTable(self, data_filter, SalesCube(cells, int(cells['count'].sum())))
+            self._filtered[data_filter.key] = table
+            while len(self._filtered) > MAX_FILTERED:
+                self._filtered.popitem(last=False)
+            return table
+
+    def select_rows(self, data_filter):
+        parts = self._row_parts()
+        indexes = [part.row_index() for part in parts]
+        with perf.stage('filter_rows', rows=len(self)):
+            return concat_frames([filters.select(part.rows, index, data_filter)
+                                  for part, index in zip(parts, indexes)], maps=self._category_maps())
+
+    def product_cells(self, product):
+        # Cube cells of one product_detail (see SalesCube.product_cells)
+        return self.cube.product_cells(product)
+
+    def product_rows(self, product, columns=None):
+        # Transactions of one product_detail, in table order and labelled
+        # with their position in the table; only the given columns are gathered
+        selected, offset = [], 0
+        for part in self._row_parts():
+            positions = part.product_index().positions(product)
+            rows = part.rows if columns is None else part.rows[columns]
+            selected.append(rows.take(positions).set_axis(positions + offset))
+            offset += len(part.rows)
+        return concat_frames(selected, ignore_index=False, maps=self._category_maps())
+
+    def products(self):
+        # Every product_detail that has transactions in this table
+        return self.cube.rollup('product_detail').index
+
+    def __len__(self):
+        return sum(len(part.rows) for part in self._parts) if self._parts else self.cube.rows
+
+    def memory_usage(self):
+        if not self._parts:
+            return self.cube.memory_usage()
+        return self._rows().memory_usage(index=True, deep=True)
+
+
+class FilteredTable(TransactionTable):
+    # Transactions of a parent table that pass a filter, with their own version
+    # so cached figures and KPIs are kept apart from the unfiltered ones
+
+    def __init__(self, parent, data_filter, cube):
+        super().__init__(None, f"{parent.version}:{data_filter.key}", cube)
+        self.persistent = parent.persistent
+        self.parent = parent
+        self.data_filter = data_filter
+
+    @property
+    def has_rows(self):
+        return self.parent.has_rows
+
+    @property
+    def monitor(self):
+        # Kept for the whole table; pages pick the filtered stores and dates
+        return self.parent.monitor
+
+    def _rows(self):
+        with self._lock:
+            if self._frame is None:
+                self._frame = self.parent.select_rows(self.data_filter)
+            return self._frame
+
+    def _row_parts(self):
+        # The selected rows as one part of their own
+        with self._lock:
+            if not self._parts:
+                self._parts = [_Part(self._rows())]
+            return self._parts
+
+    def filter(self, data_filter):
+        raise TypeError("Filter the parent table instead")
+
+    def append(self, batch, version=None):
+        raise TypeError("Append to the parent table instead")
+
+    def __len__(self):
+        return self.cube.rows
+
+
+def category_maps(frames):
+    # Sorted union of the category dictionaries of every frame (as
+    # astype('category') would make it) and, per frame, where each of its
+    # categories is in the union; None for frames that already have the union
+    maps = {}
+    for col in CATEGORICAL_COLUMNS:
+        if not all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            continue
+        categories = frames[0][col].cat.categories
+        for frame in frames[1:]:
+            if not frame[col].cat.categories.equals(categories):
+                categories = categories.union(frame[col].cat.categories)
+        maps[col] = (pd.CategoricalDtype(categories),
+                     [None if frame[col].cat.categories.equals(categories)
+                      else categories.get_indexer(frame[col].cat.categories) for frame in frames])
+    return maps
+
+
+def extend_category_maps(maps, kept, frame):
+    # category_maps of the first `kept` frames plus `frame`, reusing the merged
+    # dictionaries (and their hash tables); None when `frame` brings new categories
+    extended = {}
+    for col, (dtype, positions) in maps.items():
+        if col not in frame.columns or not isinstance(frame[col].dtype, pd.CategoricalDtype):
+            return None
+        indexer = dtype.categories.get_indexer(frame[col].cat.categories)
+        if (indexer < 0).any():
+            return None
+        same = len(indexer) == len(dtype.categories) and (indexer == np.arange(len(indexer))).all()
+        extended[col] = (dtype, positions[:kept] + [None if same else indexer])
+    return extended
+
+
+def concat_frames(frames, ignore_index=True, maps=None):
+    # Concatenate normalized frames, recoding the categoricals onto the merged
+    # dictionaries first instead of falling back to object columns. `maps`
+    # (from category_maps) can come from other frames with the same categories,
+    # e.g. the parts that `frames` were selected from.
+    if len(frames) == 1:
+        return frames[0]
+    frames = list(frames)
+    for col, (dtype, positions) in (category_maps(frames) if maps is None else maps).items():
+        if col not in frames[0].columns:
+            continue
+        for i, frame in enumerate(frames):
+            if positions[i] is not None:
+                codes = frame[col].cat.codes.to_numpy()
+                codes = np.where(codes >= 0, positions[i][codes], -1)
+                frames[i] = frame.assign(**{col: pd.Categorical.from_codes(codes, dtype=dtype, validate=False)})
+    return pd.concat(frames, ignore_index=ignore_index)
+
+
+# Normalized tables per source path, rebuilt when the source version changes
+_tables = {}
+# Tables built on the fly for plain DataFrames handed to the page functions
+_adhoc_tables = {}
+_lock = threading.RLock()
+
+
+def load_table(path):
+    store_df = data_loader.load_frame(path)
+    version = data_loader.data_version(path)
+    with _lock:
+        table = _tables.get(path)
+        if table is None or table.version != version:
+            table = TransactionTable.from_frame(store_df, version)
+            _tables[path] = table
+        return table
+
+
+def _forget(key, ref):
+    with _lock:
+        if key in _adhoc_tables and _adhoc_tables[key][0] is ref:
+            del _adhoc_tables[key]
+
+
+def as_table(store_df):
+    if isinstance(store_df, TransactionTable):
+        return store_df
+    key = id(store_df)
+    with _lock:
+        entry = _adhoc_tables.get(key)
+        if entry is not None and entry[0]() is store_df:
+            return entry[1]
+        table = TransactionTable.from_frame(store_df)
+        _adhoc_tables[key] = (weakref.ref(store_df, lambda ref, key=key: _forget(key, ref)), table)
+        return table
+
+
+def memory_report(store_df, table):
+    # Per-column bytes of the raw source frame next to the normalized table
+    report = pd.DataFrame({
+        'raw_bytes': store_df.memory_usage(index=True, deep=True),
+        'normalized_bytes': table.memory_usage(),
+    })
+    report.loc['total'] = report.sum()
+    return report